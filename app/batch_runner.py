@@ -0,0 +1,170 @@
+import logging
+
+import instrumentation
+import journal
+from command_parser import (OP_PLACE, OP_MOVE, OP_LEFT, OP_RIGHT, OP_REPORT, OP_EXIT, OP_GOTO, OP_DISTANCE, OP_STATS,
+                            OP_REPEAT, compile_command, compile_lines, compile_program)
+from macros import move_forward, run_repeat
+from path_planner import goto
+
+logger = logging.getLogger(__name__)
+
+def _place(board, robot, x, y, f):
+    return robot.place(x, y, f, board)
+
+def _move(board, robot, x, y, f):
+    if x is None:
+        robot.move()
+    else:
+        move_forward(robot, x)
+
+def _left(board, robot, x, y, f):
+    robot.rotate('LEFT')
+
+def _right(board, robot, x, y, f):
+    robot.rotate('RIGHT')
+
+def _report(board, robot, x, y, f):
+    return robot.report()
+
+def _exit(board, robot, x, y, f):
+    return 'EXIT'
+
+def _goto(board, robot, x, y, f):
+    return goto(robot, x, y, f)
+
+def _distance(board, robot, x, y, f):
+    distance = str(board.distance(robot.x_axis, robot.y_axis, x, y))
+    logger.info("Distance to [%s,%s] = %s", x, y, distance)
+    return distance
+
+def _stats(board, robot, x, y, f):
+    stats = instrumentation.stats_line()
+    logger.info("Stats: %s", stats)
+    return stats
+
+def _repeat(board, robot, x, y, f):
+    return list(run_repeat(x, y, board, robot))
+
+# opcode -> handler(board, robot, x, y, f) shared by start_app.run_command and execute. Handlers return the command
+# output, a list of outputs for REPEAT. instrumentation.enable swaps timed wrappers in and out of this table.
+COMMAND_HANDLERS = {
+    OP_PLACE: _place,
+    OP_MOVE: _move,
+    OP_LEFT: _left,
+    OP_RIGHT: _right,
+    OP_REPORT: _report,
+    OP_EXIT: _exit,
+    OP_GOTO: _goto,
+    OP_DISTANCE: _distance,
+    OP_STATS: _stats,
+    OP_REPEAT: _repeat,
+}
+
+# commands that also run before the robot is placed
+UNPLACED_OPCODES = frozenset((OP_PLACE, OP_EXIT, OP_STATS, OP_REPEAT))
+
+# commands whose handler result is an output line
+OUTPUT_OPCODES = frozenset((OP_REPORT, OP_DISTANCE, OP_STATS))
+
+def compile_line(line):
+    """
+    Compiles one command line into an instruction with the command_parser grammar used by start_app.run_command
+
+    Args:
+        line (str): command line, trailing newline is ignored
+
+    Returns:
+        tuple: (opcode, x, y, f) instruction or None if the line is blank or invalid
+    """
+    return compile_command(line.rstrip('\r\n'))[0]
+
+def compile_commands(lines):
+    """
+    Compiles an iterable of command lines into instructions, dropping no-op lines.
+    A REPEAT block may span several lines.
+
+    Args:
+        lines (iterable): command strings, e.g. an open file
+
+    Yields:
+        tuple: (opcode, x, y, f) instruction
+    """
+    for instruction, error in compile_lines(lines):
+        if instruction is not None:
+            yield instruction
+
+def execute(instructions, board, robot, record=True):
+    """
+    Runs compiled instructions against a board and robot through COMMAND_HANDLERS, yielding only REPORT, DISTANCE
+    and STATS outputs. Stops at the first EXIT instruction. Instructions are recorded in the board's open journals.
+
+    Args:
+        instructions (iterable): (opcode, x, y, f) instructions
+        board (Board): Board object
+        robot (Robot): Robot object
+        record (bool, optional): record the instructions in the open journals. Defaults to True,
+            REPEAT bodies run without it since the REPEAT itself is recorded.
+
+    Yields:
+        str: REPORT output in x,y,f format, DISTANCE or STATS output
+    """
+    record = journal.record if record and journal.writers else None
+    handlers = COMMAND_HANDLERS
+    for instruction in instructions:
+        if record is not None:
+            record(instruction, board, robot)
+        opcode, x, y, f = instruction
+        if opcode == OP_EXIT:
+            return
+        if robot.board is None and opcode not in UNPLACED_OPCODES: # commands are discarded until a valid PLACE
+            continue
+        result = handlers[opcode](board, robot, x, y, f)
+        if opcode in OUTPUT_OPCODES:
+            yield result
+        elif opcode == OP_REPEAT:
+            yield from result
+
+def iter_reports(lines, board, robot):
+    """
+    Runs a stream of commands against a board and robot, yielding only REPORT, DISTANCE and STATS outputs.
+    Stops at the first EXIT command.
+
+    Args:
+        lines (iterable): command strings, e.g. an open file
+        board (Board): Board object
+        robot (Robot): Robot object
+
+    Yields:
+        str: REPORT output in x,y,f format, DISTANCE or STATS output
+    """
+    return execute(compile_commands(lines), board, robot)
+
+def run_program(source, board, robot):
+    """
+    Runs a program text against a board and robot. The compiled program is cached by source,
+    so replaying the same scenario many times parses it only once.
+
+    Args:
+        source (str): program text, one command per line
+        board (Board): Board object
+        robot (Robot): Robot object
+
+    Returns:
+        list: REPORT outputs in x,y,f format, DISTANCE and STATS outputs
+    """
+    return list(execute(compile_program(source).instructions, board, robot))
+
+def run_batch(lines, board, robot):
+    """
+    Runs a stream of commands against a board and robot
+
+    Args:
+        lines (iterable): command strings, e.g. an open file
+        board (Board): Board object
+        robot (Robot): Robot object
+
+    Returns:
+        list: REPORT outputs in x,y,f format, DISTANCE and STATS outputs
+    """
+    return list(iter_reports(lines, board, robot))
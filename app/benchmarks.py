@@ -0,0 +1,205 @@
+import argparse
+import json
+import logging
+import platform
+import sys
+import time
+
+from batch_runner import compile_line
+from board import Board
+from robot import Robot
+from start_app import run_command, set_quiet_mode
+
+logger = logging.getLogger(__name__)
+
+PARSE_COMMANDS = ('PLACE 1,2,EAST', 'MOVE', 'LEFT', 'RIGHT', 'REPORT', 'move', 'Place 0 , 0 , north', 'invalid')
+
+def _measure(function, ops, repeat):
+    """
+    Runs function repeat times and keeps the fastest run
+
+    Args:
+        function (callable): benchmark body doing ops operations
+        ops (int): number of operations done by one call of function
+        repeat (int): number of runs
+
+    Returns:
+        dict: ops, best time in seconds and ops per second
+    """
+    best = None
+    for count in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return {"ops": ops, "seconds": best, "ops_per_sec": ops / best if best else None}
+
+def bench_run_command(ops):
+    """
+    run_command throughput for a mix of valid and invalid commands
+    """
+    board = Board(5)
+    robot = Robot()
+    commands = [PARSE_COMMANDS[index % len(PARSE_COMMANDS)] for index in range(ops)]
+    def body():
+        for command in commands:
+            run_command(command, board, robot)
+    return body
+
+def bench_compile_line(ops):
+    """
+    batch_runner.compile_line parsing throughput
+    """
+    commands = [PARSE_COMMANDS[index % len(PARSE_COMMANDS)] for index in range(ops)]
+    def body():
+        for command in commands:
+            compile_line(command)
+    return body
+
+def bench_move(ops, size=100):
+    """
+    Robot.move throughput, walking back and forth along the bottom row
+    """
+    board = Board(size)
+    robot = Robot()
+    robot.place(0, 0, 'EAST', board)
+    def body():
+        for count in range(ops):
+            if not robot.move(): # turn around at the edge
+                robot.facing = 'WEST' if robot.facing == 'EAST' else 'EAST'
+    return body
+
+def bench_rotate(ops):
+    """
+    Robot.rotate throughput
+    """
+    board = Board(5)
+    robot = Robot()
+    robot.place(0, 0, 'NORTH', board)
+    def body():
+        for count in range(ops):
+            robot.rotate('LEFT' if count & 1 else 'RIGHT')
+    return body
+
+def bench_obstructions(ops, size, filled):
+    """
+    add_obstruction/remove_obstruction throughput on a board that already holds filled obstructions.
+    The filled obstructions take the lowest tile keys, the benchmarked tiles are picked from the empty ones after them.
+    """
+    board = Board(size)
+    for index in range(filled):
+        board.add_obstruction(index % size, index // size)
+    empty = size * size - filled
+    keys = [filled + (index * 7919) % empty for index in range(ops)]
+    tiles = [(key % size, key // size) for key in keys]
+    def body():
+        for x, y in tiles:
+            board.add_obstruction(x, y)
+            board.remove_obstruction(x, y)
+        if len(board.occupancy) != filled:
+            raise RuntimeError(f"Board holds {len(board.occupancy)} obstructions instead of {filled}.")
+    return body
+
+def bench_board_state(ops, size):
+    """
+    get_board_state cost for one board size
+    """
+    board = Board(size)
+    board.add_obstruction(0, 0)
+    def body():
+        for count in range(ops):
+            board.get_board_state()
+    return body
+
+def bench_report(ops, size):
+    """
+    Robot.report cost for one board size
+    """
+    board = Board(size)
+    robot = Robot()
+    robot.place(0, 0, 'NORTH', board)
+    def body():
+        for count in range(ops):
+            robot.report()
+    return body
+
+def run_benchmarks(scale=1.0, repeat=3):
+    """
+    Runs every benchmark
+
+    Args:
+        scale (float, optional): multiplier for the number of operations. Defaults to 1.0.
+        repeat (int, optional): runs per benchmark, the fastest is kept. Defaults to 3.
+
+    Returns:
+        dict: machine readable results
+    """
+    def ops(count):
+        return max(int(count * scale), 1)
+
+    cases = [
+        ("run_command", {}, ops(100000), bench_run_command),
+        ("compile_line", {}, ops(100000), bench_compile_line),
+        ("robot_move", {"size": 100}, ops(100000), lambda count: bench_move(count, 100)),
+        ("robot_rotate", {}, ops(100000), bench_rotate),
+    ]
+    for filled in (0, 1000, 100000):
+        cases.append(("add_remove_obstruction", {"size": 1000, "filled": filled}, ops(50000),
+                      lambda count, filled=filled: bench_obstructions(count, 1000, filled)))
+    for size in (10, 100, 1000):
+        cases.append(("get_board_state", {"size": size}, ops(100000 // (size * size) + 1),
+                      lambda count, size=size: bench_board_state(count, size)))
+        cases.append(("report", {"size": size}, ops(10000), lambda count, size=size: bench_report(count, size)))
+
+    results = []
+    for name, params, count, factory in cases:
+        result = {"name": name, "params": params}
+        result.update(_measure(factory(count), count, repeat))
+        results.append(result)
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "scale": scale,
+        "results": results,
+    }
+
+def compare_results(baseline, current):
+    """
+    Compares two run_benchmarks results
+
+    Args:
+        baseline (dict): older results
+        current (dict): newer results
+
+    Returns:
+        list: (name, params, speedup) tuples where speedup > 1 means current is faster
+    """
+    baseline_rates = {(result["name"], json.dumps(result["params"], sort_keys=True)): result["ops_per_sec"] for result in baseline["results"]}
+    comparison = []
+    for result in current["results"]:
+        old_rate = baseline_rates.get((result["name"], json.dumps(result["params"], sort_keys=True)))
+        if old_rate and result["ops_per_sec"]:
+            comparison.append((result["name"], result["params"], result["ops_per_sec"] / old_rate))
+    return comparison
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Toy robot simulator benchmarks")
+    parser.add_argument('--scale', type=float, default=1.0, help="multiplier for the number of operations per benchmark")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per benchmark, the fastest is kept")
+    parser.add_argument('--output', metavar='FILE', help="write JSON results to FILE instead of stdout")
+    parser.add_argument('--compare', metavar='FILE', help="print speedups against JSON results saved in FILE")
+    args = parser.parse_args()
+    set_quiet_mode()
+    report = run_benchmarks(args.scale, args.repeat)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        for name, params, speedup in compare_results(baseline, report):
+            print(f"{name} {params}: {speedup:.2f}x", file=sys.stderr)
@@ -1,16 +1,74 @@
 import logging
+from collections import namedtuple
+from operator import index
 
-logger = logging.getLogger() 
+from distance_field import DistanceFieldCache, MAX_FIELD_TILES, search_distance
+from macros import LineIndex
+from obstacle_map import read_obstacle_map
+from occupancy import choose_occupancy, maybe_promote, numpy
+from spatial_index import SpatialIndex
+
+logger = logging.getLogger(__name__)
+
+# invalid cells quoted in the bulk load warning
+INVALID_SAMPLE_SIZE = 5
+
+# added: newly occupied tiles, occupied: tiles that were already occupied (or repeated), invalid: cells outside the board
+LoadResult = namedtuple('LoadResult', ['added', 'occupied', 'invalid'])
 
 class Board:
     """
     A simple Board Class
     """
-    def __init__(self, size):
-        self.size = size
+    def __init__(self, size, height=None, occupancy=None):
+        """
+        Args:
+            size (int): board width, and height when height is not given
+            height (int, optional): board height of rectangular boards. Defaults to size.
+            occupancy (optional): occupancy index of a subclass, e.g. ChunkedOccupancy. Defaults to choose_occupancy.
+        """
+        height = size if height is None else height
+        self.size = size if size == height else None
+        self.width = size
+        self.height = height
         self.max_x = size - 1
-        self.max_y = size - 1
-        self.obstructions = []
+        self.max_y = height - 1
+        self.occupancy = choose_occupancy(size, height) if occupancy is None else occupancy
+        self._grid = None # persistent bytearray rows, top row first. Built on first state request.
+        self.version = 0 # bumped on every occupancy change so caches can tell when the board changed
+        self.tile_listeners = [] # callbacks (x, y, occupied) kept in sync with every occupancy change
+        self._distance_fields = None # DistanceFieldCache, created on first distance query
+        self._spatial_index = None # SpatialIndex, created on first neighbourhood query
+        self._line_index = None # LineIndex, created on first MOVE n
+
+    @property
+    def obstructions(self):
+        """
+        Occupied tiles of the board in [x,y] format. Built from the occupancy index on each access.
+
+        Returns:
+            list: list of [x,y] lists
+        """
+        return [[x,y] for x,y in self.occupancy]
+
+    def _xy_in_bounds(self,x,y):
+        """
+        Silent bounds check used before touching the occupancy index. Int-like values (e.g. numpy integers) are
+        accepted like _xy_is_valid does.
+
+        Args:
+            x (int): x axis value
+            y (int): y axis value
+
+        Returns:
+            Bool: True or False
+        """
+        if type(x) is not int or type(y) is not int:
+            try:
+                x, y = index(x), index(y)
+            except TypeError:
+                return False
+        return 0 <= x <= self.max_x and 0 <= y <= self.max_y
 
     def _xy_is_valid(self,x,y):
         """
@@ -48,10 +106,10 @@ class Board:
         Returns:
             Bool: True or False
         """
-        if [x,y] not in self.obstructions:
+        if not self._xy_in_bounds(x,y) or not self.occupancy.contains(x,y):
             return True
         else:
-            logger.error(f"Tile [{x},{y}] is not empty.")
+            logger.error("Tile [%s,%s] is not empty.", x, y)
             return False
 
     def add_obstruction(self,x,y):
@@ -66,7 +124,11 @@ class Board:
             Bool: True or False
         """
         if self._xy_is_valid(x,y) and self._xy_is_empty(x,y):
-            self.obstructions.append([x,y])
+            x, y = index(x), index(y) # int-like values are stored as plain ints
+            self.occupancy.add(x,y)
+            self.occupancy = maybe_promote(self.occupancy)
+            self._tile_changed(x,y,1)
+            self.version += 1
             return True
         else:
             return False
@@ -82,12 +144,198 @@ class Board:
         Returns:
             Bool: True or False
         """
-        if [x,y] in self.obstructions:
-            self.obstructions.remove([x,y])
+        if self._xy_in_bounds(x,y) and self.occupancy.contains(x,y):
+            self.occupancy.discard(x,y)
+            self._tile_changed(x,y,0)
+            self.version += 1
             return True
         else:
             return False
 
+    def load_obstructions(self, cells):
+        """
+        Adds many obstructions at once. Cells are validated together, the occupancy index is filled in one pass
+        and invalid cells are reported in a single warning instead of one error each.
+
+        Args:
+            cells (iterable): (x, y) pairs, or a NumPy integer array of shape (n, 2)
+
+        Returns:
+            LoadResult: (added, occupied, invalid) counts
+        """
+        if numpy is not None and isinstance(cells, numpy.ndarray):
+            if cells.ndim != 2 or cells.shape[1] != 2:
+                raise ValueError("Expected an array of shape (n, 2).")
+            return self._load_arrays(cells[:, 0], cells[:, 1], 0)
+        width, max_x, max_y = self.width, self.max_x, self.max_y
+        keys = []
+        invalid = []
+        for x, y in cells:
+            if type(x) is not int or type(y) is not int: # int-like values (e.g. numpy integers) like add_obstruction
+                try:
+                    x, y = index(x), index(y)
+                except TypeError:
+                    invalid.append((x, y))
+                    continue
+            if 0 <= x <= max_x and 0 <= y <= max_y:
+                keys.append(y * width + x)
+            else:
+                invalid.append((x, y))
+        return self._load_keys(keys, 0, len(invalid), invalid[:INVALID_SAMPLE_SIZE])
+
+    def load_obstruction_mask(self, mask):
+        """
+        Adds an obstruction for every truthy cell of a 2D mask. The first mask row is the top row and
+        the last mask row is y = 0. Mask cells falling outside the board are counted as invalid.
+
+        Args:
+            mask (numpy.ndarray or list): boolean array of shape (rows, columns), or a list of rows
+                (e.g. bytes or lists of 0/1). Rows may have different lengths.
+
+        Returns:
+            LoadResult: (added, occupied, invalid) counts
+        """
+        if numpy is None:
+            rows = len(mask)
+            keys = []
+            invalid = []
+            for row_index, row in enumerate(mask):
+                y = rows - 1 - row_index
+                for x, value in enumerate(row):
+                    if not value:
+                        continue
+                    if x <= self.max_x and y <= self.max_y:
+                        keys.append(y * self.width + x)
+                    else:
+                        invalid.append((x, y))
+            return self._load_keys(keys, 0, len(invalid), invalid[:INVALID_SAMPLE_SIZE])
+        if not isinstance(mask, numpy.ndarray):
+            rows = mask
+            mask = numpy.zeros((len(rows), max((len(row) for row in rows), default=0)), dtype=bool)
+            for row_index, row in enumerate(rows):
+                values = numpy.frombuffer(row, dtype=numpy.uint8) if isinstance(row, (bytes, bytearray)) else row
+                mask[row_index, :len(row)] = values
+        if mask.ndim != 2:
+            raise ValueError("Expected a 2D mask.")
+        row_indexes, xs = numpy.nonzero(mask)
+        return self._load_arrays(xs, mask.shape[0] - 1 - row_indexes, 0, unique=True)
+
+    def load_obstruction_map(self, path):
+        """
+        Adds the obstructions of a map file, either a text map ('#' or '1' blocked, '.' or '0' free, one line
+        per row) or a PGM image (dark pixels blocked). The last row of the map is y = 0.
+
+        Args:
+            path (str): map file path
+
+        Returns:
+            LoadResult: (added, occupied, invalid) counts, invalid includes unknown map characters
+        """
+        mask, unknown = read_obstacle_map(path)
+        if unknown:
+            logger.warning("Map %s has %s unknown characters. They are treated as free tiles.", path, unknown)
+        result = self.load_obstruction_mask(mask)
+        return result._replace(invalid=result.invalid + unknown)
+
+    def _load_arrays(self, xs, ys, occupied, unique=False):
+        """
+        Vectorized validation of NumPy coordinate arrays used by the bulk loaders. Repeated cells are dropped
+        unless unique says the arrays have none (e.g. coordinates taken from a mask).
+
+        Returns:
+            LoadResult: (added, occupied, invalid) counts
+        """
+        xs = numpy.asarray(xs, dtype=numpy.int64)
+        ys = numpy.asarray(ys, dtype=numpy.int64)
+        valid = (xs >= 0) & (xs <= self.max_x) & (ys >= 0) & (ys <= self.max_y)
+        invalid_count = int(len(valid) - numpy.count_nonzero(valid))
+        sample = []
+        if invalid_count:
+            sample = list(zip(xs[~valid][:INVALID_SAMPLE_SIZE].tolist(), ys[~valid][:INVALID_SAMPLE_SIZE].tolist()))
+        keys = ys[valid] * self.width + xs[valid]
+        if not unique and len(keys):
+            keys.sort()
+            repeated = len(keys)
+            keys = keys[numpy.concatenate(([True], keys[1:] != keys[:-1]))]
+            occupied += repeated - len(keys)
+        return self._load_keys(keys, occupied, invalid_count, sample)
+
+    def _load_keys(self, keys, occupied, invalid, sample):
+        """
+        Fills the occupancy index with validated packed keys (y * width + x) and reports invalid cells once
+
+        Returns:
+            LoadResult: (added, occupied, invalid) counts
+        """
+        if invalid:
+            logger.warning("Skipped %s cells outside the board, e.g. %s.", invalid, sample)
+        if self._distance_fields is not None: # cheaper to rebuild than to update per tile
+            self._distance_fields.clear()
+        new_keys = None
+        if self.tile_listeners: # listeners still get one call per newly occupied tile
+            width = self.width
+            contains = self.occupancy.contains
+            unique_keys = keys.tolist() if numpy is not None and isinstance(keys, numpy.ndarray) else dict.fromkeys(keys)
+            new_keys = [key for key in unique_keys if not contains(key % width, key // width)]
+        requested = len(keys)
+        added = self.occupancy.add_keys(keys)
+        self.occupancy = maybe_promote(self.occupancy)
+        if added:
+            self._grid = None # rebuilt on the next state request
+            self.version += 1
+            if new_keys is not None:
+                for key in new_keys:
+                    for listener in self.tile_listeners:
+                        listener(key % self.width, key // self.width, 1)
+        return LoadResult(added, occupied + requested - added, invalid)
+
+    def _tile_changed(self,x,y,value):
+        """
+        Updates one tile of the persistent grid if it was already built and notifies tile listeners
+
+        Args:
+            x (int): x axis value
+            y (int): y axis value
+            value (int): 1 if occupied, 0 if empty
+        """
+        if self._grid is not None:
+            self._grid[self.max_y - y][x] = value
+        for listener in self.tile_listeners:
+            listener(x, y, value)
+
+    def sync_tiles(self, vacated, taken):
+        """
+        Brings the grid and tile listeners up to date after tiles were changed directly in the occupancy index
+        (e.g. by step_engine).
+        Vacated tiles are applied before taken ones, so a tile in both ends up occupied.
+
+        Args:
+            vacated (iterable): packed keys (y * width + x) of tiles that were emptied
+            taken (iterable): packed keys of tiles that were occupied
+        """
+        if self._grid is None and not self.tile_listeners:
+            return
+        width = self.max_x + 1
+        for key in vacated:
+            self._tile_changed(key % width, key // width, 0)
+        for key in taken:
+            self._tile_changed(key % width, key // width, 1)
+
+    def _get_grid(self):
+        """
+        Returns the persistent grid, building it from the occupancy index the first time.
+        After that it is kept up to date by add_obstruction/remove_obstruction.
+
+        Returns:
+            list: list of bytearray rows, top row first
+        """
+        if self._grid is None:
+            grid = [bytearray(self.max_x + 1) for count in range(self.max_y + 1)]
+            for x_axis, y in self.occupancy:
+                grid[self.max_y - y][x_axis] = 1
+            self._grid = grid
+        return self._grid
+
     def get_board_state(self):
         """
         Returns the state of the board in list format. It can be parsed to display the state of the board via print.
@@ -95,9 +343,93 @@ class Board:
         Returns:
             list: list of lists containing data state of the board
         """
-        board_state = [[0 for count in range(int(self.size))] for count in range(int(self.size))]
-        for obj in self.obstructions:
-            x_axis = obj[0]
-            y_axis = self.max_y - obj[1]
-            board_state[y_axis][x_axis] = 1
-        return board_state
\ No newline at end of file
+        return [list(row) for row in self._get_grid()]
+
+    def get_board_rows(self):
+        """
+        Compact version of get_board_state. Each row is a bytes object of 0/1 values.
+
+        Returns:
+            list: list of bytes rows, top row first
+        """
+        return [bytes(row) for row in self._get_grid()]
+
+    def get_board_window(self, x, y, radius):
+        """
+        Returns the state of the tiles around x,y only, clipped to the board. Same format as get_board_state.
+
+        Args:
+            x (int): x axis value of the window center
+            y (int): y axis value of the window center
+            radius (int): number of tiles to include on each side of the center
+
+        Returns:
+            list: list of lists containing data state of the window, top row first
+        """
+        grid = self._get_grid()
+        min_x = max(x - radius, 0)
+        max_x = min(x + radius, self.max_x)
+        top_row = self.max_y - min(y + radius, self.max_y)
+        bottom_row = self.max_y - max(y - radius, 0)
+        return [list(grid[row][min_x:max_x + 1]) for row in range(top_row, bottom_row + 1)]
+
+    def distance_field(self, targets):
+        """
+        Returns the cached distance field for a set of target tiles. Fields are kept up to date as tiles change.
+
+        Args:
+            targets (iterable): (x, y) target tiles
+
+        Returns:
+            DistanceField: distance field of the targets
+        """
+        if self._distance_fields is None:
+            self._distance_fields = DistanceFieldCache(self)
+        return self._distance_fields.get(targets)
+
+    def spatial_index(self):
+        """
+        Returns the board's spatial index for range, nearest and rectangle count queries, building it on first use.
+        It is kept in sync with every occupancy change.
+
+        Returns:
+            SpatialIndex: spatial index of the occupied tiles
+        """
+        if self._spatial_index is None:
+            self._spatial_index = SpatialIndex(self)
+        return self._spatial_index
+
+    def line_index(self):
+        """
+        Returns the board's per-row and per-column index of occupied tiles used by MOVE n, building it on first use.
+        It is kept in sync with every occupancy change.
+
+        Returns:
+            LineIndex: line index of the occupied tiles
+        """
+        if self._line_index is None:
+            self._line_index = LineIndex(self)
+        return self._line_index
+
+    def distance(self, from_x, from_y, to_x, to_y):
+        """
+        Number of MOVE steps between two tiles around the occupied tiles. An occupied start tile
+        (e.g. the robot asking) is left through its nearest free neighbour. Boards with more than MAX_FIELD_TILES
+        tiles use a bounded search instead of a cached distance field.
+
+        Args:
+            from_x (int): start x axis value
+            from_y (int): start y axis value
+            to_x (int): target x axis value
+            to_y (int): target y axis value
+
+        Returns:
+            int: number of moves or -1 if the target cannot be reached
+        """
+        if not (self._xy_in_bounds(from_x, from_y) and self._xy_in_bounds(to_x, to_y)):
+            return -1
+        if (from_x, from_y) == (to_x, to_y):
+            return 0
+        if self.width * self.height > MAX_FIELD_TILES: # too large for a distance field, search from the start tile
+            return search_distance(self, from_x, from_y, to_x, to_y)
+        return self.distance_field(((to_x, to_y),)).distance_from(from_x, from_y)
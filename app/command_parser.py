@@ -0,0 +1,342 @@
+import logging
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# compact opcodes for compiled commands
+OP_PLACE = 0
+OP_MOVE = 1
+OP_LEFT = 2
+OP_RIGHT = 3
+OP_REPORT = 4
+OP_EXIT = 5
+OP_GOTO = 6
+OP_DISTANCE = 7
+OP_STATS = 8
+OP_REPEAT = 9
+
+# command name -> (opcode, argument kinds, number of required arguments, usage)
+# argument kinds are 'int' (unsigned integer), 'word' (letters, e.g. a facing value) and 'block'
+# ('{ ... }' around commands separated by ';' or new lines, not preceded by a comma)
+COMMANDS = {
+    'PLACE':  (OP_PLACE,  ('int', 'int', 'word'), 3, 'PLACE x,y,f'),
+    'MOVE':   (OP_MOVE,   ('int',), 0, 'MOVE [n]'),
+    'LEFT':   (OP_LEFT,   (), 0, 'LEFT'),
+    'RIGHT':  (OP_RIGHT,  (), 0, 'RIGHT'),
+    'REPORT': (OP_REPORT, (), 0, 'REPORT'),
+    'EXIT':   (OP_EXIT,   (), 0, 'EXIT'),
+    'GOTO':   (OP_GOTO,   ('int', 'int', 'word'), 2, 'GOTO x,y[,f]'),
+    'DISTANCE': (OP_DISTANCE, ('int', 'int'), 2, 'DISTANCE x,y'),
+    'STATS':  (OP_STATS,  (), 0, 'STATS'),
+    'REPEAT': (OP_REPEAT, ('int', 'block'), 2, 'REPEAT k { commands }'),
+}
+
+# commands that cannot be used inside a block
+TOP_LEVEL_OPCODES = frozenset((OP_EXIT,))
+
+ARGUMENT_NAMES = {'int': 'a number', 'word': 'a word', 'block': "'{'"}
+
+TOKEN_PATTERN = re.compile(r'(?P<space>\s+)|(?P<word>[A-Za-z_]+)|(?P<int>[0-9]+)|(?P<comma>,)|(?P<semicolon>;)'
+                           r'|(?P<lbrace>\{)|(?P<rbrace>\})|(?P<bad>.)')
+
+# tokens that end a command
+SEPARATORS = frozenset(('semicolon', 'newline', 'rbrace'))
+
+Program = namedtuple('Program', ['instructions', 'errors'])
+
+
+class ParseError(ValueError):
+    """
+    Error raised for text that is not a valid command. Keeps the 1-based line and column of the problem.
+    """
+    def __init__(self, message, line, column, usage=None):
+        super().__init__(f"line {line}, column {column}: {message}")
+        self.message = message
+        self.line = line
+        self.column = column
+        self.usage = usage
+
+
+def tokenize(text):
+    """
+    Splits one command line into tokens. Whitespace is dropped and words are upper-cased.
+
+    Args:
+        text (str): command line
+
+    Returns:
+        list: (kind, value, column) tuples where kind is 'word', 'int', 'comma', 'semicolon', 'lbrace', 'rbrace' or 'bad'
+    """
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(text):
+        kind = match.lastgroup
+        if kind == 'space':
+            continue
+        value = match.group()
+        if kind == 'word':
+            value = value.upper()
+        elif kind == 'int':
+            value = int(value)
+        tokens.append((kind, value, match.start() + 1))
+    return tokens
+
+def _describe(tokens, position):
+    """
+    Returns:
+        str: text of the token at position for error messages
+    """
+    if position >= len(tokens) or tokens[position][0] == 'newline':
+        return 'end of line'
+    return repr(str(tokens[position][1]))
+
+def _error(message, tokens, position, lines, usage=None):
+    """
+    Returns:
+        ParseError: error at the token at position, or just after the last token
+    """
+    return ParseError(message, lines[min(position, len(lines) - 1)], _column_at(tokens, position), usage)
+
+def _parse_command(tokens, position, lines):
+    """
+    Parses one command starting at position. Arguments end at the end of the tokens or at a separator.
+
+    Args:
+        tokens (list): tokens from tokenize()
+        position (int): index of the command name
+        lines (list): 1-based line number of every token, used in errors
+
+    Returns:
+        tuple: (instruction, position after the command, error). instruction is an (opcode, x, y, f) tuple
+        or None when error is a ParseError.
+    """
+    kind, name, column = tokens[position]
+    spec = COMMANDS.get(name) if kind == 'word' else None
+    if spec is None:
+        return None, position, _error(f"unknown command {_describe(tokens, position)}", tokens, position, lines)
+    opcode, kinds, required, usage = spec
+    arguments = []
+    position += 1
+    for index, argument_kind in enumerate(kinds):
+        at_end = position == len(tokens) or tokens[position][0] in SEPARATORS
+        if at_end and index >= required: # optional arguments left out
+            break
+        if index > 0 and argument_kind != 'block':
+            if at_end or tokens[position][0] != 'comma':
+                return None, position, _error(f"expected ',' but found {_describe(tokens, position)}", tokens, position,
+                                              lines, usage)
+            position += 1
+        if argument_kind == 'block':
+            if position == len(tokens) or tokens[position][0] != 'lbrace':
+                return None, position, _error(f"expected {ARGUMENT_NAMES['block']} but found {_describe(tokens, position)}",
+                                              tokens, position, lines, usage)
+            block, position, error = _parse_block(tokens, position + 1, lines)
+            if error is not None:
+                return None, position, error
+            arguments.append(block)
+            continue
+        if position == len(tokens) or tokens[position][0] != argument_kind:
+            return None, position, _error(f"expected {ARGUMENT_NAMES[argument_kind]} but found {_describe(tokens, position)}",
+                                          tokens, position, lines, usage)
+        arguments.append(tokens[position][1])
+        position += 1
+    arguments.extend([None] * (3 - len(arguments)))
+    return (opcode, arguments[0], arguments[1], arguments[2]), position, None
+
+def _parse_block(tokens, position, lines):
+    """
+    Parses the commands of a block up to its closing brace
+
+    Args:
+        tokens (list): tokens from tokenize()
+        position (int): index of the first token after the opening brace
+        lines (list): 1-based line number of every token, used in errors
+
+    Returns:
+        tuple: (instructions, position after the closing brace, error)
+    """
+    instructions = []
+    while True:
+        if position == len(tokens):
+            return None, position, _error("expected '}' but found end of line", tokens, position, lines)
+        kind = tokens[position][0]
+        if kind == 'rbrace':
+            return tuple(instructions), position + 1, None
+        if kind in ('semicolon', 'newline'): # empty commands are allowed
+            position += 1
+            continue
+        start = position
+        instruction, position, error = _parse_command(tokens, position, lines)
+        if error is not None:
+            return None, position, error
+        if instruction[0] in TOP_LEVEL_OPCODES:
+            return None, start, _error(f"{tokens[start][1]} is not allowed inside a block", tokens, start, lines)
+        if position < len(tokens) and tokens[position][0] not in SEPARATORS:
+            return None, position, _error(f"expected ';' or '}}' but found {_describe(tokens, position)}", tokens,
+                                          position, lines)
+        instructions.append(instruction)
+
+def _parse_tokens(tokens, lines):
+    """
+    Parses the tokens of one line, or of the lines of a block spanning several lines
+
+    Args:
+        tokens (list): tokens from tokenize()
+        lines (list): 1-based line number of every token, used in errors
+
+    Returns:
+        tuple: (instruction, error). instruction is an (opcode, x, y, f) tuple or None for a blank line,
+        error is a ParseError or None. The error is returned instead of raised to keep invalid lines cheap.
+    """
+    if not tokens:
+        return None, None
+    instruction, position, error = _parse_command(tokens, 0, lines)
+    if error is not None:
+        return None, error
+    if position < len(tokens):
+        usage = COMMANDS[tokens[0][1]][3]
+        return None, _error(f"unexpected {_describe(tokens, position)}", tokens, position, lines, usage)
+    return instruction, None
+
+def _column_at(tokens, position):
+    """
+    Returns:
+        int: column of the token at position, or the column just after the last token
+    """
+    if position < len(tokens):
+        return tokens[position][2]
+    kind, value, column = tokens[-1]
+    return column + len(str(value))
+
+def _depth(tokens):
+    """
+    Returns:
+        int: number of opening braces minus closing braces
+    """
+    return sum(1 if kind == 'lbrace' else -1 for kind, value, column in tokens if kind in ('lbrace', 'rbrace'))
+
+def _join_lines(lines, first_line=1):
+    """
+    Tokenizes the lines of one command whose block spans several lines. Inside an open block a line break separates
+    commands like ';' does.
+
+    Args:
+        lines (list): command lines
+        first_line (int, optional): 1-based line number of the first line. Defaults to 1.
+
+    Returns:
+        tuple: (tokens, 1-based line number of every token)
+    """
+    tokens = []
+    token_lines = []
+    depth = 0
+    for line_number, line in enumerate(lines, first_line):
+        line_tokens = tokenize(line)
+        if depth > 0: # inside an open block, new lines separate commands
+            tokens.append(('newline', None, len(line) + 1 if not line_tokens else line_tokens[0][2]))
+            token_lines.append(line_number)
+        tokens.extend(line_tokens)
+        token_lines.extend([line_number] * len(line_tokens))
+        depth += _depth(line_tokens)
+    return tokens, token_lines
+
+def block_depth(text):
+    """
+    Number of blocks a command leaves open, used to keep reading lines until a block is closed.
+    Only REPEAT opens blocks, braces after any other command are an error on that line.
+
+    Args:
+        text (str): command text
+
+    Returns:
+        int: number of opening braces minus closing braces, 0 for commands other than REPEAT
+    """
+    tokens = tokenize(text)
+    if not tokens or tokens[0][:2] != ('word', 'REPEAT'):
+        return 0
+    return _depth(tokens)
+
+@lru_cache(maxsize=4096)
+def compile_command(text):
+    """
+    Compiles one command. Results are cached by text so repeated commands are parsed once.
+    The text is one line, or several lines when a block spans them.
+
+    Args:
+        text (str): command text
+
+    Returns:
+        tuple: (instruction, error) where instruction is an (opcode, x, y, f) tuple, or None for blank
+        and invalid lines, and error is a ParseError or None
+    """
+    if '\n' in text: # a block typed over several lines
+        tokens, lines = _join_lines(text.splitlines())
+    else:
+        tokens = tokenize(text)
+        lines = [1] * len(tokens)
+    return _parse_tokens(tokens, lines)
+
+def compile_lines(lines):
+    """
+    Compiles command lines one command at a time, so it works on streams like an open file.
+    A REPEAT line that opens a block continues until the block is closed, so a block can span several lines.
+    Lines outside blocks go through the compile_command cache.
+
+    Args:
+        lines (iterable): command lines, trailing newlines are ignored
+
+    Yields:
+        tuple: (instruction, error) for every line or block that is not blank, like compile_command.
+        Errors carry the line number in lines.
+    """
+    pending = [] # lines of a command whose block is still open
+    depth = 0
+    first_line = 1
+    for line_number, line in enumerate(lines, 1):
+        line = line.rstrip('\r\n')
+        if pending:
+            depth += _depth(tokenize(line))
+        elif '{' in line:
+            depth = block_depth(line)
+            first_line = line_number
+        if not pending and depth <= 0: # a complete line
+            depth = 0
+            instruction, error = compile_command(line)
+            if error is not None and line_number != 1:
+                error = ParseError(error.message, line_number, error.column, error.usage)
+            if instruction is not None or error is not None:
+                yield instruction, error
+            continue
+        pending.append(line)
+        if depth > 0:
+            continue
+        instruction, error = _parse_tokens(*_join_lines(pending, first_line))
+        pending = []
+        depth = 0
+        if instruction is not None or error is not None:
+            yield instruction, error
+    if pending: # block left open at the end of the lines
+        yield _parse_tokens(*_join_lines(pending, first_line))
+
+@lru_cache(maxsize=256)
+def compile_program(source):
+    """
+    Compiles a multi-line program into an instruction list. Results are cached by source so a scripted
+    scenario replayed many times is only parsed once. Invalid lines are collected in errors and skipped.
+    A line that opens a block continues until the block is closed, so a block can span several lines.
+
+    Args:
+        source (str): program text, one command per line
+
+    Returns:
+        Program: (instructions, errors) tuples
+    """
+    instructions = []
+    errors = []
+    for instruction, error in compile_lines(source.splitlines()):
+        if error is not None:
+            errors.append(error)
+        else:
+            instructions.append(instruction)
+    return Program(tuple(instructions), tuple(errors))
@@ -0,0 +1,258 @@
+import logging
+from array import array
+from collections import OrderedDict, deque
+import heapq
+
+logger = logging.getLogger(__name__)
+
+# distance value of tiles that cannot reach the targets
+UNREACHABLE = -1
+# largest board (in tiles) a distance field is built for
+MAX_FIELD_TILES = 1 << 24
+# distance fields kept per board
+CACHE_SIZE = 16
+# tiles a search on a board too large for a distance field expands before giving up
+MAX_SEARCH_EXPANSIONS = 1 << 20
+
+
+class DistanceField:
+    """
+    Number of MOVE steps from every tile to the nearest target tile, computed with a multi-source BFS over
+    free tiles (four axis neighbours). Distances are stored in a flat int array indexed by y * width + x.
+    The field keeps its own copy of blocked tiles and is updated incrementally when a tile changes.
+    """
+    def __init__(self, board, targets):
+        self.width = board.max_x + 1
+        self.height = board.max_y + 1
+        tile_count = self.width * self.height
+        if tile_count > MAX_FIELD_TILES:
+            raise ValueError("Board is too large for a distance field.")
+        self.targets = frozenset(y * self.width + x for x, y in targets)
+        self.blocked = bytearray(tile_count)
+        for x, y in board.occupancy:
+            self.blocked[y * self.width + x] = 1
+        self.distances = array('i', [UNREACHABLE]) * tile_count
+        self._relax([tile for tile in self.targets if not self.blocked[tile]], seed=0)
+
+    def _neighbours(self, tile):
+        """
+        Returns:
+            list: tiles next to tile inside the board
+        """
+        width = self.width
+        x = tile % width
+        neighbours = []
+        if x > 0:
+            neighbours.append(tile - 1)
+        if x < width - 1:
+            neighbours.append(tile + 1)
+        if tile >= width:
+            neighbours.append(tile - width)
+        if tile + width < len(self.distances):
+            neighbours.append(tile + width)
+        return neighbours
+
+    def _relax(self, tiles, seed=None):
+        """
+        BFS that lowers distances outwards from tiles. When seed is given the tiles are set to it first.
+        """
+        distances = self.distances
+        blocked = self.blocked
+        queue = deque(tiles)
+        if seed is not None:
+            for tile in tiles:
+                distances[tile] = seed
+        while queue:
+            tile = queue.popleft()
+            next_distance = distances[tile] + 1
+            for neighbour in self._neighbours(tile):
+                if not blocked[neighbour] and (distances[neighbour] == UNREACHABLE or distances[neighbour] > next_distance):
+                    distances[neighbour] = next_distance
+                    queue.append(neighbour)
+
+    def _best_neighbour(self, tile, skip=()):
+        """
+        Returns:
+            int: smallest distance among free neighbours of tile (ignoring skip), or UNREACHABLE
+        """
+        best = UNREACHABLE
+        for neighbour in self._neighbours(tile):
+            distance = self.distances[neighbour]
+            if distance != UNREACHABLE and neighbour not in skip and (best == UNREACHABLE or distance < best):
+                best = distance
+        return best
+
+    def tile_changed(self, x, y, occupied):
+        """
+        Updates the field after a tile was blocked or freed. Only the tiles whose distance changes are touched.
+
+        Args:
+            x (int): x axis value
+            y (int): y axis value
+            occupied (int): 1 if the tile is now occupied, 0 if it is now empty
+        """
+        tile = y * self.width + x
+        if bool(self.blocked[tile]) == bool(occupied):
+            return
+        self.blocked[tile] = 1 if occupied else 0
+        if not occupied:
+            if tile in self.targets:
+                self._relax([tile], seed=0)
+            else:
+                best = self._best_neighbour(tile)
+                if best != UNREACHABLE:
+                    self._relax([tile], seed=best + 1)
+            return
+        if self.distances[tile] == UNREACHABLE:
+            return
+        self._block(tile)
+
+    def _block(self, tile):
+        """
+        Raises distances of the tiles that lost their shortest path through the newly blocked tile
+        """
+        distances = self.distances
+        # tiles whose every shortest path went through the blocked tile, found in increasing distance order
+        affected = {tile}
+        queue = deque([tile])
+        while queue:
+            current = queue.popleft()
+            expected = distances[current] + 1
+            for neighbour in self._neighbours(current):
+                if neighbour in affected or self.blocked[neighbour] or distances[neighbour] != expected:
+                    continue
+                supported = any(
+                    distances[other] == expected - 1 and other not in affected
+                    for other in self._neighbours(neighbour)
+                    if not self.blocked[other]
+                )
+                if not supported:
+                    affected.add(neighbour)
+                    queue.append(neighbour)
+        for current in affected:
+            distances[current] = UNREACHABLE
+        affected.discard(tile)
+
+        # recompute the affected tiles from their unaffected neighbours
+        heap = []
+        for current in affected:
+            if current in self.targets:
+                heap.append((0, current))
+                continue
+            best = self._best_neighbour(current, affected)
+            if best != UNREACHABLE:
+                heap.append((best + 1, current))
+        heapq.heapify(heap)
+        while heap:
+            distance, current = heapq.heappop(heap)
+            if distances[current] != UNREACHABLE and distances[current] <= distance:
+                continue
+            distances[current] = distance
+            for neighbour in self._neighbours(current):
+                if neighbour in affected and (distances[neighbour] == UNREACHABLE or distances[neighbour] > distance + 1):
+                    heapq.heappush(heap, (distance + 1, neighbour))
+
+    def distance_from(self, x, y):
+        """
+        Number of MOVE steps from x,y to the nearest target. A start tile that is occupied (e.g. by the robot
+        asking) is left through its best free neighbour.
+
+        Args:
+            x (int): x axis value
+            y (int): y axis value
+
+        Returns:
+            int: distance or UNREACHABLE
+        """
+        tile = y * self.width + x
+        if tile in self.targets:
+            return 0
+        if not self.blocked[tile]:
+            return self.distances[tile]
+        best = self._best_neighbour(tile)
+        return UNREACHABLE if best == UNREACHABLE else best + 1
+
+
+class DistanceFieldCache:
+    """
+    Least recently used distance fields of one board, kept up to date through the board tile listeners
+    """
+    def __init__(self, board, size=CACHE_SIZE):
+        self.board = board
+        self.size = size
+        self.fields = OrderedDict()
+        board.tile_listeners.append(self.tile_changed)
+
+    def tile_changed(self, x, y, occupied):
+        for field in self.fields.values():
+            field.tile_changed(x, y, occupied)
+
+    def clear(self):
+        """
+        Drops every cached field, e.g. before a bulk change where rebuilding is cheaper than updating
+        """
+        self.fields.clear()
+
+    def get(self, targets):
+        """
+        Returns the distance field for a set of target tiles, building it on first use
+
+        Args:
+            targets (iterable): (x, y) target tiles
+
+        Returns:
+            DistanceField: distance field
+        """
+        key = frozenset(targets)
+        field = self.fields.get(key)
+        if field is None:
+            field = DistanceField(self.board, key)
+            self.fields[key] = field
+            if len(self.fields) > self.size:
+                self.fields.popitem(last=False)
+        else:
+            self.fields.move_to_end(key)
+        return field
+
+
+def search_distance(board, from_x, from_y, to_x, to_y, max_expansions=MAX_SEARCH_EXPANSIONS):
+    """
+    Number of MOVE steps between two tiles found with an A* search from the start tile, used on boards too large
+    for a distance field. Occupied tiles block the path except the start tile.
+
+    Args:
+        board (Board): Board object
+        from_x (int): start x axis value
+        from_y (int): start y axis value
+        to_x (int): target x axis value
+        to_y (int): target y axis value
+        max_expansions (int, optional): search limit. Defaults to MAX_SEARCH_EXPANSIONS.
+
+    Returns:
+        int: distance, or UNREACHABLE if the target cannot be reached within the search limit
+    """
+    contains = board.occupancy.contains
+    if contains(to_x, to_y):
+        return UNREACHABLE
+    max_x, max_y = board.max_x, board.max_y
+    steps_to = {(from_x, from_y): 0}
+    heap = [(abs(to_x - from_x) + abs(to_y - from_y), 0, from_x, from_y)]
+    expansions = 0
+    while heap:
+        estimate, steps, x, y = heapq.heappop(heap)
+        if x == to_x and y == to_y:
+            return steps
+        if steps > steps_to[(x, y)]: # already reached with fewer steps
+            continue
+        expansions += 1
+        if expansions > max_expansions:
+            logger.warning("Gave up the distance search to [%s,%s] after %s tiles.", to_x, to_y, max_expansions)
+            return UNREACHABLE
+        steps += 1
+        for next_x, next_y in ((x - 1, y), (x + 1, y), (x, y - 1), (x, y + 1)):
+            if 0 <= next_x <= max_x and 0 <= next_y <= max_y and not contains(next_x, next_y):
+                tile = (next_x, next_y)
+                if tile not in steps_to or steps_to[tile] > steps:
+                    steps_to[tile] = steps
+                    heapq.heappush(heap, (steps + abs(to_x - next_x) + abs(to_y - next_y), steps, next_x, next_y))
+    return UNREACHABLE
@@ -0,0 +1,338 @@
+import asyncio
+import csv
+import io
+import json
+import logging
+from collections import deque
+
+import events
+import journal
+from batch_runner import COMMAND_HANDLERS, OUTPUT_OPCODES, UNPLACED_OPCODES, compile_commands
+from command_parser import OP_REPORT, OP_EXIT, OP_REPEAT
+from journal import encode_varint, decode_varint
+from macros import run_repeat
+from robot import Robot
+
+logger = logging.getLogger(__name__)
+
+# event kind -> names of the values after the robot
+EVENT_FIELDS = {
+    events.PLACED: ('x', 'y', 'facing'),
+    events.MOVED: ('old_x', 'old_y', 'new_x', 'new_y'),
+    events.BLOCKED: ('x', 'y'),
+    events.ROTATED: ('old_facing', 'new_facing'),
+    events.REPORTED: ('x', 'y', 'facing'),
+    events.OUTPUT: ('text',),
+}
+
+# Binary sink layout: header magic, version, then one record per event:
+#   varint kind code, varint robot id, one varint per value
+# Coordinates are stored plus one (a blocked target can be -1), facings as facing code + 1 with 0 for none, text as
+# varint length and UTF-8 bytes.
+MAGIC = b'TRBE'
+VERSION = 1
+HEADER = MAGIC + bytes([VERSION])
+KINDS = tuple(EVENT_FIELDS) # kind code -> kind
+KIND_CODES = {kind: code for code, kind in enumerate(KINDS)}
+
+# sinks write their buffer to the file once it holds this many bytes or characters
+CHUNK_SIZE = 64 * 1024
+
+
+def robot_id(robot):
+    """
+    Returns:
+        int: fleet slot of a FleetRobot, 0 for a standalone robot
+    """
+    return getattr(robot, 'robot_id', 0)
+
+def _stream(instructions, board, robot, pending, record):
+    """
+    Runs instructions through batch_runner.COMMAND_HANDLERS like batch_runner.execute, yielding the events collected
+    in pending after every instruction. REPORT is emitted as an event without building the report string, DISTANCE
+    and STATS outputs become OUTPUT events and REPEAT replays the events of its body.
+
+    Args:
+        instructions (iterable): (opcode, x, y, f) instructions
+        board (Board): Board object
+        robot (Robot): Robot object
+        pending (deque): event buffer registered as an events hook
+        record (callable): journal.record, or None when nothing is journaled
+
+    Yields:
+        tuple: event tuple
+    """
+    handlers = COMMAND_HANDLERS
+    for instruction in instructions:
+        if record is not None:
+            record(instruction, board, robot)
+        opcode, x, y, f = instruction
+        if opcode == OP_EXIT:
+            return
+        if robot.board is None and opcode not in UNPLACED_OPCODES: # commands are discarded until a valid PLACE
+            continue
+        if opcode == OP_REPORT:
+            events.emit((events.REPORTED, robot, robot.x_axis, robot.y_axis, robot.FACINGS[robot.facing_code]))
+        elif opcode == OP_REPEAT:
+            # fast-forwarded iterations replay the events of the cycle they repeat
+            run_body = lambda: list(_stream(y, board, robot, pending, None))
+            yield from run_repeat(x, y, board, robot, run_body)
+            pending.clear() # the jump to the final state is already covered by the replayed events
+            continue
+        else:
+            result = handlers[opcode](board, robot, x, y, f)
+            if opcode in OUTPUT_OPCODES:
+                pending.append((events.OUTPUT, robot, result))
+        while pending:
+            yield pending.popleft()
+
+def execute_events(instructions, board, robot):
+    """
+    Runs compiled instructions against a board and robot, yielding every event as it happens.
+    Stops at the first EXIT instruction. Instructions are recorded in the board's open journals.
+    Events are handed out one instruction at a time, so memory stays constant however long the run is.
+
+    Args:
+        instructions (iterable): (opcode, x, y, f) instructions
+        board (Board): Board object
+        robot (Robot): Robot object
+
+    Yields:
+        tuple: event tuple (PLACED, MOVED, BLOCKED, ROTATED, REPORTED or OUTPUT, see events.py)
+    """
+    pending = deque()
+    hook = pending.append
+    events.add_hook(hook)
+    try:
+        yield from _stream(instructions, board, robot, pending, journal.record if journal.writers else None)
+    finally:
+        events.remove_hook(hook)
+
+def iter_events(lines, board, robot):
+    """
+    Runs a stream of commands against a board and robot, yielding every event as it happens.
+    Stops at the first EXIT command.
+
+    Args:
+        lines (iterable): command strings, e.g. an open file
+        board (Board): Board object
+        robot (Robot): Robot object
+
+    Yields:
+        tuple: event tuple
+    """
+    return execute_events(compile_commands(lines), board, robot)
+
+async def aiter_events(lines, board, robot, batch_size=1000):
+    """
+    Async version of iter_events. Yields control to the event loop every batch_size events.
+
+    Args:
+        lines (iterable): command strings, e.g. an open file
+        board (Board): Board object
+        robot (Robot): Robot object
+        batch_size (int, optional): events between two yields to the event loop. Defaults to 1000.
+
+    Yields:
+        tuple: event tuple
+    """
+    for count, event in enumerate(iter_events(lines, board, robot), 1):
+        yield event
+        if count % batch_size == 0:
+            await asyncio.sleep(0)
+
+
+class EventSink:
+    """
+    Base class of the event sinks. Events are formatted into an in-memory chunk that is written to the file once it
+    reaches CHUNK_SIZE, so the file sees a few large writes. Subclasses implement _format.
+    """
+    binary = False
+
+    def __init__(self, file, chunk_size=CHUNK_SIZE):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.chunk = bytearray() if self.binary else []
+        self.chunk_length = 0
+        self.count = 0
+
+    def write(self, event):
+        """
+        Args:
+            event (tuple): event tuple
+        """
+        length = self._format(event)
+        self.count += 1
+        self.chunk_length += length
+        if self.chunk_length >= self.chunk_size:
+            self.flush()
+
+    def consume(self, event_stream):
+        """
+        Writes every event of a stream, e.g. execute_events(...)
+
+        Args:
+            event_stream (iterable): event tuples
+
+        Returns:
+            int: number of events written
+        """
+        before = self.count
+        for event in event_stream:
+            self.write(event)
+        return self.count - before
+
+    def flush(self):
+        """
+        Writes the buffered chunk to the file
+        """
+        if self.chunk_length:
+            if self.binary:
+                self.file.write(self.chunk)
+                self.chunk.clear()
+            else:
+                self.file.write(''.join(self.chunk))
+                self.chunk.clear()
+            self.chunk_length = 0
+
+    def close(self):
+        """
+        Flushes the chunk and closes the file
+        """
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class NdjsonSink(EventSink):
+    """
+    One JSON object per line, e.g. {"event": "moved", "robot": 0, "old_x": 0, "old_y": 0, "new_x": 0, "new_y": 1}
+    Lines are filled into a per-kind template; only facings and text go through json.dumps.
+    """
+    def __init__(self, file, chunk_size=CHUNK_SIZE):
+        super().__init__(file, chunk_size)
+        self.templates = {} # kind -> (line template, per value True if it is a string)
+        for kind, fields in EVENT_FIELDS.items():
+            keys = ['"event": %s' % json.dumps(kind), '"robot": %d'] + ['"%s": %%s' % name for name in fields]
+            quoted = tuple(name.endswith('facing') or name == 'text' for name in fields)
+            self.templates[kind] = '{' + ', '.join(keys) + '}\n', quoted if any(quoted) else None
+
+    def _format(self, event):
+        template, quoted = self.templates[event[0]]
+        values = event[2:]
+        if quoted is not None:
+            values = tuple(json.dumps(value) if is_string else value for value, is_string in zip(values, quoted))
+        line = template % ((robot_id(event[1]),) + values)
+        self.chunk.append(line)
+        return len(line)
+
+
+class CsvSink(EventSink):
+    """
+    CSV with one row per event. Values go in the columns named by EVENT_FIELDS, the other columns are left empty.
+    """
+    COLUMNS = ('event', 'robot', 'x', 'y', 'facing', 'old_x', 'old_y', 'new_x', 'new_y', 'old_facing', 'new_facing', 'text')
+
+    def __init__(self, file, chunk_size=CHUNK_SIZE):
+        super().__init__(file, chunk_size)
+        self.buffer = io.StringIO()
+        self.writer = csv.DictWriter(self.buffer, self.COLUMNS, lineterminator='\n')
+        self.writer.writeheader()
+        self._take()
+
+    def _take(self):
+        text = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        self.chunk.append(text)
+        return len(text)
+
+    def _format(self, event):
+        kind = event[0]
+        row = dict(zip(EVENT_FIELDS[kind], event[2:]))
+        row['event'] = kind
+        row['robot'] = robot_id(event[1])
+        self.writer.writerow(row)
+        return self._take()
+
+
+class BinarySink(EventSink):
+    """
+    Compact varint records, see the layout above. Read them back with iter_binary_events.
+    """
+    binary = True
+
+    def __init__(self, file, chunk_size=CHUNK_SIZE):
+        super().__init__(file, chunk_size)
+        self.chunk += HEADER
+        self.chunk_length = len(HEADER)
+
+    def _format(self, event):
+        chunk = self.chunk
+        start = len(chunk)
+        kind = event[0]
+        encode_varint(KIND_CODES[kind], chunk)
+        encode_varint(robot_id(event[1]), chunk)
+        for name, value in zip(EVENT_FIELDS[kind], event[2:]):
+            if name.endswith('facing'):
+                code = Robot.FACING_CODES.get(value)
+                encode_varint(0 if code is None else code + 1, chunk)
+            elif name == 'text':
+                data = str(value).encode()
+                encode_varint(len(data), chunk)
+                chunk += data
+            else:
+                encode_varint(value + 1, chunk)
+        return len(chunk) - start
+
+
+def iter_binary_events(data):
+    """
+    Decodes the output of BinarySink
+
+    Args:
+        data (bytes): file contents
+
+    Yields:
+        tuple: (kind, robot id, *values)
+    """
+    if data[:len(HEADER)] != HEADER:
+        raise ValueError("Not a robot simulator event stream.")
+    offset = len(HEADER)
+    while offset < len(data):
+        code, offset = decode_varint(data, offset)
+        kind = KINDS[code]
+        values = [kind]
+        value, offset = decode_varint(data, offset)
+        values.append(value)
+        for name in EVENT_FIELDS[kind]:
+            value, offset = decode_varint(data, offset)
+            if name.endswith('facing'):
+                value = Robot.FACINGS[value - 1] if value else None
+            elif name == 'text':
+                value, offset = bytes(data[offset:offset + value]).decode(), offset + value
+            else:
+                value -= 1
+            values.append(value)
+        yield tuple(values)
+
+def open_sink(path):
+    """
+    Opens a sink chosen by file extension: .ndjson or .jsonl for NDJSON, .csv for CSV, anything else binary
+
+    Args:
+        path (str): output file path
+
+    Returns:
+        EventSink: sink writing to the file
+    """
+    if path.endswith(('.ndjson', '.jsonl')):
+        return NdjsonSink(open(path, 'w'))
+    if path.endswith('.csv'):
+        return CsvSink(open(path, 'w', newline=''))
+    return BinarySink(open(path, 'wb'))
@@ -0,0 +1,72 @@
+from collections import deque
+
+# event kinds. Each event is a plain tuple (kind, robot, ...) so no text is formatted when it is emitted.
+PLACED = 'placed'       # (PLACED, robot, x, y, facing)
+MOVED = 'moved'         # (MOVED, robot, old_x, old_y, new_x, new_y)
+BLOCKED = 'blocked'     # (BLOCKED, robot, x, y)  target tile that could not be entered
+ROTATED = 'rotated'     # (ROTATED, robot, old_facing, new_facing)
+REPORTED = 'report'     # (REPORTED, robot, x, y, facing)
+OUTPUT = 'output'       # (OUTPUT, robot, text)  DISTANCE and STATS results, only produced by event_stream
+
+# registered callbacks. Emitters check this list before building an event so that no hooks means no cost.
+hooks = []
+
+def add_hook(callback):
+    """
+    Registers a callback that receives every event tuple
+
+    Args:
+        callback (callable): function taking one event tuple
+    """
+    hooks.append(callback)
+
+def remove_hook(callback):
+    """
+    Unregisters a callback added with add_hook
+
+    Args:
+        callback (callable): function taking one event tuple
+    """
+    hooks.remove(callback)
+
+def emit(event):
+    """
+    Sends an event tuple to every registered hook
+
+    Args:
+        event (tuple): event tuple starting with the event kind
+    """
+    for callback in hooks:
+        callback(event)
+
+
+class EventRing:
+    """
+    Ring buffer hook that keeps the last maxlen events. Register it with add_hook(ring).
+    """
+    def __init__(self, maxlen=10000):
+        self.events = deque(maxlen=maxlen)
+
+    def __call__(self, event):
+        self.events.append(event)
+
+    def __len__(self):
+        return len(self.events)
+
+    def __iter__(self):
+        return iter(self.events)
+
+    def counts(self):
+        """
+        Number of buffered events per kind
+
+        Returns:
+            dict: event kind to count
+        """
+        counts = {}
+        for event in self.events:
+            counts[event[0]] = counts.get(event[0], 0) + 1
+        return counts
+
+    def clear(self):
+        self.events.clear()
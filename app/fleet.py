@@ -0,0 +1,161 @@
+import logging
+from array import array
+
+from robot import NO_FACING, Robot
+from start_app import run_command
+
+try:
+    import numpy
+except ImportError: # numpy is optional, arrays from the array module are used as is
+    numpy = None
+
+logger = logging.getLogger(__name__)
+
+# facing code of a robot that is not yet placed on the board
+UNPLACED = NO_FACING
+
+class FleetRobot(Robot):
+    """
+    A Robot that is a thin view onto one Fleet slot. All state is read from and written to the fleet arrays.
+    The fleet facing codes share Robot.facing_code values, with UNPLACED for a robot that is not on the board.
+    """
+    __slots__ = ('fleet', 'robot_id')
+
+    def __init__(self, fleet, robot_id):
+        self.fleet = fleet
+        self.robot_id = robot_id
+
+    @property
+    def x_axis(self):
+        if self.fleet.facings[self.robot_id] == UNPLACED:
+            return None
+        return self.fleet.xs[self.robot_id]
+
+    @x_axis.setter
+    def x_axis(self, value):
+        self.fleet.xs[self.robot_id] = value
+
+    @property
+    def y_axis(self):
+        if self.fleet.facings[self.robot_id] == UNPLACED:
+            return None
+        return self.fleet.ys[self.robot_id]
+
+    @y_axis.setter
+    def y_axis(self, value):
+        self.fleet.ys[self.robot_id] = value
+
+    @property
+    def facing_code(self):
+        return self.fleet.facings[self.robot_id]
+
+    @facing_code.setter
+    def facing_code(self, value):
+        self.fleet.facings[self.robot_id] = value
+
+    @property
+    def board(self):
+        if self.fleet.facings[self.robot_id] == UNPLACED:
+            return None
+        return self.fleet.board
+
+    @board.setter
+    def board(self, value):
+        if value is None:
+            self.fleet.facings[self.robot_id] = UNPLACED
+        elif value is not self.fleet.board:
+            raise ValueError("Fleet robots can only be placed on the fleet board.")
+
+
+class Fleet:
+    """
+    A fleet of robots sharing one board. Robot x, y and facing are kept in contiguous typed arrays indexed by robot id.
+    Collisions are checked through the board occupancy index like a single Robot.
+    """
+    def __init__(self, board, count=0):
+        self.board = board
+        self.xs = array('i')
+        self.ys = array('i')
+        self.facings = array('b')
+        for robot_id in range(count):
+            self.add_robot()
+
+    def __len__(self):
+        return len(self.facings)
+
+    def add_robot(self):
+        """
+        Adds a new robot slot to the fleet. The robot is not on the board until it is placed.
+
+        Returns:
+            int: robot id
+        """
+        self.xs.append(0)
+        self.ys.append(0)
+        self.facings.append(UNPLACED)
+        return len(self.facings) - 1
+
+    def robot(self, robot_id):
+        """
+        Returns a Robot view onto one fleet slot
+
+        Args:
+            robot_id (int): robot id
+
+        Returns:
+            FleetRobot: Robot view of the slot
+        """
+        if not 0 <= robot_id < len(self.facings):
+            raise IndexError(f"Unknown robot id {robot_id}.")
+        return FleetRobot(self, robot_id)
+
+    def remove_robot(self, robot_id):
+        """
+        Takes a robot off the board and frees its tile. The slot is kept so robot ids stay stable.
+
+        Args:
+            robot_id (int): robot id
+
+        Returns:
+            Bool: True or False if the robot was on the board
+        """
+        if self.facings[robot_id] == UNPLACED:
+            return False
+        self.board.remove_obstruction(self.xs[robot_id], self.ys[robot_id])
+        self.facings[robot_id] = UNPLACED
+        return True
+
+    def run_command(self, robot_id, command):
+        """
+        Runs a command for one robot of the fleet
+
+        Args:
+            robot_id (int): robot id
+            command (str): command to run
+
+        Returns:
+            Bool: True / False / 'Exit' or the REPORT string, same as start_app.run_command
+        """
+        return run_command(command, self.board, self.robot(robot_id))
+
+    def placed_ids(self):
+        """
+        Returns:
+            list: ids of robots currently on the board
+        """
+        return [robot_id for robot_id, code in enumerate(self.facings) if code != UNPLACED]
+
+    def as_numpy(self):
+        """
+        Zero-copy NumPy views of the fleet arrays. Views must be released before adding more robots.
+
+        Returns:
+            tuple: (xs, ys, facings) numpy arrays or None if numpy is not installed
+        """
+        if numpy is None:
+            return None
+        return (
+            numpy.frombuffer(self.xs, dtype=numpy.int32),
+            numpy.frombuffer(self.ys, dtype=numpy.int32),
+            numpy.frombuffer(self.facings, dtype=numpy.int8),
+        )
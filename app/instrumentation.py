@@ -0,0 +1,186 @@
+import functools
+import json
+import logging
+import time
+
+from board import Board
+from command_parser import COMMANDS
+from sparse_board import SparseBoard
+
+logger = logging.getLogger(__name__)
+
+# Board operations timed when instrumentation is enabled, as (class, method name, stat name).
+# SparseBoard overrides get_board_window, so its own method is wrapped too.
+BOARD_OPERATIONS = (
+    (Board, '_xy_is_valid', 'board.valid_check'),
+    (Board, '_xy_is_empty', 'board.empty_check'),
+    (Board, 'add_obstruction', 'board.add'),
+    (Board, 'remove_obstruction', 'board.remove'),
+    (Board, 'get_board_state', 'board.render_state'),
+    (Board, 'get_board_rows', 'board.render_rows'),
+    (Board, 'get_board_window', 'board.render_window'),
+    (SparseBoard, 'get_board_window', 'board.render_window'),
+)
+# histogram buckets are powers of two nanoseconds, the last one collects everything slower (about 1 second and up)
+BUCKET_COUNT = 31
+
+# stat name -> Stat. Kept after disable() so results can still be exported.
+stats = {}
+# (owner, name, original) of every swapped function while enabled
+_swapped = []
+
+
+class Stat:
+    """
+    Call counter with total and max time and a power-of-two histogram of call durations
+    """
+    __slots__ = ('count', 'total', 'maximum', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.maximum = 0
+        self.buckets = [0] * BUCKET_COUNT
+
+    def record(self, duration):
+        """
+        Args:
+            duration (int): call duration in nanoseconds
+        """
+        self.count += 1
+        self.total += duration
+        if duration > self.maximum:
+            self.maximum = duration
+        self.buckets[min(duration.bit_length(), BUCKET_COUNT - 1)] += 1
+
+
+def _timed(function, stat):
+    """
+    Returns:
+        callable: function wrapped to record every call in stat
+    """
+    clock = time.perf_counter_ns
+    @functools.wraps(function)
+    def timed(*args, **kwargs):
+        start = clock()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            stat.record(clock() - start)
+    return timed
+
+def _stat(name):
+    stat = stats.get(name)
+    if stat is None:
+        stat = stats[name] = Stat()
+    return stat
+
+def enabled():
+    """
+    Returns:
+        Bool: True if the timed functions are in place
+    """
+    return bool(_swapped)
+
+def enable():
+    """
+    Swaps timed wrappers in for every command handler of start_app.run_command and batch_runner.execute and the
+    Board operations. Nothing is checked per call while disabled; the original functions are simply in place.
+    """
+    import batch_runner # batch_runner imports this module for the STATS command
+    if _swapped:
+        return
+    opcode_names = {spec[0]: name for name, spec in COMMANDS.items()}
+    handlers = batch_runner.COMMAND_HANDLERS
+    for opcode, handler in list(handlers.items()):
+        _swapped.append((handlers, opcode, handler))
+        handlers[opcode] = _timed(handler, _stat(f"command.{opcode_names[opcode]}"))
+    for owner, name, stat_name in BOARD_OPERATIONS:
+        original = owner.__dict__[name]
+        _swapped.append((owner, name, original))
+        setattr(owner, name, _timed(original, _stat(stat_name)))
+
+def disable():
+    """
+    Puts the original functions back. Collected stats are kept.
+    """
+    while _swapped:
+        owner, name, original = _swapped.pop()
+        if isinstance(owner, dict):
+            owner[name] = original
+        else:
+            setattr(owner, name, original)
+
+def reset():
+    """
+    Clears the collected stats
+    """
+    for stat in stats.values():
+        stat.__init__()
+
+def stats_line():
+    """
+    One line summary used by the STATS command
+
+    Returns:
+        str: 'name count=... mean=...us max=...us' for every called operation, separated by '; '
+    """
+    if not _swapped and not any(stat.count for stat in stats.values()):
+        return "instrumentation disabled"
+    line = '; '.join(
+        f"{name} count={stat.count} mean={stat.total / stat.count / 1000:.2f}us max={stat.maximum / 1000:.2f}us"
+        for name, stat in sorted(stats.items()) if stat.count
+    )
+    return line or "no calls recorded"
+
+def to_dict():
+    """
+    Returns:
+        dict: name -> count, total and max seconds and the cumulative histogram {upper bound in seconds: count}
+    """
+    result = {}
+    for name, stat in sorted(stats.items()):
+        if not stat.count:
+            continue
+        histogram = {}
+        cumulative = 0
+        for index, count in enumerate(stat.buckets[:-1]):
+            cumulative += count
+            histogram[f"{(1 << index) / 1e9:g}"] = cumulative
+        histogram["+Inf"] = stat.count
+        result[name] = {
+            "count": stat.count,
+            "total_seconds": stat.total / 1e9,
+            "max_seconds": stat.maximum / 1e9,
+            "histogram": histogram,
+        }
+    return result
+
+def to_prometheus():
+    """
+    Returns:
+        str: stats in the Prometheus text exposition format as one histogram metric labelled by operation
+    """
+    lines = [
+        "# HELP toy_robot_operation_seconds Time spent in simulator commands and board operations.",
+        "# TYPE toy_robot_operation_seconds histogram",
+    ]
+    for name, values in to_dict().items():
+        for bound, count in values["histogram"].items():
+            lines.append(f'toy_robot_operation_seconds_bucket{{operation="{name}",le="{bound}"}} {count}')
+        lines.append(f'toy_robot_operation_seconds_sum{{operation="{name}"}} {values["total_seconds"]:g}')
+        lines.append(f'toy_robot_operation_seconds_count{{operation="{name}"}} {values["count"]}')
+    return '\n'.join(lines) + '\n'
+
+def export(path):
+    """
+    Writes the stats to a file, as JSON if the path ends with .json and as Prometheus text otherwise
+
+    Args:
+        path (str): output file path
+    """
+    with open(path, 'w') as stats_file:
+        if path.endswith('.json'):
+            json.dump(to_dict(), stats_file, indent=2)
+        else:
+            stats_file.write(to_prometheus())
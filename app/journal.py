@@ -0,0 +1,344 @@
+import argparse
+import logging
+import os
+import time
+from bisect import bisect_right
+
+from command_parser import COMMANDS, OP_MOVE, OP_REPEAT
+from robot import Robot
+
+logger = logging.getLogger(__name__)
+
+# File layout:
+#   header    magic, version
+#   records   command:  varint opcode, varint robot slot, arguments
+#             snapshot: varint SNAPSHOT, varint command index, varint length, snapshot bytes (snapshot.py format)
+# Required number arguments are stored as is, optional ones as value + 1 with 0 for none. Word arguments (facings) are
+# stored as facing code + 1 with 0 for none or unknown. Block arguments are a varint command count followed by the
+# commands as varint opcode and arguments.
+# Version 1 stored MOVE without its tile count and had no REPEAT blocks.
+MAGIC = b'TRBJ'
+VERSION = 2
+SUPPORTED_VERSIONS = (1, 2)
+HEADER = MAGIC + bytes([VERSION])
+SNAPSHOT = 0x7f
+
+# opcode -> (argument kinds, number of required arguments)
+ARGUMENT_KINDS = {opcode: (kinds, required) for opcode, kinds, required, usage in COMMANDS.values()}
+
+# journal version -> argument table its records were written with
+VERSION_ARGUMENT_KINDS = {
+    1: {opcode: ((), 0) if opcode == OP_MOVE else spec for opcode, spec in ARGUMENT_KINDS.items() if opcode != OP_REPEAT},
+    2: ARGUMENT_KINDS,
+}
+
+# open journals. run_command and batch_runner.execute check this list before recording so that no journal means no cost.
+writers = []
+
+
+def encode_varint(value, out):
+    """
+    Appends an unsigned LEB128 varint to a bytearray
+
+    Args:
+        value (int): non-negative integer
+        out (bytearray): output buffer
+    """
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def decode_varint(data, offset):
+    """
+    Reads an unsigned LEB128 varint
+
+    Args:
+        data (bytes): encoded data
+        offset (int): position of the varint
+
+    Returns:
+        tuple: (value, offset after the varint). Raises IndexError if the data ends inside the varint.
+    """
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+def encode_arguments(instruction, facing_codes, out):
+    """
+    Appends the arguments of a compiled command to a bytearray
+
+    Args:
+        instruction (tuple): (opcode, x, y, f) instruction
+        facing_codes (dict): facing -> facing code of the robot running the command
+        out (bytearray): output buffer
+    """
+    kinds, required = ARGUMENT_KINDS[instruction[0]]
+    for index, (kind, value) in enumerate(zip(kinds, instruction[1:])):
+        if kind == 'int':
+            if index < required:
+                encode_varint(value, out)
+            else:
+                encode_varint(0 if value is None else value + 1, out)
+        elif kind == 'block':
+            encode_varint(len(value), out)
+            for command in value:
+                encode_varint(command[0], out)
+                encode_arguments(command, facing_codes, out)
+        else:
+            code = facing_codes.get(value)
+            encode_varint(0 if code is None else code + 1, out)
+
+def decode_arguments(opcode, data, offset, version=VERSION):
+    """
+    Reads the arguments of a command record
+
+    Args:
+        opcode (int): command opcode
+        data (bytes): encoded data
+        offset (int): position of the first argument
+        version (int, optional): journal version the record was written with. Defaults to VERSION.
+
+    Returns:
+        tuple: ((opcode, x, y, f) instruction, offset after the arguments). Raises IndexError if the data ends
+        inside the record and KeyError for an unknown opcode.
+    """
+    kinds, required = VERSION_ARGUMENT_KINDS[version][opcode]
+    arguments = []
+    for index, kind in enumerate(kinds):
+        value, offset = decode_varint(data, offset)
+        if kind == 'int':
+            if index >= required:
+                value = value - 1 if value else None
+        elif kind == 'block':
+            commands = []
+            for _ in range(value):
+                command_opcode, offset = decode_varint(data, offset)
+                command, offset = decode_arguments(command_opcode, data, offset, version)
+                commands.append(command)
+            value = tuple(commands)
+        else:
+            value = Robot.FACINGS[value - 1] if value else None
+        arguments.append(value)
+    arguments.extend([None] * (3 - len(arguments)))
+    return (opcode, arguments[0], arguments[1], arguments[2]), offset
+
+def _robot_key(robot):
+    """
+    Returns:
+        hashable: identity of a robot. FleetRobot views are created per call, so they are keyed by fleet slot.
+    """
+    fleet = getattr(robot, 'fleet', None)
+    return id(robot) if fleet is None else (id(fleet), robot.robot_id)
+
+def record(instruction, board, robot):
+    """
+    Appends a compiled command to every open journal of the board
+
+    Args:
+        instruction (tuple): (opcode, x, y, f) instruction
+        board (Board): board the command runs on
+        robot (Robot): robot running the command
+    """
+    for journal in writers:
+        if journal.board is board:
+            journal.append(instruction, robot)
+
+
+class Journal:
+    """
+    Append-only binary log of every command run on one board. Records are buffered in memory, written when the buffer
+    fills up and fsynced at most every sync_interval seconds. The board and robots are snapshotted when the journal is
+    opened and every snapshot_interval commands, so a replay can start from the nearest snapshot.
+    Changes made to the board outside of commands (e.g. add_obstruction) are not recorded.
+    """
+    def __init__(self, path, board, robots=(), snapshot_interval=10000, buffer_size=64 * 1024, sync_interval=1.0):
+        from snapshot import dump_snapshot # snapshot imports fleet -> start_app -> batch_runner, which imports this module
+        self._dump_snapshot = dump_snapshot
+        self.path = path
+        self.board = board
+        self.robots = list(robots)
+        self.slots = {_robot_key(robot): slot for slot, robot in enumerate(self.robots)}
+        self.snapshot_interval = snapshot_interval
+        self.buffer_size = buffer_size
+        self.sync_interval = sync_interval
+        self.command_count = 0
+        self.buffer = bytearray(HEADER)
+        self.file = open(path, 'wb')
+        self.synced = time.monotonic()
+        self._append_snapshot()
+        writers.append(self)
+
+    def _append_snapshot(self):
+        """
+        Embeds a snapshot of the board and robots taken before the next command
+        """
+        data = self._dump_snapshot(self.board, self.robots)
+        encode_varint(SNAPSHOT, self.buffer)
+        encode_varint(self.command_count, self.buffer)
+        encode_varint(len(data), self.buffer)
+        self.buffer += data
+
+    def append(self, instruction, robot):
+        """
+        Records one command
+
+        Args:
+            instruction (tuple): (opcode, x, y, f) instruction
+            robot (Robot): robot running the command. Robots not seen before get the next slot.
+        """
+        key = _robot_key(robot)
+        slot = self.slots.get(key)
+        if slot is None:
+            slot = self.slots[key] = len(self.robots)
+            self.robots.append(robot)
+        if self.command_count and self.command_count % self.snapshot_interval == 0:
+            self._append_snapshot()
+        buffer = self.buffer
+        encode_varint(instruction[0], buffer)
+        encode_varint(slot, buffer)
+        encode_arguments(instruction, robot.FACING_CODES, buffer)
+        self.command_count += 1
+        if len(buffer) >= self.buffer_size:
+            self.flush()
+        elif time.monotonic() - self.synced >= self.sync_interval: # slow sessions still reach the disk every interval
+            self.flush(sync=True)
+
+    def flush(self, sync=False):
+        """
+        Writes buffered records to the file and fsyncs it if sync_interval has passed
+
+        Args:
+            sync (bool, optional): fsync now regardless of the interval. Defaults to False.
+        """
+        if self.buffer:
+            self.file.write(self.buffer)
+            self.buffer.clear()
+        now = time.monotonic()
+        if sync or now - self.synced >= self.sync_interval:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.synced = now
+
+    def close(self):
+        """
+        Flushes and fsyncs the journal and stops recording
+        """
+        if self.file.closed:
+            return
+        if self in writers:
+            writers.remove(self)
+        self.flush(sync=True)
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class JournalReader:
+    """
+    Replay engine for a journal file. The file is indexed once; state_at then restores the nearest snapshot at or before
+    a command index and replays only the commands after it.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as journal_file:
+            self.data = journal_file.read()
+        if len(self.data) < len(HEADER) or self.data[:len(MAGIC)] != MAGIC:
+            raise ValueError("Not a robot simulator journal.")
+        self.version = self.data[len(MAGIC)]
+        if self.version not in SUPPORTED_VERSIONS:
+            raise ValueError(f"Unsupported journal version {self.version}.")
+        self.command_offsets = [] # byte offset of every command record
+        self.snapshots = [] # (offset, length) of every embedded snapshot
+        self.snapshot_indexes = [] # command index each snapshot was taken before, ascending
+        self._index()
+
+    def _index(self):
+        data = self.data
+        offset = len(HEADER)
+        while offset < len(data):
+            start = offset
+            try:
+                opcode, offset = decode_varint(data, offset)
+                if opcode == SNAPSHOT:
+                    command_index, offset = decode_varint(data, offset)
+                    length, offset = decode_varint(data, offset)
+                    if offset + length > len(data):
+                        raise IndexError
+                    self.snapshots.append((offset, length))
+                    self.snapshot_indexes.append(command_index)
+                    offset += length
+                    continue
+                slot, offset = decode_varint(data, offset)
+                instruction, offset = decode_arguments(opcode, data, offset, self.version)
+            except (IndexError, KeyError): # the process stopped in the middle of a write
+                logger.warning("Journal ends with a partial record after %s commands.", len(self.command_offsets))
+                break
+            self.command_offsets.append(start)
+
+    def __len__(self):
+        return len(self.command_offsets)
+
+    def command(self, index):
+        """
+        Decodes one command record
+
+        Args:
+            index (int): command index
+
+        Returns:
+            tuple: (robot slot, (opcode, x, y, f) instruction)
+        """
+        opcode, offset = decode_varint(self.data, self.command_offsets[index])
+        slot, offset = decode_varint(self.data, offset)
+        instruction, offset = decode_arguments(opcode, self.data, offset, self.version)
+        return slot, instruction
+
+    def state_at(self, index):
+        """
+        Rebuilds the board and robots as they were just before a command ran
+
+        Args:
+            index (int): command index, len(reader) for the final state
+
+        Returns:
+            tuple: (board, robots, outputs) where robots is a list of Robot objects in slot order and outputs
+            are the REPORT and DISTANCE outputs of the replayed commands as (command index, output)
+        """
+        from batch_runner import execute # batch_runner records into this module
+        from snapshot import load_snapshot
+        if not 0 <= index <= len(self.command_offsets):
+            raise IndexError(f"Command index {index} is outside the journal.")
+        nearest = max(bisect_right(self.snapshot_indexes, index) - 1, 0)
+        offset, length = self.snapshots[nearest]
+        board, robots = load_snapshot(self.data[offset:offset + length])
+        robots = list(robots)
+        outputs = []
+        for command_index in range(self.snapshot_indexes[nearest], index):
+            slot, instruction = self.command(command_index)
+            while slot >= len(robots):
+                robots.append(Robot())
+            for output in execute((instruction,), board, robots[slot]):
+                outputs.append((command_index, output))
+        return board, robots, outputs
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a toy robot journal")
+    parser.add_argument('path', metavar='FILE', help="journal file")
+    parser.add_argument('--at', type=int, help="stop before this command index, defaults to the end of the journal")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
+    logging.getLogger('robot').setLevel(logging.CRITICAL)
+    reader = JournalReader(args.path)
+    board, robots, outputs = reader.state_at(len(reader) if args.at is None else args.at)
+    for slot, robot in enumerate(robots):
+        print(f"robot {slot}: {robot.report() if robot.board is not None else 'not placed'}")
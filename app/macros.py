@@ -0,0 +1,198 @@
+import logging
+from bisect import bisect_left, bisect_right, insort
+
+import events
+from command_parser import OP_REPEAT, OP_STATS
+from robot import NO_FACING
+
+logger = logging.getLogger(__name__)
+
+# REPEAT remembers the robot state of this many iterations while looking for a cycle, then just steps the rest
+MAX_TRACKED_ITERATIONS = 4096
+
+
+class LineIndex:
+    """
+    Sorted occupied x values of every row and y values of every column, kept in sync through the board tile listeners.
+    Finds the first occupied tile in a straight line with one bisect, so MOVE n costs the same for any n.
+    """
+    def __init__(self, board):
+        self.board = board
+        self.rows = {} # y -> sorted occupied x values
+        self.columns = {} # x -> sorted occupied y values
+        for x, y in board.occupancy:
+            self.rows.setdefault(y, []).append(x)
+            self.columns.setdefault(x, []).append(y)
+        for line in self.rows.values():
+            line.sort()
+        for line in self.columns.values():
+            line.sort()
+        board.tile_listeners.append(self.tile_changed)
+
+    def tile_changed(self, x, y, occupied):
+        """
+        Board tile listener keeping the lines in sync
+
+        Args:
+            x (int): x axis value
+            y (int): y axis value
+            occupied (int): 1 if the tile is now occupied, 0 if it is now empty
+        """
+        for lines, line_key, value in ((self.rows, y, x), (self.columns, x, y)):
+            line = lines.get(line_key)
+            if occupied:
+                if line is None:
+                    lines[line_key] = [value]
+                else:
+                    insort(line, value)
+            elif line is not None:
+                index = bisect_left(line, value)
+                if index < len(line) and line[index] == value:
+                    del line[index]
+                    if not line:
+                        del lines[line_key]
+
+    def reach(self, x, y, dx, dy):
+        """
+        Number of free tiles from x,y in one axis direction before the board edge or the first occupied tile.
+        The tile x,y itself is not checked.
+
+        Args:
+            x (int): x axis value
+            y (int): y axis value
+            dx (int): x step, -1, 0 or 1
+            dy (int): y step, -1, 0 or 1 (exactly one of dx and dy is not 0)
+
+        Returns:
+            int: number of free tiles
+        """
+        if dx:
+            line, value, limit, step = self.rows.get(y), x, self.board.max_x, dx
+        else:
+            line, value, limit, step = self.columns.get(x), y, self.board.max_y, dy
+        if step > 0:
+            if line:
+                index = bisect_right(line, value)
+                if index < len(line):
+                    return line[index] - value - 1
+            return limit - value
+        if line:
+            index = bisect_left(line, value)
+            if index > 0:
+                return value - line[index - 1] - 1
+        return value
+
+
+def move_forward(robot, steps):
+    """
+    MOVE n. Moves the robot up to steps tiles along its facing in one jump, stopping at the board edge or before the
+    first occupied tile like n single MOVE commands would. Headings that are not one tile along an axis (e.g. diagonal
+    headings of a Robot subclass) are stepped one tile at a time.
+
+    Args:
+        robot (Robot): placed Robot object
+        steps (int): number of tiles
+
+    Returns:
+        int: number of tiles moved
+    """
+    code = robot.facing_code
+    dx, dy = robot.DX[code], robot.DY[code]
+    if steps <= 1 or abs(dx) + abs(dy) != 1:
+        moved = 0
+        while moved < steps and robot.move():
+            moved += 1
+        return moved
+    x, y = robot.x_axis, robot.y_axis
+    moved = min(steps, robot.board.line_index().reach(x, y, dx, dy))
+    if moved:
+        robot.move(x + dx * moved, y + dy * moved)
+    if moved < steps:
+        logger.info("MOVE %s stopped after %s tiles.", steps, moved)
+        if events.hooks:
+            events.emit((events.BLOCKED, robot, robot.x_axis + dx, robot.y_axis + dy))
+    return moved
+
+def _uses(instructions, opcode):
+    """
+    Returns:
+        Bool: True if opcode appears in the instructions or in any nested block
+    """
+    for instruction in instructions:
+        if instruction[0] == opcode or (instruction[0] == OP_REPEAT and _uses(instruction[2], opcode)):
+            return True
+    return False
+
+def _state(robot):
+    """
+    Returns:
+        tuple: (x, y, facing code) of the robot, (None, None, NO_FACING) when it is not placed
+    """
+    if robot.board is None:
+        return None, None, NO_FACING
+    return robot.x_axis, robot.y_axis, robot.facing_code
+
+def run_repeat(count, body, board, robot, run_body=None):
+    """
+    REPEAT k { body }. Runs the body count times.
+    A body only changes the robot's own position, facing and placement, so once the robot state at the start of an
+    iteration repeats, the remaining iterations follow the same cycle. They are fast-forwarded: their outputs are
+    replayed and the robot jumps to the state the last iteration ends in, without events for the skipped iterations.
+    Bodies with STATS are always stepped since their output changes every time.
+
+    Args:
+        count (int): number of iterations
+        body (tuple): (opcode, x, y, f) instructions
+        board (Board): Board object
+        robot (Robot): Robot object
+        run_body (callable, optional): runs the body once and returns its outputs as a list, e.g. the events of an
+            event stream. Defaults to batch_runner.execute without journaling.
+
+    Yields:
+        object: outputs of the iterations, by default REPORT output in x,y,f format, DISTANCE or STATS output
+    """
+    if run_body is None:
+        from batch_runner import execute # batch_runner runs REPEAT through this module
+        run_body = lambda: list(execute(body, board, robot, record=False))
+    tracking = not _uses(body, OP_STATS)
+    seen = {} # robot state -> first iteration starting in it
+    history = [] # (robot state, outputs) of every tracked iteration
+    iteration = 0
+    while iteration < count:
+        state = _state(robot)
+        if tracking:
+            first = seen.get(state)
+            if first is not None:
+                cycle = history[first:]
+                cycles, rest = divmod(count - iteration, len(cycle))
+                logger.info("REPEAT cycle of %s iterations found, fast-forwarding %s iterations.", len(cycle),
+                            count - iteration)
+                cycle_outputs = [output for cycle_state, outputs in cycle for output in outputs]
+                if cycle_outputs:
+                    for _ in range(cycles):
+                        yield from cycle_outputs
+                for cycle_state, outputs in cycle[:rest]:
+                    yield from outputs
+                if rest:
+                    _jump(robot, cycle[rest][0])
+                return
+            if len(history) < MAX_TRACKED_ITERATIONS:
+                seen[state] = iteration
+            else:
+                tracking = False
+                history = None
+        outputs = run_body()
+        if tracking:
+            history.append((state, outputs))
+        yield from outputs
+        iteration += 1
+
+def _jump(robot, state):
+    """
+    Puts a placed robot in a state it was in earlier in the same REPEAT. The tile is free since the body only moves
+    this robot.
+    """
+    x, y, code = state
+    if (x, y) != (robot.x_axis, robot.y_axis):
+        robot.move(x, y)
+    robot.facing_code = code
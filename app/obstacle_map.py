@@ -0,0 +1,90 @@
+import logging
+
+from occupancy import numpy
+
+logger = logging.getLogger(__name__)
+
+# text map characters, anything else is an invalid cell
+BLOCKED_CHARS = b'#1'
+FREE_CHARS = b'.0'
+INVALID_CELL = 2
+# byte -> 1 obstacle, 0 free, INVALID_CELL for anything else
+_TEXT_TABLE = bytes(1 if byte in BLOCKED_CHARS else 0 if byte in FREE_CHARS else INVALID_CELL for byte in range(256))
+
+
+def _read_pgm(data):
+    """
+    Parses a plain (P2) or raw (P5) PGM image. Dark pixels (below half of the max value) are obstacles.
+
+    Args:
+        data (bytes): file contents
+
+    Returns:
+        list or numpy.ndarray: mask rows, top row first
+    """
+    fields = []
+    position = 2
+    while len(fields) < 3:
+        while position < len(data) and data[position:position + 1].isspace():
+            position += 1
+        if data[position:position + 1] == b'#': # comment until the end of the line
+            end = data.find(b'\n', position)
+            position = len(data) if end < 0 else end + 1
+            continue
+        start = position
+        while position < len(data) and not data[position:position + 1].isspace():
+            position += 1
+        if start == position:
+            raise ValueError("Truncated PGM header.")
+        fields.append(int(data[start:position]))
+    width, height, max_value = fields
+    threshold = (max_value + 1) // 2
+    count = width * height
+    if data[:2] == b'P5':
+        position += 1 # single whitespace after the header
+        sample_size = 1 if max_value < 256 else 2
+        pixels = data[position:position + count * sample_size]
+        if len(pixels) != count * sample_size:
+            raise ValueError("Truncated PGM pixel data.")
+        if numpy is not None:
+            values = numpy.frombuffer(pixels, dtype=numpy.uint8 if sample_size == 1 else '>u2')
+            return (values < threshold).reshape(height, width)
+        if sample_size == 2:
+            values = [int.from_bytes(pixels[index:index + 2], 'big') for index in range(0, len(pixels), 2)]
+        else:
+            values = pixels
+    else:
+        values = [int(value) for value in data[position:].split()]
+        if len(values) != count:
+            raise ValueError("PGM pixel count does not match its size.")
+        if numpy is not None:
+            return (numpy.array(values) < threshold).reshape(height, width)
+    return [bytes(value < threshold for value in values[row * width:(row + 1) * width]) for row in range(height)]
+
+
+def read_obstacle_map(path):
+    """
+    Reads an obstacle map file. PGM images (P2/P5) are detected by their magic number, anything else is read as
+    text with one line per row, '#' or '1' for obstacles and '.' or '0' for free tiles.
+    The first row of the file is the top row of the map.
+
+    Args:
+        path (str): map file path
+
+    Returns:
+        tuple: (mask, invalid) where mask is a list of rows (or a NumPy boolean array) and invalid is
+        the number of unknown characters in a text map
+    """
+    with open(path, 'rb') as map_file:
+        data = map_file.read()
+    if data[:2] in (b'P2', b'P5'):
+        return _read_pgm(data), 0
+    mask = []
+    invalid = 0
+    for line in data.splitlines():
+        row = line.translate(_TEXT_TABLE)
+        if INVALID_CELL in row:
+            invalid += row.count(INVALID_CELL)
+            row = row.replace(bytes([INVALID_CELL]), b'\0')
+        mask.append(row)
+    return mask, invalid
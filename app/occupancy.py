@@ -0,0 +1,356 @@
+try:
+    import numpy
+except ImportError: # numpy is optional, bulk loads fall back to plain loops
+    numpy = None
+
+
+class SetOccupancy:
+    """
+    Occupancy index backed by a set of packed coordinates. Best for large and sparsely occupied boards.
+    """
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.cells = set()
+
+    def add(self, x, y):
+        """
+        Marks x,y as occupied
+
+        Args:
+            x (int): x axis value
+            y (int): y axis value
+        """
+        self.cells.add(y * self.width + x)
+
+    def discard(self, x, y):
+        """
+        Marks x,y as empty
+
+        Args:
+            x (int): x axis value
+            y (int): y axis value
+        """
+        self.cells.discard(y * self.width + x)
+
+    def contains(self, x, y):
+        """
+        Checks if x,y is occupied
+
+        Args:
+            x (int): x axis value
+            y (int): y axis value
+
+        Returns:
+            Bool: True or False
+        """
+        return (y * self.width + x) in self.cells
+
+    def add_keys(self, keys):
+        """
+        Marks many tiles as occupied in one pass
+
+        Args:
+            keys (iterable): packed tile keys (y * width + x) inside the board
+
+        Returns:
+            int: number of tiles that were empty before
+        """
+        before = len(self.cells)
+        self.cells.update(keys.tolist() if numpy is not None and isinstance(keys, numpy.ndarray) else keys)
+        return len(self.cells) - before
+
+    def nbytes(self):
+        """
+        Rough memory estimate of the index in bytes. Used to decide when a bitmap would be smaller.
+
+        Returns:
+            int: estimated size in bytes
+        """
+        return len(self.cells) * SET_ENTRY_BYTES
+
+    def __len__(self):
+        return len(self.cells)
+
+    def __iter__(self):
+        width = self.width
+        for key in self.cells:
+            yield key % width, key // width
+
+
+class BitmapOccupancy:
+    """
+    Occupancy index backed by a dense bitmap with one bit per tile. Best for small or densely occupied boards.
+    """
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.bits = bytearray((width * height + 7) // 8)
+        self.count = 0
+
+    def add(self, x, y):
+        """
+        Marks x,y as occupied
+
+        Args:
+            x (int): x axis value
+            y (int): y axis value
+        """
+        key = y * self.width + x
+        mask = 1 << (key & 7)
+        if not self.bits[key >> 3] & mask:
+            self.bits[key >> 3] |= mask
+            self.count += 1
+
+    def discard(self, x, y):
+        """
+        Marks x,y as empty
+
+        Args:
+            x (int): x axis value
+            y (int): y axis value
+        """
+        key = y * self.width + x
+        mask = 1 << (key & 7)
+        if self.bits[key >> 3] & mask:
+            self.bits[key >> 3] &= ~mask
+            self.count -= 1
+
+    def contains(self, x, y):
+        """
+        Checks if x,y is occupied
+
+        Args:
+            x (int): x axis value
+            y (int): y axis value
+
+        Returns:
+            Bool: True or False
+        """
+        key = y * self.width + x
+        return bool(self.bits[key >> 3] & (1 << (key & 7)))
+
+    def begin_write(self):
+        """
+        Called before writing to bits directly (e.g. the NumPy step engine). Nothing to do for a private bitmap,
+        shared bitmaps bump their sequence counter.
+        """
+
+    def end_write(self):
+        """
+        Called after writing to bits directly
+        """
+
+    def add_keys(self, keys):
+        """
+        Marks many tiles as occupied in one pass. NumPy key arrays are packed into the bitmap without a Python loop.
+
+        Args:
+            keys (iterable): packed tile keys (y * width + x) inside the board
+
+        Returns:
+            int: number of tiles that were empty before
+        """
+        before = self.count
+        if numpy is not None and isinstance(keys, numpy.ndarray):
+            tiles = numpy.zeros(len(self.bits) * 8, dtype=bool)
+            tiles[keys] = True
+            merged = numpy.frombuffer(self.bits, dtype=numpy.uint8) | numpy.packbits(tiles, bitorder='little')
+            self.bits[:] = merged.tobytes()
+            self.count = int(numpy.unpackbits(merged).sum())
+        else:
+            bits = self.bits
+            for key in keys:
+                mask = 1 << (key & 7)
+                if not bits[key >> 3] & mask:
+                    bits[key >> 3] |= mask
+                    self.count += 1
+        return self.count - before
+
+    def nbytes(self):
+        """
+        Memory size of the bitmap in bytes
+
+        Returns:
+            int: size in bytes
+        """
+        return len(self.bits)
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        width = self.width
+        for index, byte in enumerate(self.bits):
+            if byte:
+                for bit in range(8):
+                    if byte & (1 << bit):
+                        key = (index << 3) + bit
+                        yield key % width, key // width
+
+
+class ChunkedOccupancy:
+    """
+    Occupancy index made of fixed-size square chunks, each a small bitmap allocated on demand and freed when empty.
+    Memory scales with the occupied area instead of the board area.
+    """
+    def __init__(self, width, height, chunk_size=64):
+        if chunk_size <= 0 or chunk_size & (chunk_size - 1):
+            raise ValueError("chunk_size must be a power of two.")
+        self.width = width
+        self.height = height
+        self.chunk_size = chunk_size
+        self.shift = chunk_size.bit_length() - 1
+        self.mask = chunk_size - 1
+        self.chunks_per_row = (width + chunk_size - 1) >> self.shift
+        self.chunks = {} # chunk key -> [tile count, bitmap]
+        self.count = 0
+
+    def _locate(self, x, y):
+        """
+        Returns:
+            tuple: (chunk key, tile index inside the chunk)
+        """
+        shift = self.shift
+        return (y >> shift) * self.chunks_per_row + (x >> shift), ((y & self.mask) << shift) | (x & self.mask)
+
+    def add(self, x, y):
+        """
+        Marks x,y as occupied
+
+        Args:
+            x (int): x axis value
+            y (int): y axis value
+        """
+        chunk_key, tile = self._locate(x, y)
+        chunk = self.chunks.get(chunk_key)
+        if chunk is None:
+            chunk = self.chunks[chunk_key] = [0, bytearray((self.chunk_size * self.chunk_size) >> 3)]
+        mask = 1 << (tile & 7)
+        if not chunk[1][tile >> 3] & mask:
+            chunk[1][tile >> 3] |= mask
+            chunk[0] += 1
+            self.count += 1
+
+    def discard(self, x, y):
+        """
+        Marks x,y as empty. Frees the chunk when its last tile is emptied.
+
+        Args:
+            x (int): x axis value
+            y (int): y axis value
+        """
+        chunk_key, tile = self._locate(x, y)
+        chunk = self.chunks.get(chunk_key)
+        mask = 1 << (tile & 7)
+        if chunk is not None and chunk[1][tile >> 3] & mask:
+            chunk[1][tile >> 3] &= ~mask
+            chunk[0] -= 1
+            self.count -= 1
+            if not chunk[0]:
+                del self.chunks[chunk_key]
+
+    def contains(self, x, y):
+        """
+        Checks if x,y is occupied
+
+        Args:
+            x (int): x axis value
+            y (int): y axis value
+
+        Returns:
+            Bool: True or False
+        """
+        chunk_key, tile = self._locate(x, y)
+        chunk = self.chunks.get(chunk_key)
+        return chunk is not None and bool(chunk[1][tile >> 3] & (1 << (tile & 7)))
+
+    def add_keys(self, keys):
+        """
+        Marks many tiles as occupied
+
+        Args:
+            keys (iterable): packed tile keys (y * width + x) inside the board
+
+        Returns:
+            int: number of tiles that were empty before
+        """
+        before = self.count
+        width = self.width
+        for key in (keys.tolist() if numpy is not None and isinstance(keys, numpy.ndarray) else keys):
+            self.add(key % width, key // width)
+        return self.count - before
+
+    def nbytes(self):
+        """
+        Memory size of the allocated chunk bitmaps in bytes
+
+        Returns:
+            int: size in bytes
+        """
+        return len(self.chunks) * ((self.chunk_size * self.chunk_size) >> 3)
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        shift = self.shift
+        for chunk_key, (count, bits) in self.chunks.items():
+            base_x = (chunk_key % self.chunks_per_row) << shift
+            base_y = (chunk_key // self.chunks_per_row) << shift
+            for index, byte in enumerate(bits):
+                if byte:
+                    for bit in range(8):
+                        if byte & (1 << bit):
+                            tile = (index << 3) + bit
+                            yield base_x + (tile & self.mask), base_y + (tile >> shift)
+
+
+# approximate cost of one packed int inside a set (int object + hash table slot)
+SET_ENTRY_BYTES = 64
+# boards whose bitmap fits in this many bytes always start with a bitmap
+BITMAP_MAX_BYTES = 1 << 20
+
+
+def bitmap_nbytes(width, height):
+    """
+    Size in bytes of a bitmap covering a width x height board
+
+    Returns:
+        int: size in bytes
+    """
+    return (width * height + 7) // 8
+
+
+def choose_occupancy(width, height):
+    """
+    Picks the backing store for a new board. Small boards get a bitmap, large boards start as a set.
+
+    Args:
+        width (int): board width
+        height (int): board height
+
+    Returns:
+        SetOccupancy or BitmapOccupancy: empty occupancy index
+    """
+    if bitmap_nbytes(width, height) <= BITMAP_MAX_BYTES:
+        return BitmapOccupancy(width, height)
+    return SetOccupancy(width, height)
+
+
+def maybe_promote(occupancy):
+    """
+    Converts a set index into a bitmap once the set has become larger than the equivalent bitmap
+
+    Args:
+        occupancy (SetOccupancy or BitmapOccupancy): current index
+
+    Returns:
+        SetOccupancy or BitmapOccupancy: index to keep using
+    """
+    if isinstance(occupancy, SetOccupancy) and occupancy.nbytes() > bitmap_nbytes(occupancy.width, occupancy.height):
+        bitmap = BitmapOccupancy(occupancy.width, occupancy.height)
+        for x, y in occupancy:
+            bitmap.add(x, y)
+        return bitmap
+    return occupancy
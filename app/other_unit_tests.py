@@ -1,9 +1,43 @@
+import json
 import logging
 import unittest
 
 from start_app import run_command
+from batch_runner import run_batch
+from fleet import Fleet, numpy
+from step_engine import step_scalar, step_numpy, OP_NONE
+from command_parser import (OP_MOVE, OP_LEFT, OP_RIGHT, OP_PLACE, OP_GOTO, OP_REPORT, OP_REPEAT, compile_command,
+                            compile_program, block_depth)
+from batch_runner import run_program
+import random
+import events
+from sparse_board import SparseBoard
+from snapshot import dump_snapshot, load_snapshot, save_snapshot, SnapshotReader
+import os
+import tempfile
+import tracemalloc
+import time
+import benchmarks
+import asyncio
+from server import SimulatorServer, TokenBucket
+from scenario_runner import run_scenarios, summarize
+from path_planner import plan_path
+from distance_field import DistanceField, search_distance
+from scheduler import TickScheduler
+from spatial_index import SpatialIndex
+from sharded_fleet import ShardedFleet
+from shared_board import SharedBoard, SharedBoardReader
+from event_stream import (iter_events, aiter_events, NdjsonSink, CsvSink, BinarySink, iter_binary_events,
+                          open_sink)
+import io
+import csv
+import instrumentation
+import start_app
+from journal import Journal, JournalReader, encode_varint, decode_varint
 from board import Board
-from robot import Robot
+from robot import Robot, NO_FACING
+from occupancy import BitmapOccupancy, SetOccupancy
+import occupancy
 
 
 logging.basicConfig(level=logging.CRITICAL)
@@ -324,5 +358,1186 @@ class TestExamples(unittest.TestCase):
         result = run_command('REPORT', b1, r1)
         self.assertEqual(result,'4,0,SOUTH')
 
+class TestBoardOccupancy(unittest.TestCase):
+    # Small boards are backed by a bitmap
+    def test_small_board_uses_bitmap(self):
+        b1 = Board(board_size)
+        self.assertIsInstance(b1.occupancy, BitmapOccupancy)
+
+    # Add, check and remove obstructions through the occupancy index
+    def test_add_remove_obstruction(self):
+        b1 = Board(board_size)
+        self.assertTrue(b1.add_obstruction(1,2))
+        self.assertFalse(b1.add_obstruction(1,2))
+        self.assertEqual(b1.obstructions, [[1,2]])
+        self.assertTrue(b1.remove_obstruction(1,2))
+        self.assertFalse(b1.remove_obstruction(1,2))
+        self.assertEqual(b1.obstructions, [])
+
+    # Out of bounds coordinates must not alias a valid tile in the packed index
+    def test_remove_out_of_bounds_obstruction(self):
+        b1 = Board(board_size)
+        b1.add_obstruction(0,1)
+        self.assertFalse(b1.remove_obstruction(board_size,0))
+        self.assertEqual(b1.obstructions, [[0,1]])
+
+    # Int-like coordinates pass the same emptiness check as ints, so a tile cannot be taken twice
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_int_like_coordinates(self):
+        b1 = Board(board_size)
+        self.assertTrue(b1.add_obstruction(1,1))
+        self.assertFalse(b1.add_obstruction(numpy.int64(1), numpy.int64(1)))
+        self.assertTrue(b1.add_obstruction(numpy.int64(2), numpy.int64(3)))
+        self.assertEqual(b1.obstructions, [[1,1], [2,3]])
+        self.assertIs(type(b1.obstructions[1][0]), int)
+        self.assertTrue(b1.remove_obstruction(numpy.int64(2), numpy.int64(3)))
+
+    # Large boards start with a set and switch to a bitmap once it would be smaller
+    def test_large_board_promotes_to_bitmap(self):
+        old_max = occupancy.BITMAP_MAX_BYTES
+        occupancy.BITMAP_MAX_BYTES = 0
+        try:
+            b1 = Board(16)
+            self.assertIsInstance(b1.occupancy, SetOccupancy)
+            b1.add_obstruction(0,0)
+            self.assertIsInstance(b1.occupancy, BitmapOccupancy)
+            self.assertEqual(b1.obstructions, [[0,0]])
+        finally:
+            occupancy.BITMAP_MAX_BYTES = old_max
+
+class TestBoardState(unittest.TestCase):
+    # Cached board state should follow add/remove of obstructions
+    def test_incremental_board_state(self):
+        b1 = Board(3)
+        b1.add_obstruction(0,0)
+        self.assertEqual(b1.get_board_state(), [[0,0,0],[0,0,0],[1,0,0]])
+        b1.add_obstruction(2,2)
+        b1.remove_obstruction(0,0)
+        self.assertEqual(b1.get_board_state(), [[0,0,1],[0,0,0],[0,0,0]])
+        self.assertEqual(b1.get_board_rows(), [bytes([0,0,1]), bytes(3), bytes(3)])
+
+    # Returned state is a copy, changing it must not change the board
+    def test_board_state_is_copy(self):
+        b1 = Board(3)
+        b1.get_board_state()[0][0] = 1
+        self.assertEqual(b1.obstructions, [])
+        self.assertEqual(b1.get_board_state()[0][0], 0)
+
+    # Window queries are clipped to the board
+    def test_board_window(self):
+        b1 = Board(board_size)
+        b1.add_obstruction(0,0)
+        b1.add_obstruction(1,1)
+        self.assertEqual(b1.get_board_window(0,0,1), [[0,1],[1,0]])
+        self.assertEqual(b1.get_board_window(3,3,1), [[0,0,0],[0,0,0],[0,0,0]])
+
+class TestEventsAndLogging(unittest.TestCase):
+    # Event hooks receive plain tuples for every robot action
+    def test_event_ring(self):
+        ring = events.EventRing(maxlen=3)
+        events.add_hook(ring)
+        try:
+            b1 = Board(board_size)
+            r1 = Robot()
+            run_command('PLACE 0,0,SOUTH', b1, r1)
+            run_command('MOVE', b1, r1)
+            run_command('LEFT', b1, r1)
+            run_command('MOVE', b1, r1)
+            run_command('REPORT', b1, r1)
+        finally:
+            events.remove_hook(ring)
+        self.assertEqual([event[0] for event in ring], [events.ROTATED, events.MOVED, events.REPORTED])
+        self.assertEqual(ring.events[1][2:], (0, 0, 1, 0))
+
+    # Blocked moves are reported as events and return False
+    def test_blocked_event(self):
+        ring = events.EventRing()
+        events.add_hook(ring)
+        try:
+            b1 = Board(board_size)
+            r1 = Robot()
+            run_command('PLACE 0,0,SOUTH', b1, r1)
+            self.assertFalse(r1.move())
+        finally:
+            events.remove_hook(ring)
+        self.assertEqual(ring.counts(), {events.PLACED: 1, events.BLOCKED: 1})
+
+    # The board is not rendered by REPORT unless DEBUG logging is enabled
+    def test_report_skips_board_dump(self):
+        class CountingBoard(Board):
+            renders = 0
+            def get_board_state(self):
+                CountingBoard.renders += 1
+                return Board.get_board_state(self)
+        b1 = CountingBoard(board_size)
+        r1 = Robot()
+        run_command('PLACE 0,0,NORTH', b1, r1)
+        run_command('REPORT', b1, r1)
+        self.assertEqual(CountingBoard.renders, 0)
+
+class TestSparseBoard(unittest.TestCase):
+    # Robots work unchanged on a huge rectangular sparse board
+    def test_robot_on_large_rectangular_board(self):
+        b1 = SparseBoard(10**6, 10**5)
+        r1 = Robot()
+        run_command('PLACE 999999,99999,NORTH', b1, r1)
+        run_command('MOVE', b1, r1)
+        run_command('LEFT', b1, r1)
+        run_command('MOVE', b1, r1)
+        self.assertEqual(run_command('REPORT', b1, r1), '999998,99999,WEST')
+        self.assertEqual(run_command('PLACE 0,100000,NORTH', b1, r1), False)
+
+    # Sparse boards are set up by Board.__init__, so they get every board attribute
+    def test_board_attributes(self):
+        b1 = SparseBoard(8, 4)
+        self.assertTrue(set(vars(Board(4))) <= set(vars(b1)))
+        self.assertEqual((b1.size, b1.max_x, b1.max_y), (None, 7, 3))
+        self.assertEqual(SparseBoard(4).size, 4)
+
+    # Chunks are allocated on demand and freed once empty
+    def test_chunks_allocated_on_demand(self):
+        b1 = SparseBoard(10**6, chunk_size=64)
+        b1.add_obstruction(0,0)
+        b1.add_obstruction(63,63)
+        b1.add_obstruction(500000,500000)
+        self.assertEqual(len(b1.occupancy.chunks), 2)
+        self.assertEqual(sorted(b1.obstructions), [[0,0],[63,63],[500000,500000]])
+        b1.remove_obstruction(500000,500000)
+        self.assertEqual(len(b1.occupancy.chunks), 1)
+        self.assertEqual(b1.get_board_window(0,0,1), [[0,0],[1,0]])
+        with self.assertRaises(ValueError):
+            b1.get_board_state()
+
+    # Small sparse boards render the same as a regular board
+    def test_small_sparse_board_state(self):
+        b1 = SparseBoard(3, 2)
+        b1.add_obstruction(2,1)
+        self.assertEqual(b1.get_board_state(), [[0,0,1],[0,0,0]])
+
+class DiagonalRobot(Robot):
+    HEADINGS = (
+        ("NORTH", 0, 1), ("NORTHEAST", 1, 1), ("EAST", 1, 0), ("SOUTHEAST", 1, -1),
+        ("SOUTH", 0, -1), ("SOUTHWEST", -1, -1), ("WEST", -1, 0), ("NORTHWEST", -1, 1),
+    )
+
+class TestSnapshot(unittest.TestCase):
+    # Board, obstructions and robots survive a save/load round trip through a file
+    def test_file_round_trip(self):
+        b1 = Board(board_size)
+        r1 = Robot()
+        r2 = Robot()
+        run_command('PLACE 1,2,EAST', b1, r1)
+        b1.add_obstruction(4,4)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'state.snap')
+            save_snapshot(path, b1, [r1, r2])
+            b2, robots = load_snapshot(path)
+            with SnapshotReader(path) as reader:
+                self.assertEqual(reader.robot_state(0), (1, 2, Robot.FACING_CODES['EAST']))
+                self.assertIsNone(reader.robot_state(1))
+        self.assertEqual(sorted(b2.obstructions), [[1,2],[4,4]])
+        self.assertEqual(run_command('REPORT', b2, robots[0]), '1,2,EAST')
+        self.assertIsNone(robots[1].board)
+        run_command('MOVE', b2, robots[0])
+        self.assertEqual(run_command('REPORT', b2, robots[0]), '2,2,EAST')
+
+    # Sparse boards and fleets keep their type
+    def test_sparse_fleet_round_trip(self):
+        fleet = Fleet(SparseBoard(10**6, 10), 2)
+        fleet.run_command(1, 'PLACE 999999,9,WEST')
+        b2, fleet2 = load_snapshot(dump_snapshot(fleet.board, fleet))
+        self.assertIsInstance(b2, SparseBoard)
+        self.assertEqual((b2.width, b2.height), (10**6, 10))
+        self.assertEqual(fleet2.placed_ids(), [1])
+        self.assertEqual(fleet2.run_command(1, 'REPORT'), '999999,9,WEST')
+
+    # Rectangular dense boards keep their height
+    def test_rectangular_round_trip(self):
+        b1 = Board(4, 7)
+        r1 = Robot()
+        run_command('PLACE 3,6,NORTH', b1, r1)
+        b2, robots = load_snapshot(dump_snapshot(b1, [r1]))
+        self.assertEqual((b2.width, b2.height), (4, 7))
+        self.assertEqual(sorted(b2.obstructions), [[3,6]])
+        self.assertEqual(run_command('REPORT', b2, robots[0]), '3,6,NORTH')
+
+    # Robots come back as their own class, so subclass headings survive
+    def test_robot_subclass_round_trip(self):
+        b1 = Board(board_size)
+        r1, r2 = DiagonalRobot(), Robot()
+        run_command('PLACE 1,1,NORTHEAST', b1, r1)
+        run_command('PLACE 3,1,WEST', b1, r2)
+        b2, robots = load_snapshot(dump_snapshot(b1, [r1, r2]))
+        self.assertEqual([type(robot) for robot in robots], [DiagonalRobot, Robot])
+        self.assertEqual(run_command('REPORT', b2, robots[0]), '1,1,NORTHEAST')
+        run_command('MOVE', b2, robots[0])
+        self.assertEqual(run_command('REPORT', b2, robots[0]), '2,2,NORTHEAST')
+        class LocalRobot(Robot):
+            pass
+        with self.assertRaises(ValueError):
+            dump_snapshot(b1, [LocalRobot()])
+
+    # Files written before robot classes were saved restore base robots
+    def test_version_1_snapshot(self):
+        b1 = Board(board_size)
+        r1 = Robot()
+        run_command('PLACE 1,2,EAST', b1, r1)
+        data = bytearray(dump_snapshot(b1, [r1])[:-(2 + 2 + len('robot:Robot') + 2)])
+        data[4] = 1
+        b2, robots = load_snapshot(bytes(data))
+        self.assertEqual(run_command('REPORT', b2, robots[0]), '1,2,EAST')
+
+    # Corrupt data is rejected
+    def test_invalid_snapshot(self):
+        with self.assertRaises(ValueError):
+            load_snapshot(b'not a snapshot at all, just some bytes')
+        with self.assertRaises(ValueError):
+            load_snapshot(dump_snapshot(Board(board_size), [Robot()])[:-1])
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'other.snap')
+            with open(path, 'wb') as other_file:
+                other_file.write(b'x' * 64)
+            with self.assertRaises(ValueError):
+                SnapshotReader(path)
+
+class TestBenchmarks(unittest.TestCase):
+    # Smoke test of the benchmark harness with tiny operation counts
+    def test_run_benchmarks(self):
+        report = benchmarks.run_benchmarks(scale=0.0001, repeat=1)
+        names = {result["name"] for result in report["results"]}
+        self.assertTrue({"run_command", "robot_move", "robot_rotate", "add_remove_obstruction", "get_board_state", "report"} <= names)
+        self.assertTrue(all(result["ops"] >= 1 for result in report["results"]))
+        self.assertEqual(len(benchmarks.compare_results(report, report)), len(report["results"]))
+
+    # Benchmarked tiles never touch the pre-filled obstructions, so every run measures the same board
+    def test_obstructions_keep_filled_count(self):
+        body = benchmarks.bench_obstructions(500, 20, 390)
+        body()
+        body()
+
+class TestServer(unittest.TestCase):
+    # Pipelined commands over TCP get their REPORT replies, robots on a shared board collide
+    def test_shared_board_connections(self):
+        async def scenario():
+            simulator = SimulatorServer(board_size, shared_board=True)
+            server = await simulator.start_tcp()
+            port = server.sockets[0].getsockname()[1]
+            reader1, writer1 = await asyncio.open_connection('127.0.0.1', port)
+            writer1.write(b'PLACE 0,0,NORTH\nMOVE\nREPORT\n')
+            first = await reader1.readline()
+            reader2, writer2 = await asyncio.open_connection('127.0.0.1', port)
+            writer2.write(b'place 0,0,north\nPLACE 0,2,SOUTH\nMOVE\nREPORT\nEXIT\n')
+            second = await reader2.read()
+            writer1.write(b'EXIT\n')
+            await reader1.read()
+            writer1.close()
+            writer2.close()
+            await simulator.close()
+            return first, second, simulator.board.obstructions
+        first, second, obstructions = asyncio.run(scenario())
+        self.assertEqual(first, b'0,1,NORTH\n')
+        self.assertEqual(second, b'0,2,SOUTH\n')
+        self.assertEqual(obstructions, [])
+
+    # The token bucket asks to wait once the burst is used up
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=100, burst=10)
+        self.assertEqual(bucket.delay(10), 0.0)
+        self.assertGreater(bucket.delay(5), 0.04)
+
+class TestScenarioRunner(unittest.TestCase):
+    # Scenarios run in worker processes and come back in input order
+    def test_run_scenarios(self):
+        scenarios = ['PLACE 0,0,NORTH\nMOVE\nREPORT\n', 'PLACE 0,0,NORTH\nLEFT\nREPORT\n',
+                     'PLACE 1,2,EAST\nMOVE\nMOVE\nLEFT\nMOVE\nREPORT\nbad command\n']
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = []
+            for index, scenario in enumerate(scenarios):
+                path = os.path.join(tmp_dir, f'scenario_{index}.txt')
+                with open(path, 'w') as scenario_file:
+                    scenario_file.write(scenario)
+                paths.append(path)
+            paths.append(os.path.join(tmp_dir, 'missing.txt'))
+            results = list(run_scenarios(paths, workers=2, chunksize=1))
+        self.assertEqual([result.final for result in results], ['0,1,NORTH', '0,0,WEST', '3,3,NORTH', None])
+        summary = summarize(results)
+        self.assertEqual((summary["scenarios"], summary["failures"], summary["invalid_lines"]), (4, 1, 1))
+
+class TestPathPlanner(unittest.TestCase):
+    # GOTO walks around obstructions and ends on the requested facing
+    def test_goto_around_wall(self):
+        b1 = Board(board_size)
+        r1 = Robot()
+        for y in range(4):
+            b1.add_obstruction(2,y)
+        run_command('PLACE 0,0,NORTH', b1, r1)
+        self.assertTrue(run_command('GOTO 4,0,SOUTH', b1, r1))
+        self.assertEqual(run_command('REPORT', b1, r1), '4,0,SOUTH')
+
+    # The plan is the shortest command sequence, turns included
+    def test_shortest_plan(self):
+        b1 = Board(board_size)
+        r1 = Robot()
+        run_command('PLACE 0,0,EAST', b1, r1)
+        self.assertEqual(plan_path(b1, r1, 2, 1), ('MOVE', 'MOVE', 'LEFT', 'MOVE'))
+        self.assertEqual(plan_path(b1, r1, 0, 0, 'WEST'), ('LEFT', 'LEFT'))
+
+    # Unreachable or occupied targets are rejected without moving the robot
+    def test_unreachable_target(self):
+        b1 = Board(board_size)
+        r1 = Robot()
+        b1.add_obstruction(3,4)
+        b1.add_obstruction(4,3)
+        run_command('PLACE 0,0,NORTH', b1, r1)
+        self.assertFalse(run_command('GOTO 4,4', b1, r1))
+        self.assertFalse(run_command('GOTO 3,4', b1, r1))
+        self.assertFalse(run_command('GOTO 9,9', b1, r1))
+        self.assertEqual(run_command('REPORT', b1, r1), '0,0,NORTH')
+
+    # Plans are cached until the board changes
+    def test_plan_cache(self):
+        b1 = Board(board_size)
+        r1 = Robot()
+        run_command('PLACE 0,0,NORTH', b1, r1)
+        plan = plan_path(b1, r1, 4, 4)
+        self.assertIs(plan_path(b1, r1, 4, 4), plan)
+        b1.add_obstruction(0,1)
+        self.assertNotEqual(plan_path(b1, r1, 4, 4), plan)
+
+    # The robot's own moves keep its cached plans, other robots' moves do not
+    def test_plan_cache_ignores_own_moves(self):
+        b1 = Board(board_size)
+        r1, r2 = Robot(), Robot()
+        run_command('PLACE 0,0,NORTH', b1, r1)
+        run_command('PLACE 4,0,NORTH', b1, r2)
+        plan = plan_path(b1, r1, 3, 3)
+        run_command('MOVE', b1, r1)
+        run_command('PLACE 0,0,NORTH', b1, r1)
+        self.assertIs(plan_path(b1, r1, 3, 3), plan)
+        run_command('MOVE', b1, r2)
+        self.assertIsNot(plan_path(b1, r1, 3, 3), plan)
+        self.assertEqual(plan_path(b1, r1, 3, 3), plan)
+
+class TestDistanceField(unittest.TestCase):
+    # DISTANCE counts moves around obstructions and ignores the robot's own tile
+    def test_distance_command(self):
+        b1 = Board(board_size)
+        r1 = Robot()
+        for y in range(4):
+            b1.add_obstruction(2,y)
+        self.assertFalse(run_command('DISTANCE 4,0', b1, r1))
+        run_command('PLACE 0,0,NORTH', b1, r1)
+        self.assertEqual(run_command('DISTANCE 4,0', b1, r1), '12')
+        self.assertEqual(run_command('DISTANCE 0,0', b1, r1), '0')
+        self.assertEqual(run_command('DISTANCE 2,0', b1, r1), '-1')
+        self.assertEqual(run_command('DISTANCE 9,9', b1, r1), '-1')
+        self.assertEqual(run_program('PLACE 0,0,NORTH\nDISTANCE 1,1\n', Board(board_size), Robot()), ['2'])
+
+    # Boards too large for a distance field are searched from the robot and agree with the field on small boards
+    def test_large_board_distance(self):
+        b1 = SparseBoard(10**6)
+        r1 = Robot()
+        for y in range(5):
+            b1.add_obstruction(500001,y)
+        run_command('PLACE 500000,0,NORTH', b1, r1)
+        self.assertEqual(run_batch(['DISTANCE 500002,0', 'DISTANCE 500001,0', 'REPORT'], b1, r1), ['12', '-1', '500000,0,NORTH'])
+        self.assertEqual(search_distance(b1, 500000, 0, 500002, 0, max_expansions=5), -1)
+        rng = random.Random(15)
+        for _ in range(20):
+            b2 = Board(10)
+            for _ in range(30):
+                b2.add_obstruction(rng.randrange(10), rng.randrange(10))
+            from_x, from_y, to_x, to_y = (rng.randrange(10) for _ in range(4))
+            if (from_x, from_y) != (to_x, to_y):
+                self.assertEqual(search_distance(b2, from_x, from_y, to_x, to_y), b2.distance(from_x, from_y, to_x, to_y))
+
+    # Incremental updates give the same distances as a field built from scratch
+    def test_incremental_updates(self):
+        rng = random.Random(15)
+        b1 = Board(12)
+        field = b1.distance_field([(3,5), (9,1)])
+        for _ in range(400):
+            x, y = rng.randrange(12), rng.randrange(12)
+            if b1.occupancy.contains(x,y):
+                b1.remove_obstruction(x,y)
+            else:
+                b1.add_obstruction(x,y)
+            self.assertEqual(field.distances, DistanceField(b1, [(3,5), (9,1)]).distances)
+
+    # Fields are cached per target set
+    def test_field_cache(self):
+        b1 = Board(board_size)
+        field = b1.distance_field([(1,1)])
+        self.assertIs(b1.distance_field([(1,1)]), field)
+        self.assertIsNot(b1.distance_field([(2,2)]), field)
+
+class TestBulkLoading(unittest.TestCase):
+    # Pairs are loaded in one call with invalid and repeated cells counted instead of logged one by one
+    def test_load_pairs(self):
+        b1 = Board(board_size)
+        result = b1.load_obstructions([(0,0), (1,2), (1,2), (5,0), (-1,3), ('a',1)])
+        self.assertEqual(result, (2, 1, 3))
+        self.assertEqual(sorted(b1.obstructions), [[0,0], [1,2]])
+        self.assertEqual(b1.get_board_state()[2], [0,1,0,0,0])
+
+    # Int-like elements are accepted like add_obstruction accepts them
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_load_int_like_pairs(self):
+        b1 = Board(board_size)
+        result = b1.load_obstructions([(numpy.int64(3), numpy.int32(4)), (numpy.int64(9), 0), (1.0, 1)])
+        self.assertEqual(result, (1, 0, 2))
+        self.assertEqual(b1.obstructions, [[3,4]])
+        self.assertIs(type(b1.obstructions[0][0]), int)
+        self.assertFalse(b1.add_obstruction(3,4))
+
+    # Masks put their first row at the top of the board
+    def test_load_mask(self):
+        b1 = Board(3)
+        result = b1.load_obstruction_mask([b'\x01\x00\x00', b'\x00\x00\x00', b'\x00\x01\x00\x01'])
+        self.assertEqual(result, (2, 0, 1))
+        self.assertEqual(sorted(b1.obstructions), [[0,2], [1,0]])
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_load_numpy(self):
+        b1 = Board(board_size)
+        b2 = Board(board_size)
+        mask = numpy.random.default_rng(16).random((board_size, board_size)) < 0.4
+        b1.load_obstruction_mask(mask)
+        rows, xs = numpy.nonzero(mask)
+        b2.load_obstructions(numpy.stack([xs, board_size - 1 - rows], axis=1))
+        self.assertEqual(b1.get_board_state(), mask.astype(int).tolist())
+        self.assertEqual(b2.get_board_state(), b1.get_board_state())
+
+    # Text and PGM map files
+    def test_load_map_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            text_path = os.path.join(directory, 'map.txt')
+            with open(text_path, 'w') as map_file:
+                map_file.write("#..\n.1?\n")
+            pgm_path = os.path.join(directory, 'map.pgm')
+            with open(pgm_path, 'wb') as map_file:
+                map_file.write(b"P5\n# warehouse\n3 2\n255\n" + bytes([0, 255, 255, 255, 10, 255]))
+            b1 = Board(3)
+            self.assertEqual(b1.load_obstruction_map(text_path), (2, 0, 1))
+            self.assertEqual(sorted(b1.obstructions), [[0,1], [1,0]])
+            b2 = Board(3)
+            self.assertEqual(b2.load_obstruction_map(pgm_path), (2, 0, 0))
+            self.assertEqual(sorted(b2.obstructions), [[0,1], [1,0]])
+
+    # Distance fields stay correct after a bulk load
+    def test_load_updates_distance(self):
+        b1 = Board(board_size)
+        self.assertEqual(b1.distance(0,0,4,0), 4)
+        b1.load_obstructions([(2,y) for y in range(4)])
+        self.assertEqual(b1.distance(0,0,4,0), 12)
+
+class TestTickScheduler(unittest.TestCase):
+    # One robot gives the same outputs as running its commands one by one
+    def test_single_robot(self):
+        commands = ['MOVE', 'PLACE 0,0,NORTH', 'MOVE', 'RIGHT', 'MOVE', 'REPORT', 'EXIT', 'REPORT']
+        scheduler = TickScheduler(Board(board_size))
+        robot_id = scheduler.add_robot()
+        scheduler.submit(robot_id, *commands)
+        self.assertEqual(list(scheduler.run()), [(5, 0, '1,1,EAST')])
+        self.assertEqual(scheduler.pending(), 0)
+
+    # Robots take one command per tick and conflicts go to the lowest robot id
+    def test_interleaving(self):
+        scheduler = TickScheduler(Board(board_size))
+        first = scheduler.add_robot()
+        second = scheduler.add_robot()
+        scheduler.submit(second, 'PLACE 2,1,NORTH', 'MOVE', 'REPORT')
+        scheduler.submit(first, 'PLACE 2,3,SOUTH')
+        self.assertEqual(scheduler.tick(), [])
+        self.assertEqual(scheduler.pending(), 2)
+        scheduler.submit(first, 'MOVE', 'REPORT')
+        self.assertEqual(list(scheduler.run()), [(2, 0, '2,2,SOUTH'), (2, 1, '2,1,NORTH')])
+        self.assertEqual(scheduler.tick_count, 3)
+
+    # Robots without queued commands are not visited
+    def test_idle_robots(self):
+        scheduler = TickScheduler(Board(board_size))
+        for _ in range(1000):
+            scheduler.add_robot()
+        scheduler.submit(999, 'PLACE 0,0,NORTH', 'REPORT')
+        self.assertEqual(scheduler.ready, [999])
+        self.assertEqual(list(scheduler.run(max_ticks=1)), [])
+        self.assertEqual(list(scheduler.run()), [(1, 999, '0,0,NORTH')])
+        self.assertEqual(scheduler.ready, [])
+
+class TestJournal(unittest.TestCase):
+    def test_varint(self):
+        for value in (0, 1, 127, 128, 300, 2 ** 40):
+            data = bytearray()
+            encode_varint(value, data)
+            self.assertEqual(decode_varint(bytes(data), 0), (value, len(data)))
+        self.assertEqual(len(data), 6)
+
+    # Every command run through run_command and batch callers is recorded and replays to the same state
+    def test_record_and_replay(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'robot.journal')
+            b1 = Board(board_size)
+            b1.add_obstruction(2,2)
+            r1 = Robot()
+            with Journal(path, b1, [r1], snapshot_interval=3) as journal:
+                for command in ['PLACE 0,0,NORTH', 'MOVE', 'invalid', 'RIGHT', 'MOVE', 'REPORT', 'GOTO 4,4,WEST']:
+                    run_command(command, b1, r1)
+                run_batch(['MOVE\n', 'REPORT\n'], b1, r1)
+            run_command('MOVE', b1, r1) # not recorded after close
+            reader = JournalReader(path)
+            self.assertEqual(len(reader), 8)
+            self.assertEqual(reader.snapshot_indexes, [0, 3, 6])
+            self.assertEqual(reader.command(5), (0, (OP_GOTO, 4, 4, 'WEST')))
+            board, robots, outputs = reader.state_at(len(reader))
+            self.assertEqual(robots[0].report(), '3,4,WEST')
+            self.assertEqual(sorted(board.obstructions), [[2,2], [3,4]])
+            self.assertEqual(outputs, [(7, '3,4,WEST')])
+            board, robots, outputs = reader.state_at(5)
+            self.assertEqual(robots[0].report(), '1,1,EAST')
+            self.assertEqual(outputs, [(4, '1,1,EAST')])
+            self.assertRaises(IndexError, reader.state_at, 9)
+
+    # Fleet robots are snapshotted as standalone robots and replay from any snapshot
+    def test_fleet_replay(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'fleet.journal')
+            fleet = Fleet(Board(board_size), 2)
+            with Journal(path, fleet.board, [fleet.robot(0), fleet.robot(1)], snapshot_interval=2):
+                for robot_id, command in [(0, 'PLACE 0,0,NORTH'), (1, 'PLACE 2,2,EAST'), (0, 'MOVE'), (1, 'MOVE'),
+                                          (0, 'RIGHT'), (1, 'REPORT')]:
+                    fleet.run_command(robot_id, command)
+            reader = JournalReader(path)
+            self.assertEqual(reader.snapshot_indexes, [0, 2, 4])
+            board, robots, outputs = reader.state_at(len(reader))
+            self.assertEqual([robot.report() for robot in robots], ['0,1,EAST', '3,2,EAST'])
+            self.assertEqual(outputs, [(5, '3,2,EAST')])
+            self.assertEqual(sorted(board.obstructions), [[0,1], [3,2]])
+
+    # A slow session reaches the file every sync_interval, long before the buffer fills up
+    def test_sync_interval(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'robot.journal')
+            b1 = Board(board_size)
+            r1 = Robot()
+            with Journal(path, b1, [r1], sync_interval=0.01) as journal:
+                run_command('PLACE 0,0,NORTH', b1, r1)
+                time.sleep(0.02)
+                run_command('MOVE', b1, r1)
+                self.assertEqual(journal.buffer, bytearray())
+                self.assertEqual(len(JournalReader(path)), 2)
+
+    # Version 1 journals stored MOVE without a tile count and still replay, unknown versions are rejected
+    def test_version_1(self):
+        # written by the version 1 journal for PLACE 0,0,NORTH; MOVE; MOVE; RIGHT; MOVE; REPORT
+        data = bytes.fromhex('5452424a017f002954524253010000000500000005000000000000000000000001000000000000000000000000'
+                             '000000ff000000000101000100030001000400')
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'robot.journal')
+            with open(path, 'wb') as journal_file:
+                journal_file.write(data)
+            reader = JournalReader(path)
+            self.assertEqual(reader.version, 1)
+            self.assertEqual(len(reader), 6)
+            self.assertEqual(reader.command(0), (0, (OP_PLACE, 0, 0, 'NORTH')))
+            self.assertEqual(reader.command(1), (0, (OP_MOVE, None, None, None)))
+            board, robots, outputs = reader.state_at(len(reader))
+            self.assertEqual(outputs, [(5, '1,2,EAST')])
+            with open(path, 'wb') as journal_file:
+                journal_file.write(data[:4] + bytes([3]) + data[5:])
+            self.assertRaises(ValueError, JournalReader, path)
+
+class TestRobotMemory(unittest.TestCase):
+    # Robots have no __dict__ and keep the facing as a code
+    def test_slotted_robot(self):
+        b1 = Board(board_size)
+        r1 = Robot()
+        self.assertFalse(hasattr(r1, '__dict__'))
+        self.assertRaises(AttributeError, setattr, r1, 'speed', 1)
+        self.assertIsNone(r1.facing)
+        r1.place(1, 2, 'WEST', b1)
+        self.assertEqual(r1.facing_code, Robot.FACING_CODES['WEST'])
+        r1.rotate('RIGHT')
+        self.assertEqual(r1.facing, 'NORTH')
+        self.assertEqual(r1.report(), '1,2,NORTH')
+
+    # The NO_FACING sentinel is never used as a table index
+    def test_unplaced_robot(self):
+        r1 = Robot()
+        self.assertIsNone(r1.report())
+        r1.rotate('LEFT')
+        self.assertEqual(r1.facing_code, NO_FACING)
+        self.assertIsNone(r1.facing)
+
+    # A placed robot costs well under 100 bytes
+    def test_robot_footprint(self):
+        b1 = Board(100)
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            robots = [Robot() for _ in range(10000)]
+            for index, robot in enumerate(robots):
+                robot.place(index % 100, index // 100, 'NORTH', b1)
+            robot_bytes = tracemalloc.get_traced_memory()[0] - before
+        finally:
+            tracemalloc.stop()
+        self.assertLess(robot_bytes / len(robots), 100)
+
+class TestInstrumentation(unittest.TestCase):
+    def tearDown(self):
+        instrumentation.disable()
+        instrumentation.stats.clear()
+
+    # Disabled instrumentation leaves the original functions in place
+    def test_swap(self):
+        original_add = Board.add_obstruction
+        original_move = start_app.COMMAND_HANDLERS[OP_MOVE]
+        instrumentation.enable()
+        self.assertIsNot(Board.add_obstruction, original_add)
+        self.assertIsNot(start_app.COMMAND_HANDLERS[OP_MOVE], original_move)
+        instrumentation.disable()
+        self.assertIs(Board.add_obstruction, original_add)
+        self.assertIs(start_app.COMMAND_HANDLERS[OP_MOVE], original_move)
+        self.assertEqual(run_command('STATS', Board(board_size), Robot()), "instrumentation disabled")
+
+    # Commands and board operations are counted per kind
+    def test_counts(self):
+        instrumentation.enable()
+        b1 = Board(board_size)
+        r1 = Robot()
+        for command in ['PLACE 0,0,NORTH', 'MOVE', 'MOVE', 'LEFT', 'REPORT']:
+            run_command(command, b1, r1)
+        self.assertEqual(r1.report(), '0,2,WEST')
+        counts = {name: values["count"] for name, values in instrumentation.to_dict().items()}
+        self.assertEqual(counts["command.MOVE"], 2)
+        self.assertEqual(counts["command.PLACE"], 1)
+        self.assertEqual(counts["board.add"], 3)
+        self.assertEqual(counts["board.remove"], 2)
+        self.assertNotIn("command.RIGHT", counts)
+        self.assertIn("command.MOVE count=2", run_command('STATS', b1, r1))
+
+    # Batch mode runs through the same handlers, so its commands are counted too
+    def test_batch_counts(self):
+        instrumentation.enable()
+        outputs = run_batch(['MOVE', 'PLACE 0,0,NORTH', 'MOVE 2', 'RIGHT', 'REPEAT 2 { REPORT }', 'STATS'], Board(board_size), Robot())
+        self.assertEqual(outputs[:2], ['0,2,EAST', '0,2,EAST'])
+        counts = {name: values["count"] for name, values in instrumentation.to_dict().items()}
+        self.assertEqual((counts["command.PLACE"], counts["command.MOVE"], counts["command.RIGHT"]), (1, 1, 1))
+        self.assertEqual((counts["command.REPEAT"], counts["command.REPORT"]), (1, 1)) # the second iteration is fast-forwarded
+        self.assertIn("command.MOVE count=1", outputs[2])
+
+    # JSON and Prometheus text exports
+    def test_export(self):
+        instrumentation.enable()
+        run_command('PLACE 1,1,EAST', Board(board_size), Robot())
+        with tempfile.TemporaryDirectory() as directory:
+            json_path = os.path.join(directory, 'stats.json')
+            instrumentation.export(json_path)
+            with open(json_path) as stats_file:
+                values = json.load(stats_file)["command.PLACE"]
+            self.assertEqual(values["count"], 1)
+            self.assertEqual(values["histogram"]["+Inf"], 1)
+            text_path = os.path.join(directory, 'stats.prom')
+            instrumentation.export(text_path)
+            with open(text_path) as stats_file:
+                text = stats_file.read()
+            self.assertIn('toy_robot_operation_seconds_count{operation="command.PLACE"} 1', text)
+            self.assertIn('toy_robot_operation_seconds_bucket{operation="command.PLACE",le="+Inf"} 1', text)
+
+class TestSpatialIndex(unittest.TestCase):
+    # Queries match a brute-force scan while tiles are added and removed
+    def test_against_brute_force(self):
+        rng = random.Random(21)
+        b1 = SparseBoard(40)
+        index = SpatialIndex(b1, bucket_size=4)
+        for _ in range(300):
+            x, y = rng.randrange(40), rng.randrange(40)
+            if b1.occupancy.contains(x,y):
+                b1.remove_obstruction(x,y)
+            else:
+                b1.add_obstruction(x,y)
+            tiles = set(b1.occupancy)
+            x0, y0 = rng.randrange(-3, 40), rng.randrange(-3, 40)
+            x1, y1 = x0 + rng.randrange(25), y0 + rng.randrange(25)
+            self.assertEqual(index.count_rect(x0,y0,x1,y1), sum(1 for tx, ty in tiles if x0 <= tx <= x1 and y0 <= ty <= y1))
+            key = lambda tile: ((tile[0] - x) ** 2 + (tile[1] - y) ** 2, tile[1], tile[0])
+            self.assertEqual(index.query_range(x,y,5), sorted((tile for tile in tiles if key(tile)[0] <= 25), key=key))
+            self.assertEqual(index.nearest(x,y,3), sorted(tiles - {(x,y)}, key=key)[:3])
+        self.assertEqual(len(index), len(set(b1.occupancy)))
+
+    # Moving robots update the rectangle counts in place instead of rebuilding them
+    def test_counts_follow_moves(self):
+        b1 = Board(16)
+        index = SpatialIndex(b1, bucket_size=4)
+        r1 = Robot()
+        r1.place(2, 2, 'EAST', b1)
+        self.assertEqual(index.count_rect(0,0,3,3), 1)
+        tree = index._tree
+        r1.move()
+        self.assertEqual((index.count_rect(0,0,3,3), index.count_rect(4,0,7,3)), (1, 0))
+        r1.move()
+        self.assertEqual((index.count_rect(0,0,3,3), index.count_rect(4,0,7,3)), (0, 1))
+        self.assertIs(index._tree, tree)
+
+    # Few or far tiles are found by scanning the occupied buckets, not every bucket ring of a huge board
+    def test_nearest_sparse(self):
+        b1 = SparseBoard(10**6)
+        for x, y in [(999999,999999), (5,999990), (0,0)]:
+            b1.add_obstruction(x,y)
+        index = b1.spatial_index()
+        self.assertEqual(index.nearest(0,0,k=5), [(5,999990), (999999,999999)])
+        self.assertEqual(index.nearest(999999,0), [(0,0)])
+
+    # nearest_free skips occupied tiles and the index is shared per board
+    def test_nearest_free(self):
+        b1 = Board(board_size)
+        index = b1.spatial_index()
+        self.assertIs(b1.spatial_index(), index)
+        self.assertEqual(index.nearest_free(2,2), (2,2))
+        for x, y in [(2,2), (2,1), (1,2), (3,2)]:
+            b1.add_obstruction(x,y)
+        self.assertEqual(index.nearest_free(2,2), (2,3))
+        self.assertEqual(index.count_rect(0,0,board_size,board_size), 4)
+        with self.assertRaises(ValueError):
+            SpatialIndex(b1, bucket_size=3)
+
+class TestMacroCommands(unittest.TestCase):
+    # MOVE n stops at the board edge or before the first obstruction, like n single MOVE commands
+    def test_move_n(self):
+        b1 = Board(board_size)
+        r1 = Robot()
+        b1.add_obstruction(0,3)
+        run_command('PLACE 0,0,NORTH', b1, r1)
+        run_command('MOVE 10', b1, r1)
+        self.assertEqual(r1.report(), '0,2,NORTH')
+        run_command('RIGHT', b1, r1)
+        run_command('MOVE 3', b1, r1)
+        self.assertEqual(r1.report(), '3,2,EAST')
+        run_command('MOVE 0', b1, r1)
+        run_command('MOVE 9', b1, r1)
+        self.assertEqual(r1.report(), '4,2,EAST')
+        self.assertEqual(sorted(b1.occupancy), [(0,3), (4,2)])
+
+    # REPEAT blocks fast-forward cycles and give the same result as the unrolled commands
+    def test_repeat_matches_unrolled(self):
+        rng = random.Random(22)
+        for _ in range(50):
+            b1 = Board(8)
+            b2 = Board(8)
+            for _ in range(10):
+                x, y = rng.randrange(8), rng.randrange(8)
+                b1.add_obstruction(x,y)
+                b2.add_obstruction(x,y)
+            body = [rng.choice(['MOVE 2', 'MOVE 5', 'LEFT', 'RIGHT', 'REPORT']) for _ in range(4)]
+            count = rng.randrange(100)
+            program = f'PLACE 0,0,NORTH\nREPEAT {count} {{ {"; ".join(body)} }}\nREPORT'
+            unrolled = 'PLACE 0,0,NORTH\n' + '\n'.join(body * count).replace('MOVE 2', 'MOVE\nMOVE').replace('MOVE 5', 'MOVE\nMOVE\nMOVE\nMOVE\nMOVE') + '\nREPORT'
+            self.assertEqual(run_program(program, b1, Robot()), run_program(unrolled, b2, Robot()))
+            self.assertEqual(sorted(b1.occupancy), sorted(b2.occupancy))
+        b1 = Board(board_size)
+        r1 = Robot()
+        self.assertEqual(run_program('PLACE 0,0,NORTH\nREPEAT 1000000001 {\n  MOVE 1\n  RIGHT\n}\nREPORT', b1, r1), ['0,1,EAST'])
+        self.assertEqual(run_command('REPEAT 2 { REPEAT 2 { RIGHT }; REPORT }', b1, r1), '0,1,WEST\n0,1,EAST')
+
+    # Blocks must be closed and cannot contain EXIT
+    def test_repeat_errors(self):
+        self.assertEqual(compile_command('REPEAT 3 { MOVE 2; LEFT }')[0], (OP_REPEAT, 3, ((OP_MOVE, 2, None, None), (OP_LEFT, None, None, None)), None))
+        self.assertEqual(compile_command('REPEAT 3 { MOVE')[1].message, "expected '}' but found end of line")
+        self.assertEqual(compile_command('REPEAT 3 { EXIT }')[1].message, "EXIT is not allowed inside a block")
+        self.assertEqual(compile_command('REPEAT 3 MOVE')[1].usage, 'REPEAT k { commands }')
+        program = compile_program('REPEAT 2 {\nMOVE\nJUMP\n}\nREPORT')
+        self.assertEqual(program.instructions, ((OP_REPORT, None, None, None),))
+        self.assertEqual(program.errors[0].line, 3)
+
+    # Blocks spanning several lines also run from command streams and from interactive input
+    def test_multi_line_repeat(self):
+        lines = ['PLACE 0,0,NORTH\n', 'REPEAT 3 {\n', 'MOVE\n', 'REPORT\n', '}\n', 'RIGHT\n', 'REPORT\n']
+        self.assertEqual(run_batch(lines, Board(board_size), Robot()), ['0,1,NORTH', '0,2,NORTH', '0,3,NORTH', '0,3,EAST'])
+        streamed = list(iter_events(lines, Board(board_size), Robot()))
+        self.assertEqual([event[2:] for event in streamed if event[0] == events.REPORTED],
+                         [(0, 1, 'NORTH'), (0, 2, 'NORTH'), (0, 3, 'NORTH'), (0, 3, 'EAST')])
+        self.assertEqual(run_batch(['PLACE 0,0,NORTH', 'REPEAT 3 {', 'MOVE', 'REPORT'], Board(board_size), Robot()), [])
+        self.assertEqual(block_depth('REPEAT 3 { REPEAT 2 {'), 2)
+        # only REPEAT opens a block, any other line with a brace is rejected on its own
+        self.assertEqual(run_batch(['PLACE 0,0,NORTH', 'bad {', 'MOVE {', 'MOVE', 'REPORT'], Board(board_size), Robot()), ['0,1,NORTH'])
+        self.assertEqual([error.line for error in compile_program('bad {\nMOVE {\nREPORT').errors], [1, 2])
+        self.assertEqual(block_depth('MOVE {'), 0)
+        b1 = Board(board_size)
+        r1 = Robot()
+        run_command('PLACE 0,0,NORTH', b1, r1)
+        self.assertEqual(run_command('REPEAT 2 {\nMOVE\nREPORT\n}', b1, r1), '0,1,NORTH\n0,2,NORTH')
+        self.assertFalse(run_command('REPEAT 2 {\nMOVE\n} MOVE', b1, r1))
+
+    # REPEAT is journaled as one command and replays to the same state
+    def test_repeat_journal(self):
+        b1 = Board(board_size)
+        r1 = Robot()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'macro.journal')
+            with Journal(path, b1, [r1]):
+                run_program('PLACE 0,0,EAST\nMOVE 3\nREPEAT 5 { LEFT; MOVE 2 }\nMOVE', b1, r1)
+            reader = JournalReader(path)
+            self.assertEqual(len(reader), 4)
+            self.assertEqual(reader.command(1), (0, (OP_MOVE, 3, None, None)))
+            self.assertEqual(reader.command(3), (0, (OP_MOVE, None, None, None)))
+            board, robots, outputs = reader.state_at(len(reader))
+            self.assertEqual(robots[0].report(), r1.report())
+
+class TestShardedFleet(unittest.TestCase):
+    # With one shard a tick is the same as step_scalar
+    def test_one_shard_matches_scalar(self):
+        rng = random.Random(23)
+        board = SparseBoard(8, 6)
+        fleet = Fleet(board)
+        with ShardedFleet(8, 6, shard_count=1, capacity=16, processes=False) as sharded:
+            for x, y in [(2,2), (5,1), (6,4)]:
+                board.add_obstruction(x,y)
+                sharded.add_obstruction(x,y)
+            for x, y, f in [(0,0,'NORTH'), (3,3,'EAST'), (7,5,'SOUTH'), (4,1,'WEST')]:
+                fleet.robot(fleet.add_robot()).place(x, y, f, board)
+                sharded.add_robot(x, y, f)
+            for _ in range(100):
+                ops = [rng.choice((OP_NONE, OP_MOVE, OP_MOVE, OP_LEFT, OP_RIGHT)) for _ in range(4)]
+                step_scalar(fleet, ops)
+                sharded.step(ops)
+                self.assertEqual([report for robot_id, report in sharded.reports()], [fleet.robot(robot_id).report() for robot_id in range(4)])
+
+    # Robots are handed off across shard edges unless the edge tile is taken
+    def test_handoff(self):
+        with ShardedFleet(4, 4, shard_count=2, capacity=8, processes=False) as sharded:
+            first = sharded.add_robot(0, 1, 'NORTH')
+            second = sharded.add_robot(1, 1, 'NORTH')
+            sharded.add_obstruction(1, 2)
+            self.assertIsNone(sharded.add_robot(1, 2, 'SOUTH'))
+            self.assertIsNone(sharded.add_robot(1, 9, 'SOUTH'))
+            sharded.step([OP_MOVE, OP_MOVE])
+            self.assertEqual(sharded.reports(), [(first, '0,2,NORTH'), (second, '1,1,NORTH')])
+            sharded.step([OP_MOVE])
+            self.assertEqual(sharded.report(first), '0,3,NORTH')
+            board, fleet = sharded.gather()
+            self.assertEqual(sorted(board.occupancy), [(0,3), (1,1), (1,2)])
+            self.assertEqual(list(fleet.facings), [0, 0])
+
+    # Worker processes give the same result as in-process shards
+    def test_processes(self):
+        results = []
+        for processes in (False, True):
+            rng = random.Random(5)
+            with ShardedFleet(10, 9, shard_count=3, capacity=32, processes=processes) as sharded:
+                sharded.load_obstructions([(rng.randrange(10), rng.randrange(9)) for _ in range(12)])
+                for _ in range(20):
+                    sharded.add_robot(rng.randrange(10), rng.randrange(9), rng.choice(['NORTH', 'SOUTH', 'EAST']))
+                for _ in range(60):
+                    sharded.step([rng.choice((OP_NONE, OP_MOVE, OP_MOVE, OP_LEFT, OP_RIGHT)) for _ in range(len(sharded))])
+                results.append((sharded.reports(), sharded.snapshot()))
+        self.assertEqual(results[0], results[1])
+        board, fleet = load_snapshot(results[0][1])
+        self.assertEqual(len(fleet), len(results[0][0]))
+
+class TestSharedBoard(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'board.grid')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    # Readers see the live board through the mapped file
+    def test_reader(self):
+        with SharedBoard(board_size, self.path) as b1, SharedBoardReader(self.path) as reader:
+            r1 = Robot()
+            run_command('PLACE 1,2,NORTH', b1, r1)
+            b1.add_obstruction(4,4)
+            self.assertEqual((reader.width, reader.height), (board_size, board_size))
+            self.assertTrue(reader.contains(1,2))
+            self.assertEqual(reader.count(), 2)
+            sequence = reader.sequence()
+            run_command('MOVE', b1, r1)
+            self.assertEqual(reader.sequence(), sequence + 4) # one add and one remove
+            self.assertFalse(reader.contains(1,2))
+            self.assertTrue(reader.contains(1,3))
+            self.assertEqual(reader.snapshot(), (sequence + 4, bytes(b1.occupancy.bits)))
+            if numpy is not None:
+                self.assertEqual(reader.as_numpy().tolist(), b1.get_board_state())
+
+    # A read that overlaps a write is retried
+    def test_read_retry(self):
+        with SharedBoard(board_size, self.path) as b1, SharedBoardReader(self.path) as reader:
+            calls = []
+            def count_tiles(bits):
+                calls.append(1)
+                if len(calls) == 1:
+                    b1.add_obstruction(0,0)
+                return sum(bin(byte).count('1') for byte in bits)
+            self.assertEqual(reader.read(count_tiles), 1)
+            self.assertEqual(len(calls), 2)
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_step_numpy(self):
+        with SharedBoard(board_size, self.path) as b1, SharedBoardReader(self.path) as reader:
+            fleet = Fleet(b1, 2)
+            fleet.robot(0).place(0, 0, 'NORTH', b1)
+            fleet.robot(1).place(2, 0, 'NORTH', b1)
+            step_numpy(fleet, [OP_MOVE, OP_MOVE])
+            self.assertEqual(reader.sequence() % 2, 0)
+            self.assertEqual(sorted(b1.occupancy), [(0,1), (2,1)])
+            self.assertTrue(reader.contains(2,1) and not reader.contains(2,0))
+
+    # Other files are rejected
+    def test_not_a_board(self):
+        with open(self.path, 'wb') as other_file:
+            other_file.write(b'x' * 64)
+        with self.assertRaises(ValueError):
+            SharedBoardReader(self.path)
+
+class TestEventStream(unittest.TestCase):
+    # Every command is streamed as typed events, REPORT without building the report string
+    def test_iter_events(self):
+        b1, r1 = Board(board_size), Robot()
+        streamed = list(iter_events(['MOVE', 'PLACE 0,0,NORTH', 'MOVE', 'RIGHT', 'MOVE 9', 'REPORT', 'DISTANCE 0,0', 'EXIT', 'MOVE'], b1, r1))
+        self.assertEqual([event[:1] + event[2:] for event in streamed], [
+            (events.PLACED, 0, 0, 'NORTH'),
+            (events.MOVED, 0, 0, 0, 1),
+            (events.ROTATED, 'NORTH', 'EAST'),
+            (events.MOVED, 0, 1, 4, 1),
+            (events.BLOCKED, 5, 1),
+            (events.REPORTED, 4, 1, 'EAST'),
+            (events.OUTPUT, '5'),
+        ])
+        self.assertTrue(all(event[1] is r1 for event in streamed))
+        self.assertEqual(events.hooks, [])
+
+    # A fast-forwarded REPEAT streams the same events as the unrolled commands
+    def test_repeat(self):
+        body = ['MOVE', 'RIGHT', 'MOVE', 'REPORT']
+        repeated = list(iter_events(['PLACE 1,1,NORTH', 'REPEAT 50 { %s }' % '; '.join(body), 'REPORT'], Board(board_size), Robot()))
+        unrolled = list(iter_events(['PLACE 1,1,NORTH'] + body * 50 + ['REPORT'], Board(board_size), Robot()))
+        self.assertEqual([event[:1] + event[2:] for event in repeated], [event[:1] + event[2:] for event in unrolled])
+
+    def test_aiter_events(self):
+        async def collect():
+            return [event[0] async for event in aiter_events(['PLACE 0,0,NORTH', 'MOVE', 'REPORT'], Board(board_size), Robot(), batch_size=1)]
+        self.assertEqual(asyncio.run(collect()), [events.PLACED, events.MOVED, events.REPORTED])
+
+    # Sinks write small chunks as they fill up and the rest on close
+    def test_sinks(self):
+        streamed = list(iter_events(['PLACE 0,0,NORTH', 'MOVE', 'LEFT', 'MOVE', 'REPORT', 'STATS'], Board(board_size), Robot()))
+        ndjson = io.StringIO()
+        sink = NdjsonSink(ndjson, chunk_size=100)
+        self.assertEqual(sink.consume(streamed), 6)
+        sink.flush()
+        lines = [json.loads(line) for line in ndjson.getvalue().splitlines()]
+        self.assertEqual(lines[1], {'event': 'moved', 'robot': 0, 'old_x': 0, 'old_y': 0, 'new_x': 0, 'new_y': 1})
+        self.assertEqual(lines[3], {'event': 'blocked', 'robot': 0, 'x': -1, 'y': 1})
+        self.assertEqual(lines[5]['event'], 'output')
+        csv_file = io.StringIO()
+        sink = CsvSink(csv_file)
+        sink.consume(streamed)
+        self.assertEqual(csv_file.getvalue(), '')
+        sink.flush()
+        rows = list(csv.DictReader(io.StringIO(csv_file.getvalue())))
+        self.assertEqual([row['event'] for row in rows], [event[0] for event in streamed])
+        self.assertEqual((rows[2]['old_facing'], rows[2]['new_facing'], rows[2]['x']), ('NORTH', 'WEST', ''))
+        binary = io.BytesIO()
+        sink = BinarySink(binary)
+        sink.consume(streamed)
+        sink.flush()
+        self.assertEqual(list(iter_binary_events(binary.getvalue())), [(event[0], 0) + event[2:] for event in streamed])
+        with self.assertRaises(ValueError):
+            list(iter_binary_events(b'not events'))
+
+    # open_sink picks the format from the file extension
+    def test_open_sink(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for name, sink_class in (('events.ndjson', NdjsonSink), ('events.csv', CsvSink), ('events.bin', BinarySink)):
+                path = os.path.join(directory, name)
+                with open_sink(path) as sink:
+                    self.assertIsInstance(sink, sink_class)
+                    sink.consume(iter_events(['PLACE 0,0,NORTH', 'REPORT'], Board(board_size), Robot()))
+                self.assertGreater(os.path.getsize(path), 0)
+
+class TestDirectionTables(unittest.TestCase):
+    # Rotation tables should match the original moveset
+    def test_rotation_tables(self):
+        for facing, left, right in (("NORTH","WEST","EAST"), ("EAST","NORTH","SOUTH"), ("SOUTH","EAST","WEST"), ("WEST","SOUTH","NORTH")):
+            code = Robot.FACING_CODES[facing]
+            self.assertEqual(Robot.FACINGS[Robot.LEFT[code]], left)
+            self.assertEqual(Robot.FACINGS[Robot.RIGHT[code]], right)
+
+    # Subclasses can add diagonal headings and get their own tables
+    def test_diagonal_headings(self):
+        class DiagonalRobot(Robot):
+            HEADINGS = (
+                ("NORTH", 0, 1), ("NORTHEAST", 1, 1), ("EAST", 1, 0), ("SOUTHEAST", 1, -1),
+                ("SOUTH", 0, -1), ("SOUTHWEST", -1, -1), ("WEST", -1, 0), ("NORTHWEST", -1, 1),
+            )
+        b1 = Board(board_size)
+        r1 = DiagonalRobot()
+        run_command('PLACE 0,0,NORTHEAST', b1, r1)
+        run_command('MOVE', b1, r1)
+        run_command('LEFT', b1, r1)
+        self.assertEqual(run_command('REPORT', b1, r1),'1,1,NORTH')
+        self.assertEqual(len(Robot.FACINGS), 4)
+
+class TestCommandParser(unittest.TestCase):
+    # Commands that only matched by substring before are rejected
+    def test_accidental_place_rejected(self):
+        b1 = Board(board_size)
+        r1 = Robot()
+        self.assertFalse(run_command('XPLACEY 1,2,NORTH', b1, r1))
+        self.assertFalse(run_command('PLACE 1,2,NORTH,EXTRA', b1, r1))
+        self.assertIsNone(r1.board)
+
+    # Parse errors point at the offending token
+    def test_error_positions(self):
+        instruction, error = compile_command('PLACE 1;2,NORTH')
+        self.assertIsNone(instruction)
+        self.assertEqual((error.line, error.column), (1, 8))
+        instruction, error = compile_command('PLACE 1,2')
+        self.assertEqual(error.column, 10)
+        self.assertEqual(error.usage, 'PLACE x,y,f')
+        self.assertEqual(compile_program('MOVE\nREPORT\nJUMP').errors[0].line, 3)
+
+    # Valid commands compile to compact instructions
+    def test_compile_place(self):
+        self.assertEqual(compile_command('  place 1 , 2 , north ')[0], (OP_PLACE, 1, 2, 'NORTH'))
+
+    # Programs are cached by source
+    def test_program_cache(self):
+        source = 'PLACE 0,0,NORTH\nMOVE\nREPORT'
+        self.assertIs(compile_program(source), compile_program(source))
+        b1 = Board(board_size)
+        r1 = Robot()
+        self.assertEqual(run_program(source, b1, r1), ['0,1,NORTH'])
+
+class TestBatchRunner(unittest.TestCase):
+    # Batch runs should only return REPORT outputs
+    def test_reports_only(self):
+        b1 = Board(board_size)
+        r1 = Robot()
+        result = run_batch(['PLACE 1,2,EAST\n', 'MOVE\n', 'REPORT\n', 'LEFT\n', 'MOVE\n', 'REPORT\n'], b1, r1)
+        self.assertEqual(result, ['2,2,EAST', '2,3,NORTH'])
+
+    # Batch runs should match run_command for invalid and pre-place commands
+    def test_matches_run_command(self):
+        commands = ['MOVE', 'this_is_an_invalid_command', 'PLACE x,y,NORTH', 'place 0,0,north', 'Move', 'PLACE 0,999,NORTH',
+                    'RIGHT', 'MOVE', 'REPORT', '  PLACE     3 , 3 , SOUTH   ', 'MOVE', 'REPORT']
+        b1 = Board(board_size)
+        r1 = Robot()
+        expected = [result for result in (run_command(command, b1, r1) for command in commands) if isinstance(result, str)]
+        b2 = Board(board_size)
+        r2 = Robot()
+        self.assertEqual(run_batch(commands, b2, r2), expected)
+
+    # Commands after EXIT are ignored
+    def test_exit_stops_batch(self):
+        b1 = Board(board_size)
+        r1 = Robot()
+        result = run_batch(['PLACE 0,0,NORTH', 'REPORT', 'EXIT', 'MOVE', 'REPORT'], b1, r1)
+        self.assertEqual(result, ['0,0,NORTH'])
+
+class TestFleet(unittest.TestCase):
+    # Fleet robots behave like single robots and share the board for collisions
+    def test_fleet_robots_collide(self):
+        b1 = Board(board_size)
+        fleet = Fleet(b1, 2)
+        fleet.run_command(0, 'PLACE 0,0,NORTH')
+        fleet.run_command(1, 'PLACE 0,2,SOUTH')
+        fleet.run_command(0, 'MOVE')
+        fleet.run_command(1, 'MOVE') # blocked by robot 0
+        self.assertEqual(fleet.run_command(0, 'REPORT'), '0,1,NORTH')
+        self.assertEqual(fleet.run_command(1, 'REPORT'), '0,2,SOUTH')
+        self.assertEqual(sorted(b1.obstructions), [[0,1],[0,2]])
+
+    # Robot views read and write the fleet arrays
+    def test_robot_view_state(self):
+        b1 = Board(board_size)
+        fleet = Fleet(b1)
+        robot_id = fleet.add_robot()
+        r1 = fleet.robot(robot_id)
+        self.assertIsNone(r1.board)
+        run_command('MOVE', b1, r1)
+        self.assertEqual(fleet.placed_ids(), [])
+        run_command('PLACE 1,1,EAST', b1, r1)
+        run_command('LEFT', b1, r1)
+        self.assertEqual((fleet.xs[robot_id], fleet.ys[robot_id], fleet.robot(robot_id).facing), (1, 1, 'NORTH'))
+        self.assertTrue(fleet.remove_robot(robot_id))
+        self.assertEqual(b1.obstructions, [])
+        self.assertIsNone(r1.x_axis)
+
+class TestStepEngine(unittest.TestCase):
+    def make_fleet(self, places):
+        fleet = Fleet(Board(board_size), len(places))
+        for robot_id, place in enumerate(places):
+            fleet.run_command(robot_id, place)
+        return fleet
+
+    # A robot following another moves only if the one in front has a lower robot id
+    def test_scalar_chain_priority(self):
+        fleet = self.make_fleet(['PLACE 0,1,NORTH', 'PLACE 0,0,NORTH', 'PLACE 2,0,NORTH', 'PLACE 2,1,NORTH'])
+        step_scalar(fleet, [OP_MOVE, OP_MOVE, OP_MOVE, OP_MOVE])
+        self.assertEqual([fleet.run_command(robot_id, 'REPORT') for robot_id in range(4)],
+                         ['0,2,NORTH', '0,1,NORTH', '2,0,NORTH', '2,2,NORTH'])
+
+    # Two robots swapping tiles are both blocked
+    def test_scalar_swap_blocked(self):
+        fleet = self.make_fleet(['PLACE 0,0,EAST', 'PLACE 1,0,WEST'])
+        step_scalar(fleet, [OP_MOVE, OP_MOVE])
+        self.assertEqual([fleet.run_command(robot_id, 'REPORT') for robot_id in range(2)], ['0,0,EAST', '1,0,WEST'])
+
+    # The vectorized engine must match the scalar engine exactly
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_numpy_matches_scalar(self):
+        rnd = random.Random(5)
+        places = [f"PLACE {rnd.randint(0,4)},{rnd.randint(0,4)},{rnd.choice(Robot.FACINGS)}" for count in range(15)]
+        fleets = [self.make_fleet(places), self.make_fleet(places)]
+        for fleet in fleets:
+            fleet.board.add_obstruction(2,2)
+        for tick in range(20):
+            ops = [rnd.choice((OP_NONE, OP_MOVE, OP_MOVE, OP_LEFT, OP_RIGHT)) for count in range(15)]
+            step_scalar(fleets[0], ops)
+            step_numpy(fleets[1], ops)
+            self.assertEqual(fleets[0].xs, fleets[1].xs)
+            self.assertEqual(fleets[0].ys, fleets[1].ys)
+            self.assertEqual(fleets[0].facings, fleets[1].facings)
+            self.assertEqual(sorted(fleets[0].board.obstructions), sorted(fleets[1].board.obstructions))
+
+    # With hooks registered both engines emit the same events in the same order
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_numpy_events_match_scalar(self):
+        rnd = random.Random(7)
+        places = [f"PLACE {rnd.randint(0,4)},{rnd.randint(0,4)},{rnd.choice(Robot.FACINGS)}" for count in range(12)]
+        fleets = [self.make_fleet(places), self.make_fleet(places)]
+        for tick in range(20):
+            ops = [rnd.choice((OP_NONE, OP_MOVE, OP_MOVE, OP_LEFT, OP_RIGHT)) for count in range(12)]
+            emitted = []
+            for fleet, engine in zip(fleets, (step_scalar, step_numpy)):
+                ring = events.EventRing()
+                events.add_hook(ring)
+                try:
+                    engine(fleet, ops)
+                finally:
+                    events.remove_hook(ring)
+                emitted.append([(event[0], event[1].robot_id) + event[2:] for event in ring])
+            self.assertEqual(emitted[0], emitted[1])
+            self.assertTrue(emitted[0])
+
+    # A column of followers resolves in one tick: all move when the front robot has the lowest id, one otherwise
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_numpy_follower_chain(self):
+        for places, expected in (([f"PLACE 0,{y},NORTH" for y in range(3, -1, -1)], [4, 3, 2, 1]),
+                                 ([f"PLACE 0,{y},NORTH" for y in range(4)], [0, 1, 2, 4])):
+            fleets = [self.make_fleet(places), self.make_fleet(places)]
+            step_scalar(fleets[0], [OP_MOVE] * 4)
+            step_numpy(fleets[1], [OP_MOVE] * 4)
+            self.assertEqual(list(fleets[1].ys), expected)
+            self.assertEqual(fleets[0].ys, fleets[1].ys)
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_numpy_rejects_short_ops(self):
+        fleet = self.make_fleet(["PLACE 0,0,NORTH", "PLACE 1,0,NORTH"])
+        with self.assertRaises(ValueError):
+            step_numpy(fleet, [OP_MOVE])
+
 if __name__ == "__main__":
     unittest.main(verbosity=2)
\ No newline at end of file
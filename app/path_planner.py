@@ -0,0 +1,230 @@
+import heapq
+import logging
+import weakref
+from collections import OrderedDict
+
+import events
+
+logger = logging.getLogger(__name__)
+
+# searches give up after expanding this many states
+MAX_EXPANSIONS = 5000000
+# cached plans kept per board
+CACHE_SIZE = 1024
+MASK_64 = (1 << 64) - 1
+
+# board -> PlanCache. Entries go away with the board.
+_plan_cache = weakref.WeakKeyDictionary()
+
+COMMAND_NAMES = ('MOVE', 'LEFT', 'RIGHT')
+
+def _rotation_distance(code_a, code_b, count):
+    """
+    Returns:
+        int: fewest LEFT/RIGHT turns between two facing codes
+    """
+    difference = (code_a - code_b) % count
+    return min(difference, count - difference)
+
+def _make_heuristic(robot_class, target_x, target_y, target_code):
+    """
+    Builds an admissible A* heuristic for a robot class.
+    For the four axis headings it is the Manhattan distance plus the fewest turns needed to face every
+    direction the robot still has to travel, or the turns to the target facing once it is on the target tile.
+    Other heading sets fall back to the Chebyshev distance.
+
+    Returns:
+        callable: function (x, y, facing code) -> lower bound of the remaining commands
+    """
+    count = len(robot_class.FACINGS)
+    steps = list(zip(robot_class.DX, robot_class.DY))
+    if not all(abs(dx) + abs(dy) == 1 for dx, dy in steps):
+        def chebyshev(x, y, code):
+            return max(abs(target_x - x), abs(target_y - y))
+        return chebyshev
+    codes = {step: code for code, step in enumerate(steps)}
+
+    def manhattan_turns(x, y, code):
+        dx = target_x - x
+        dy = target_y - y
+        needed = []
+        if dx:
+            needed.append(codes[(1 if dx > 0 else -1, 0)])
+        if dy:
+            needed.append(codes[(0, 1 if dy > 0 else -1)])
+        turns = 0
+        if needed:
+            turns = min(_rotation_distance(code, needed_code, count) for needed_code in needed) + len(needed) - 1
+        elif target_code is not None:
+            turns = _rotation_distance(code, target_code, count)
+        return abs(dx) + abs(dy) + turns
+    return manhattan_turns
+
+def _mix(key):
+    """
+    Returns:
+        int: 64-bit hash of a packed tile key (splitmix64 finalizer)
+    """
+    value = (key + 0x9E3779B97F4A7C15) & MASK_64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & MASK_64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & MASK_64
+    return value ^ (value >> 31)
+
+
+class PlanCache:
+    """
+    LRU of the plans made on one board. Plans are keyed by a hash of the occupied tiles without the planning robot's
+    own tile (the XOR of a 64-bit hash per occupied tile, kept up to date through the board tile listeners), so a
+    robot's own moves do not drop its plans while any other change does.
+    """
+    def __init__(self, board):
+        self.width = board.max_x + 1
+        self.plans = OrderedDict()
+        self.tiles_hash = 0
+        for x, y in board.occupancy:
+            self.tiles_hash ^= _mix(y * self.width + x)
+        board.tile_listeners.append(self.tile_changed)
+
+    def tile_changed(self, x, y, occupied):
+        """
+        Board tile listener keeping the tiles hash in sync
+
+        Args:
+            x (int): x axis value
+            y (int): y axis value
+            occupied (int): 1 if the tile is now occupied, 0 if it is now empty
+        """
+        self.tiles_hash ^= _mix(y * self.width + x)
+
+    def board_key(self, robot):
+        """
+        Returns:
+            int: hash of the occupied tiles other than the robot's own tile
+        """
+        return self.tiles_hash ^ _mix(robot.y_axis * self.width + robot.x_axis)
+
+
+def plan_path(board, robot, target_x, target_y, target_facing=None, max_expansions=MAX_EXPANSIONS):
+    """
+    Finds the shortest MOVE/LEFT/RIGHT sequence taking the robot from its current pose to a target pose,
+    using A* over (x, y, facing) states. Tiles occupied on the board block the path, except the robot's own tile.
+    Plans are cached per board until a tile other than the robot's own changes.
+
+    Args:
+        board (Board): Board object
+        robot (Robot): placed Robot object
+        target_x (int): target x axis value
+        target_y (int): target y axis value
+        target_facing (str, optional): target facing. Defaults to None (any facing).
+        max_expansions (int, optional): search limit. Defaults to MAX_EXPANSIONS.
+
+    Returns:
+        tuple: commands like ('MOVE', 'LEFT', ...) or None if there is no path
+    """
+    count = len(robot.FACINGS)
+    target_code = None if target_facing is None else robot.FACING_CODES.get(target_facing)
+    if target_facing is not None and target_code is None:
+        return None
+    start_x, start_y = robot.x_axis, robot.y_axis
+    start_code = robot.facing_code
+
+    cache = _plan_cache.get(board)
+    if cache is None:
+        cache = _plan_cache[board] = PlanCache(board)
+    key = (cache.board_key(robot), type(robot), start_x, start_y, start_code, target_x, target_y, target_code)
+    plans = cache.plans
+    if key in plans:
+        plans.move_to_end(key)
+        return plans[key]
+
+    plan = _search(board, robot, start_x, start_y, start_code, target_x, target_y, target_code, count, max_expansions)
+    plans[key] = plan
+    if len(plans) > CACHE_SIZE:
+        plans.popitem(last=False)
+    return plan
+
+def _search(board, robot, start_x, start_y, start_code, target_x, target_y, target_code, count, max_expansions):
+    """
+    A* search used by plan_path
+
+    Returns:
+        tuple: commands or None if there is no path
+    """
+    max_x, max_y = board.max_x, board.max_y
+    if not (0 <= target_x <= max_x and 0 <= target_y <= max_y):
+        return None
+    contains = board.occupancy.contains
+    if (target_x, target_y) != (start_x, start_y) and contains(target_x, target_y):
+        return None
+
+    width = max_x + 1
+    closed = set() # grows with the explored states only, not with the board
+    is_closed = closed.__contains__
+    close = closed.add
+
+    dxs, dys, lefts, rights = robot.DX, robot.DY, robot.LEFT, robot.RIGHT
+    heuristic = _make_heuristic(type(robot), target_x, target_y, target_code)
+
+    start = (start_y * width + start_x) * count + start_code
+    best = {start: 0}
+    parents = {start: None} # state -> (previous state, command index)
+    heap = [(heuristic(start_x, start_y, start_code), 0, start)]
+    expansions = 0
+    while heap:
+        estimate, cost, state = heapq.heappop(heap)
+        if is_closed(state):
+            continue
+        tile, code = divmod(state, count)
+        y, x = divmod(tile, width)
+        if x == target_x and y == target_y and (target_code is None or code == target_code):
+            commands = []
+            while parents[state] is not None:
+                state, command = parents[state]
+                commands.append(COMMAND_NAMES[command])
+            commands.reverse()
+            return tuple(commands)
+        close(state)
+        expansions += 1
+        if expansions > max_expansions:
+            logger.warning("Path search gave up after %s states.", max_expansions)
+            return None
+
+        new_cost = cost + 1
+        new_x = x + dxs[code]
+        new_y = y + dys[code]
+        candidates = [(tile * count + lefts[code], 1, x, y, lefts[code]), (tile * count + rights[code], 2, x, y, rights[code])]
+        if 0 <= new_x <= max_x and 0 <= new_y <= max_y and ((new_x == start_x and new_y == start_y) or not contains(new_x, new_y)):
+            candidates.append(((new_y * width + new_x) * count + code, 0, new_x, new_y, code))
+        for next_state, command, next_x, next_y, next_code in candidates:
+            if is_closed(next_state) or best.get(next_state, new_cost + 1) <= new_cost:
+                continue
+            best[next_state] = new_cost
+            parents[next_state] = (state, command)
+            heapq.heappush(heap, (new_cost + heuristic(next_x, next_y, next_code), new_cost, next_state))
+    return None
+
+def goto(robot, target_x, target_y, target_facing=None):
+    """
+    Plans a path for a placed robot and runs it with MOVE/LEFT/RIGHT
+
+    Args:
+        robot (Robot): placed Robot object
+        target_x (int): target x axis value
+        target_y (int): target y axis value
+        target_facing (str, optional): target facing. Defaults to None (keep whatever facing the path ends with).
+
+    Returns:
+        Bool: True or False if no path was found
+    """
+    plan = plan_path(robot.board, robot, target_x, target_y, target_facing)
+    if plan is None:
+        logger.error("No path to [%s,%s].", target_x, target_y)
+        if events.hooks:
+            events.emit((events.BLOCKED, robot, target_x, target_y))
+        return False
+    for command in plan:
+        if command == 'MOVE':
+            robot.move()
+        else:
+            robot.rotate(command)
+    return True
@@ -1,20 +1,67 @@
 import logging
 
-logger = logging.getLogger() 
+import events
+
+logger = logging.getLogger(__name__)
+
+# facing code of a robot without a facing (not yet placed)
+NO_FACING = -1
 
 class Robot:
     """
-    A simple Robot Class
+    A simple Robot Class. Instances are slotted and keep the facing as an index into FACINGS,
+    the facing string is only built at the place/report boundary.
     """
+    __slots__ = ('x_axis', 'y_axis', 'facing_code', 'board')
+
+    # headings in clockwise order as (facing, x step, y step). LEFT/RIGHT turn one heading counter-clockwise/clockwise.
+    # can easily add more headings in a subclass like diagonal moves NORTHWEST, SOUTHEAST, etc.
+    HEADINGS = (
+        ("NORTH",   0,  1),
+        ("EAST",    1,  0),
+        ("SOUTH",   0, -1),
+        ("WEST",   -1,  0),
+    )
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._compile_headings()
+
+    @classmethod
+    def _compile_headings(cls):
+        """
+        Builds the direction tables from HEADINGS. Runs once per class so move/rotate only do table lookups.
+        """
+        count = len(cls.HEADINGS)
+        cls.FACINGS = tuple(heading[0] for heading in cls.HEADINGS)
+        cls.FACING_CODES = {facing: code for code, facing in enumerate(cls.FACINGS)}
+        cls.DX = tuple(heading[1] for heading in cls.HEADINGS)
+        cls.DY = tuple(heading[2] for heading in cls.HEADINGS)
+        cls.LEFT = tuple((code - 1) % count for code in range(count))
+        cls.RIGHT = tuple((code + 1) % count for code in range(count))
+        cls.TURNS = {"LEFT": cls.LEFT, "RIGHT": cls.RIGHT}
+
     def __init__(self):
         self.x_axis = None
         self.y_axis = None
-        self.facing = None
+        self.facing_code = NO_FACING
         self.board = None
 
+    @property
+    def facing(self):
+        """
+        Facing string like NORTH, or None if the robot has no facing yet
+        """
+        code = self.facing_code
+        return None if code == NO_FACING else self.FACINGS[code]
+
+    @facing.setter
+    def facing(self, value):
+        self.facing_code = NO_FACING if value is None else self.FACING_CODES[value]
+
     def _is_valid_facing(self, f):
         """
-        Checks if facing value is valid. Will capture latest list of facing values from generate_moveset()
+        Checks if facing value is valid against the facing values compiled from HEADINGS
 
         Args:
             f (str): Facing string value
@@ -22,8 +69,7 @@ class Robot:
         Returns:
             Bool: True or False
         """
-        moveset = self.generate_moveset()
-        if next((x for x in moveset if x["facing"] == f), False):
+        if f in self.FACING_CODES:
             return True
         else:
             logger.error("Invalid facing value.")
@@ -49,7 +95,7 @@ class Robot:
     def generate_moveset(self):
         """
         Generate all possible moves based on current Robot's state.
-        Update moveset variable to add more moves like NORTHWEST, SOUTHEAST, etc.
+        Built from the compiled direction tables. Extend HEADINGS to add more moves like NORTHWEST, SOUTHEAST, etc.
 
         Returns:
             list: list of dictionaries. Each dictionary will contain all valid moveset
@@ -61,12 +107,15 @@ class Robot:
             x_axis = 0
             y_axis = 0
 
-        # can easily add more moves if needed like diagonal moves NORTHWEST, SOUTHEAST, etc.
+        facings = self.FACINGS
         moveset = [
-            {"facing": "NORTH",     "LEFT": "WEST",     "RIGHT": "EAST",     "MOVE": f"[{x_axis},{y_axis+1}]"},
-            {"facing": "EAST",      "LEFT": "NORTH",    "RIGHT": "SOUTH",    "MOVE": f"[{x_axis+1},{y_axis}]"},
-            {"facing": "WEST",      "LEFT": "SOUTH",    "RIGHT": "NORTH",    "MOVE": f"[{x_axis-1},{y_axis}]"},
-            {"facing": "SOUTH",     "LEFT": "EAST",     "RIGHT": "WEST",     "MOVE": f"[{x_axis},{y_axis-1}]"},
+            {
+                "facing": facing,
+                "LEFT": facings[self.LEFT[code]],
+                "RIGHT": facings[self.RIGHT[code]],
+                "MOVE": f"[{x_axis+self.DX[code]},{y_axis+self.DY[code]}]",
+            }
+            for code, facing in enumerate(facings)
         ]
         return moveset
 
@@ -90,23 +139,24 @@ class Robot:
                 logger.info("Attempting to reposition the robot.")
 
                 if self.x_axis == x_int and self.y_axis == y_int: # if repositioning on same location, allow change in facing direction
-                    self.facing = f
+                    self.facing_code = self.FACING_CODES[f]
                 elif self.move(x_int, y_int):
-                    self.facing = f
+                    self.facing_code = self.FACING_CODES[f]
                 else:
                     return False
 
                 logger.info("Repositioning robot success.")
-                return True
             elif board.add_obstruction(x_int, y_int):
                 logger.info("Robot added to board successfully.")
                 self.board = board
                 self.x_axis = x_int
                 self.y_axis = y_int
-                self.facing = f
-                return True
+                self.facing_code = self.FACING_CODES[f]
             else:
                 return False
+            if events.hooks:
+                events.emit((events.PLACED, self, x_int, y_int, f))
+            return True
         else:
             return False
 
@@ -115,12 +165,19 @@ class Robot:
         Output current state or the robot
 
         Returns:
-            str: String state of robot in x,y,f format
+            str: String state of robot in x,y,f format, or None if the robot is not placed
         """
-        report_string = f"{self.x_axis},{self.y_axis},{self.facing}"
-        logger.info(f"Robot State = {report_string}")
-        for row in self.board.get_board_state():
-            logger.info(row)
+        if self.board is None: # NO_FACING would index the last facing
+            logger.warning("Robot not yet placed on the board. Ignoring command.")
+            return None
+        facing = self.FACINGS[self.facing_code]
+        report_string = f"{self.x_axis},{self.y_axis},{facing}"
+        logger.info("Robot State = %s", report_string)
+        if logger.isEnabledFor(logging.DEBUG): # board dump is only built when DEBUG is enabled
+            for row in self.board.get_board_state():
+                logger.debug(row)
+        if events.hooks:
+            events.emit((events.REPORTED, self, self.x_axis, self.y_axis, facing))
         return report_string
 
     def rotate(self, direction):
@@ -130,11 +187,16 @@ class Robot:
         Args:
             direction (str): LEFT or RIGHT
         """
-        moveset = self.generate_moveset()
-        old_facing = self.facing
-        new_facing = next(x for x in moveset if x["facing"] == self.facing)[direction]
-        self.facing = new_facing
-        logger.info(f"Successfully rotated from {old_facing} to {new_facing}.")
+        if self.board is None: # an unplaced robot has no facing to turn from
+            logger.warning("Robot not yet placed on the board. Ignoring command.")
+            return
+        old_code = self.facing_code
+        new_code = self.TURNS[direction][old_code]
+        self.facing_code = new_code
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Successfully rotated from %s to %s.", self.FACINGS[old_code], self.FACINGS[new_code])
+        if events.hooks:
+            events.emit((events.ROTATED, self, self.FACINGS[old_code], self.FACINGS[new_code]))
 
     def move(self, x=None, y=None):
         """
@@ -148,7 +210,6 @@ class Robot:
         Returns:
             Bool: True or False
         """
-        moveset = self.generate_moveset()
         old_x_axis = self.x_axis
         old_y_axis = self.y_axis
         
@@ -156,16 +217,22 @@ class Robot:
             new_x_axis = x
             new_y_axis = y
         else: # regular move command to move 1 tile where it's facing
-            move_location = eval(next(x for x in moveset if x["facing"] == self.facing)["MOVE"])
-            new_x_axis = move_location[0]
-            new_y_axis = move_location[1]
+            code = self.facing_code
+            new_x_axis = old_x_axis + self.DX[code]
+            new_y_axis = old_y_axis + self.DY[code]
 
         if self.board.add_obstruction(new_x_axis,new_y_axis):
             self.board.remove_obstruction(old_x_axis,old_y_axis)
             self.x_axis = new_x_axis
             self.y_axis = new_y_axis
-            logger.info(f"Successfully moved from [{old_x_axis},{old_y_axis}] to [{new_x_axis},{new_y_axis}].")
+            logger.info("Successfully moved from [%s,%s] to [%s,%s].", old_x_axis, old_y_axis, new_x_axis, new_y_axis)
+            if events.hooks:
+                events.emit((events.MOVED, self, old_x_axis, old_y_axis, new_x_axis, new_y_axis))
             return True
-        
-        
-      
+        else:
+            if events.hooks:
+                events.emit((events.BLOCKED, self, new_x_axis, new_y_axis))
+            return False
+
+
+Robot._compile_headings()
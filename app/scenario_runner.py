@@ -0,0 +1,104 @@
+import argparse
+import json
+import logging
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from batch_runner import execute
+from board import Board
+from command_parser import compile_program
+from robot import Robot
+from start_app import set_quiet_mode
+
+logger = logging.getLogger(__name__)
+
+# reports: every REPORT output, final: last REPORT output or None, invalid: number of invalid lines,
+# error: exception text if the scenario could not be run
+ScenarioResult = namedtuple('ScenarioResult', ['name', 'reports', 'final', 'invalid', 'error'])
+
+def run_scenario(path, size=5):
+    """
+    Runs one scenario file on a fresh board and robot
+
+    Args:
+        path (str): scenario file path, one command per line
+        size (int, optional): board size. Defaults to 5.
+
+    Returns:
+        ScenarioResult: outcome of the scenario
+    """
+    try:
+        with open(path) as scenario_file:
+            program = compile_program(scenario_file.read())
+        reports = list(execute(program.instructions, Board(size), Robot()))
+    except Exception as error: # a broken scenario must not take the whole run down
+        return ScenarioResult(path, [], None, 0, f"{type(error).__name__}: {error}")
+    return ScenarioResult(path, reports, reports[-1] if reports else None, len(program.errors), None)
+
+def _run_chunk(paths, size):
+    """
+    Runs several scenarios in one worker call to save on inter-process round trips
+
+    Returns:
+        list: ScenarioResult for every path
+    """
+    return [run_scenario(path, size) for path in paths]
+
+def run_scenarios(paths, workers=None, ordered=True, size=5, chunksize=16):
+    """
+    Runs scenario files across a pool of worker processes. Workers are reused for every scenario.
+
+    Args:
+        paths (iterable): scenario file paths
+        workers (int, optional): number of worker processes. Defaults to the number of cores.
+        ordered (bool, optional): yield results in input order, otherwise as they complete. Defaults to True.
+        size (int, optional): board size. Defaults to 5.
+        chunksize (int, optional): scenarios sent to a worker at a time. Defaults to 16.
+
+    Yields:
+        ScenarioResult: outcome of every scenario
+    """
+    paths = list(paths)
+    chunks = [paths[index:index + chunksize] for index in range(0, len(paths), chunksize)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=set_quiet_mode) as executor:
+        if ordered:
+            for results in executor.map(_run_chunk, chunks, [size] * len(chunks)):
+                yield from results
+        else:
+            futures = [executor.submit(_run_chunk, chunk, size) for chunk in chunks]
+            for future in as_completed(futures):
+                yield from future.result()
+
+def summarize(results):
+    """
+    Aggregates scenario results
+
+    Args:
+        results (iterable): ScenarioResult objects
+
+    Returns:
+        dict: scenario, failure and invalid line counts plus the final REPORT of every scenario
+    """
+    summary = {"scenarios": 0, "failures": 0, "invalid_lines": 0, "finals": {}}
+    for result in results:
+        summary["scenarios"] += 1
+        summary["invalid_lines"] += result.invalid
+        if result.error is not None:
+            summary["failures"] += 1
+        summary["finals"][result.name] = result.final
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run toy robot scenario files in parallel")
+    parser.add_argument('paths', nargs='+', metavar='FILE', help="scenario files, one command per line")
+    parser.add_argument('--workers', type=int, help="number of worker processes, defaults to the number of cores")
+    parser.add_argument('--unordered', action='store_true', help="print results as they complete")
+    parser.add_argument('--size', type=int, default=5, help="board size")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
+    results = []
+    for result in run_scenarios(args.paths, args.workers, not args.unordered, args.size):
+        print(json.dumps(result._asdict()))
+        results.append(result)
+    summary = summarize(results)
+    print(json.dumps({key: value for key, value in summary.items() if key != "finals"}))
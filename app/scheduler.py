@@ -0,0 +1,97 @@
+import heapq
+import logging
+from collections import deque
+
+from robot import Robot
+from start_app import run_command
+
+logger = logging.getLogger(__name__)
+
+
+class TickScheduler:
+    """
+    Runs queued commands for many robots on one board in discrete ticks. Every tick takes at most one command
+    from each robot with pending work, in ascending robot id order, so conflicts on the board are always resolved
+    the same way. Only robots with queued commands are visited: they are kept in a ready heap of robot ids.
+    Commands run through start_app.run_command, so a single robot behaves exactly as in the interactive application.
+    """
+    def __init__(self, board):
+        self.board = board
+        self.robots = []
+        self.queues = []
+        self.ready = [] # heap of robot ids with queued commands
+        self.tick_count = 0
+
+    def add_robot(self, robot=None):
+        """
+        Registers a robot with an empty command queue
+
+        Args:
+            robot (Robot, optional): robot to drive, e.g. a FleetRobot. Defaults to a new Robot.
+
+        Returns:
+            int: robot id
+        """
+        self.robots.append(robot if robot is not None else Robot())
+        self.queues.append(deque())
+        return len(self.robots) - 1
+
+    def submit(self, robot_id, *commands):
+        """
+        Queues commands for a robot. They run one per tick in the order given.
+
+        Args:
+            robot_id (int): robot id
+            *commands (str): commands to queue
+        """
+        queue = self.queues[robot_id]
+        if not queue and commands:
+            heapq.heappush(self.ready, robot_id)
+        queue.extend(commands)
+
+    def pending(self):
+        """
+        Returns:
+            int: number of queued commands over all robots
+        """
+        return sum(len(self.queues[robot_id]) for robot_id in self.ready)
+
+    def tick(self):
+        """
+        Advances the world by one tick
+
+        Returns:
+            list: (robot id, output) for every REPORT or DISTANCE output of the tick, in robot id order
+        """
+        ready = self.ready
+        running = [heapq.heappop(ready) for _ in range(len(ready))]
+        outputs = []
+        for robot_id in running:
+            queue = self.queues[robot_id]
+            result = run_command(queue.popleft(), self.board, self.robots[robot_id])
+            if result == 'EXIT': # the robot stops, like the interactive application
+                logger.info("Robot %s exited with %s commands left.", robot_id, len(queue))
+                queue.clear()
+            elif isinstance(result, str):
+                outputs.append((robot_id, result))
+            if queue:
+                heapq.heappush(ready, robot_id)
+        self.tick_count += 1
+        return outputs
+
+    def run(self, max_ticks=None):
+        """
+        Runs ticks until every queue is empty
+
+        Args:
+            max_ticks (int, optional): stop after this many ticks. Defaults to None (no limit).
+
+        Yields:
+            tuple: (tick, robot id, output) for every REPORT or DISTANCE output
+        """
+        ticks = 0
+        while self.ready and (max_ticks is None or ticks < max_ticks):
+            tick = self.tick_count
+            for robot_id, output in self.tick():
+                yield tick, robot_id, output
+            ticks += 1
@@ -0,0 +1,189 @@
+import argparse
+import asyncio
+import logging
+import time
+
+from board import Board
+from robot import Robot
+from start_app import run_command, set_quiet_mode
+
+logger = logging.getLogger(__name__)
+
+# bytes read from a connection at a time. All complete lines in a chunk are run before replies are written.
+READ_CHUNK = 64 * 1024
+# longest accepted command line in bytes
+MAX_LINE = 1024
+# write buffer size above which the server waits for the client to read its replies
+WRITE_HIGH_WATER = 256 * 1024
+
+
+class TokenBucket:
+    """
+    Per-connection rate limiter allowing rate commands per second with bursts of up to burst commands
+    """
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def delay(self, count):
+        """
+        Takes count tokens from the bucket
+
+        Args:
+            count (int): number of commands about to run
+
+        Returns:
+            float: seconds to wait before running them
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= count
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class SimulatorServer:
+    """
+    Asyncio server accepting line-oriented commands with the same grammar as start_app.run_command.
+    Every connection drives its own robot, either on its own board or on one board shared by all connections.
+    Only REPORT outputs are sent back, one per line.
+    """
+    def __init__(self, size=5, shared_board=False, rate=None, burst=None):
+        self.size = size
+        self.board = Board(size) if shared_board else None
+        self.rate = rate
+        self.burst = burst
+        self.connections = 0
+        self.commands = 0
+        self.server = None
+
+    async def start_tcp(self, host='127.0.0.1', port=0):
+        """
+        Starts listening on a TCP port
+
+        Args:
+            host (str, optional): interface to bind. Defaults to '127.0.0.1'.
+            port (int, optional): port to bind, 0 picks a free port. Defaults to 0.
+
+        Returns:
+            asyncio.AbstractServer: the listening server
+        """
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+        return self.server
+
+    async def start_unix(self, path):
+        """
+        Starts listening on a Unix socket
+
+        Args:
+            path (str): socket path
+
+        Returns:
+            asyncio.AbstractServer: the listening server
+        """
+        self.server = await asyncio.start_unix_server(self.handle_connection, path)
+        return self.server
+
+    async def close(self):
+        """
+        Stops accepting connections
+        """
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+    def run_lines(self, lines, board, robot):
+        """
+        Runs a batch of command lines for one connection
+
+        Args:
+            lines (list): command lines as bytes
+            board (Board): Board object
+            robot (Robot): Robot object
+
+        Returns:
+            tuple: (replies, exit) where replies is the REPORT output bytes and exit is True if EXIT was received
+        """
+        replies = []
+        for line in lines:
+            result = run_command(line.decode('ascii', 'replace'), board, robot)
+            if result == 'EXIT':
+                return b''.join(replies), True
+            elif isinstance(result, str):
+                replies.append(result.encode('ascii') + b'\n')
+        return b''.join(replies), False
+
+    async def handle_connection(self, reader, writer):
+        """
+        Serves one client. Commands are read in chunks and pipelined, replies for a chunk are written at once,
+        and reading pauses while the client is not consuming replies (backpressure) or is over its rate limit.
+        """
+        board = self.board if self.board is not None else Board(self.size)
+        robot = Robot()
+        bucket = TokenBucket(self.rate, self.burst) if self.rate else None
+        writer.transport.set_write_buffer_limits(high=WRITE_HIGH_WATER)
+        self.connections += 1
+        pending = b''
+        try:
+            while True:
+                chunk = await reader.read(READ_CHUNK)
+                if not chunk:
+                    break
+                lines = (pending + chunk).split(b'\n')
+                pending = lines.pop()
+                if len(pending) > MAX_LINE:
+                    logger.warning("Command line too long. Closing connection.")
+                    break
+                if not lines:
+                    continue
+                if bucket is not None:
+                    delay = bucket.delay(len(lines))
+                    if delay:
+                        await asyncio.sleep(delay)
+                self.commands += len(lines)
+                replies, exit_requested = self.run_lines(lines, board, robot)
+                if replies:
+                    writer.write(replies)
+                    await writer.drain()
+                if exit_requested:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            self.connections -= 1
+            if robot.board is not None and self.board is not None: # free the tile on the shared board
+                board.remove_obstruction(robot.x_axis, robot.y_axis)
+            writer.close()
+
+async def serve(args):
+    """
+    Runs the server until cancelled
+    """
+    simulator = SimulatorServer(args.size, args.shared, args.rate, args.burst)
+    if args.unix:
+        server = await simulator.start_unix(args.unix)
+    else:
+        server = await simulator.start_tcp(args.host, args.port)
+    for sock in server.sockets:
+        print(f"Listening on {sock.getsockname()}")
+    async with server:
+        await server.serve_forever()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Toy robot simulator server")
+    parser.add_argument('--host', default='127.0.0.1', help="TCP interface to bind")
+    parser.add_argument('--port', type=int, default=8765, help="TCP port to bind")
+    parser.add_argument('--unix', metavar='PATH', help="listen on a Unix socket instead of TCP")
+    parser.add_argument('--size', type=int, default=5, help="board size")
+    parser.add_argument('--shared', action='store_true', help="all connections share one board")
+    parser.add_argument('--rate', type=float, help="per connection limit in commands per second")
+    parser.add_argument('--burst', type=float, help="per connection burst size, defaults to --rate")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
+    set_quiet_mode()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
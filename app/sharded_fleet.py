@@ -0,0 +1,470 @@
+import logging
+import multiprocessing
+from array import array
+from bisect import bisect_right, insort
+from collections import namedtuple
+from multiprocessing.shared_memory import SharedMemory
+
+from board import LoadResult
+from command_parser import OP_MOVE, OP_LEFT, OP_RIGHT
+from fleet import Fleet, UNPLACED
+from robot import Robot
+from snapshot import dump_snapshot
+from sparse_board import SparseBoard
+from step_engine import OP_NONE
+
+logger = logging.getLogger(__name__)
+
+# Shared memory layout, all arrays indexed by robot id except the edges:
+#   ops      i8[capacity]    opcode of every robot for the current tick, written by the coordinator
+#   facings  i8[capacity]    facing code, UNPLACED for a free slot
+#   xs, ys   i32[capacity]   position, written by the shard owning the robot
+#   edges    u8[shard count][2][width]   bottom and top row occupancy of every shard as of the end of the last tick
+SharedViews = namedtuple('SharedViews', ['ops', 'facings', 'xs', 'ys', 'edges'])
+
+# worker methods the coordinator may call
+WORKER_MESSAGES = frozenset(('add_obstruction', 'load_obstructions', 'add_robot', 'step', 'accept', 'release', 'tiles'))
+
+
+def _shared_size(capacity, shard_count, width):
+    """
+    Returns:
+        int: bytes needed for the shared arrays
+    """
+    return (2 * capacity + 3) // 4 * 4 + 8 * capacity + 2 * shard_count * width
+
+def _shared_views(buffer, capacity, shard_count, width):
+    """
+    Returns:
+        SharedViews: typed memoryviews of the shared arrays
+    """
+    xs_offset = (2 * capacity + 3) // 4 * 4
+    edges_offset = xs_offset + 8 * capacity
+    return SharedViews(
+        buffer[:capacity].cast('b'),
+        buffer[capacity:2 * capacity].cast('b'),
+        buffer[xs_offset:xs_offset + 4 * capacity].cast('i'),
+        buffer[xs_offset + 4 * capacity:edges_offset].cast('i'),
+        buffer[edges_offset:edges_offset + 2 * shard_count * width],
+    )
+
+
+class ShardWorker:
+    """
+    One shard of a ShardedFleet: the robots and obstructions in a band of rows [y0, y1).
+    The board is a SparseBoard of the full table in global coordinates, of which only the band is ever occupied.
+    Robots are FleetRobot views straight onto the shared arrays.
+    """
+    def __init__(self, shm_name, capacity, width, height, bounds, index, chunk_size=64):
+        self.shm = SharedMemory(shm_name)
+        self.index = index
+        self.y0 = bounds[index]
+        self.y1 = bounds[index + 1]
+        self.shard_count = len(bounds) - 1
+        self.width = width
+        self.board = SparseBoard(width, height, chunk_size)
+        self.views = _shared_views(self.shm.buf, capacity, self.shard_count, width)
+        self.fleet = Fleet(self.board)
+        self.fleet.xs, self.fleet.ys, self.fleet.facings = self.views.xs, self.views.ys, self.views.facings
+        self.robot_ids = [] # ids of the robots in this shard, ascending
+        self.own_edges = bytearray(2 * width) # bottom row then top row, published at the end of every tick
+        self.board.tile_listeners.append(self._tile_changed)
+
+    def _tile_changed(self, x, y, occupied):
+        if y == self.y0:
+            self.own_edges[x] = occupied
+        if y == self.y1 - 1:
+            self.own_edges[self.width + x] = occupied
+
+    def _publish(self):
+        """
+        Copies this shard's edge rows to shared memory for the neighbouring shards
+        """
+        start = self.index * 2 * self.width
+        self.views.edges[start:start + 2 * self.width] = self.own_edges
+
+    def handle(self, message):
+        """
+        Runs one coordinator message
+
+        Args:
+            message (tuple): (method name, *arguments)
+
+        Returns:
+            object: result of the method
+        """
+        name = message[0]
+        if name not in WORKER_MESSAGES:
+            raise ValueError(f"Unknown shard message {name!r}.")
+        return getattr(self, name)(*message[1:])
+
+    def add_obstruction(self, x, y):
+        added = self.board.add_obstruction(x, y)
+        self._publish()
+        return added
+
+    def load_obstructions(self, cells):
+        result = self.board.load_obstructions(cells)
+        self._publish()
+        return tuple(result)
+
+    def add_robot(self, robot_id, x, y, f):
+        if not self.fleet.robot(robot_id).place(x, y, f, self.board):
+            return False
+        insort(self.robot_ids, robot_id)
+        self._publish()
+        return True
+
+    def step(self):
+        """
+        First phase of a tick: runs this tick's command for every robot of the shard in ascending robot id order.
+        A MOVE into a neighbouring shard is blocked if the target tile was occupied at the end of the last tick,
+        otherwise the robot keeps its tile and is returned as a handoff.
+
+        Returns:
+            list: (robot id, x, y) target tiles of the robots leaving the shard
+        """
+        ops = self.views.ops
+        facings, xs, ys = self.fleet.facings, self.fleet.xs, self.fleet.ys
+        edges = self.views.edges
+        width = self.width
+        max_y = self.board.max_y
+        handoffs = []
+        for robot_id in self.robot_ids:
+            opcode = ops[robot_id]
+            if opcode == OP_NONE:
+                continue
+            if opcode == OP_MOVE:
+                code = facings[robot_id]
+                y = ys[robot_id] + Robot.DY[code]
+                if self.y0 <= y < self.y1 or not 0 <= y <= max_y:
+                    self.fleet.robot(robot_id).move()
+                    continue
+                x = xs[robot_id] + Robot.DX[code]
+                if y >= self.y1: # the bottom row of the shard above
+                    edge = edges[(self.index + 1) * 2 * width + x]
+                else: # the top row of the shard below
+                    edge = edges[(self.index - 1) * 2 * width + width + x]
+                if edge:
+                    logger.info("Robot %s is blocked at the shard edge by [%s,%s].", robot_id, x, y)
+                else:
+                    handoffs.append((robot_id, x, y))
+            elif opcode == OP_LEFT:
+                self.fleet.robot(robot_id).rotate('LEFT')
+            elif opcode == OP_RIGHT:
+                self.fleet.robot(robot_id).rotate('RIGHT')
+        return handoffs
+
+    def accept(self, handoffs):
+        """
+        Second phase of a tick: takes in robots from a neighbouring shard in ascending robot id order,
+        if their target tile is still free after this shard's own moves
+
+        Args:
+            handoffs (list): (robot id, x, y) target tiles
+
+        Returns:
+            list: (robot id, x, y) of the accepted robots
+        """
+        accepted = []
+        for robot_id, x, y in handoffs:
+            if self.board.add_obstruction(x, y):
+                insort(self.robot_ids, robot_id)
+                accepted.append((robot_id, x, y))
+        return accepted
+
+    def release(self, accepted):
+        """
+        Last phase of a tick: frees the tiles of the robots accepted by a neighbouring shard, moves them in the shared
+        arrays and publishes the edge rows
+
+        Args:
+            accepted (list): (robot id, x, y) of robots that left this shard
+        """
+        xs, ys = self.fleet.xs, self.fleet.ys
+        for robot_id, x, y in accepted:
+            self.board.remove_obstruction(xs[robot_id], ys[robot_id])
+            self.robot_ids.remove(robot_id)
+            xs[robot_id] = x
+            ys[robot_id] = y
+        self._publish()
+
+    def tiles(self):
+        """
+        Returns:
+            tuple: (xs, ys) arrays of every occupied tile of the shard, robots included
+        """
+        tile_xs, tile_ys = array('I'), array('I')
+        for x, y in self.board.occupancy:
+            tile_xs.append(x)
+            tile_ys.append(y)
+        return tile_xs, tile_ys
+
+    def close(self):
+        """
+        Releases the shared memory views and detaches from the shared memory
+        """
+        self.fleet = None
+        for view in self.views:
+            view.release()
+        self.shm.close()
+
+
+def _serve(connection, *worker_args):
+    """
+    Worker process loop. Replies to every message with (True, result) or (False, exception).
+    """
+    worker = ShardWorker(*worker_args)
+    try:
+        while True:
+            message = connection.recv()
+            if message[0] == 'close':
+                break
+            try:
+                connection.send((True, worker.handle(message)))
+            except Exception as error:
+                connection.send((False, error))
+    finally:
+        worker.close()
+        connection.close()
+
+
+class ShardedFleet:
+    """
+    A fleet on a table split into bands of rows (shards), each owned by a ShardWorker in its own process.
+    Robot state and the edge rows of every shard are kept in one shared memory block, so ticks only send short
+    messages and the lists of robots crossing a shard edge between processes.
+
+    A tick runs in three phases. Every shard first runs the commands of its own robots in ascending robot id order,
+    like step_engine.step_scalar. A MOVE across a shard edge is checked against the neighbour's edge row as of the
+    end of the last tick, then the robot is handed to the neighbour, which accepts it if the tile is still free.
+    Finally the source shards free the tiles of the accepted robots. So a robot never follows another robot across
+    a shard edge in the same tick; with one shard a tick is exactly step_scalar.
+    """
+    def __init__(self, width, height=None, shard_count=2, capacity=1024, processes=True, chunk_size=64):
+        height = width if height is None else height
+        if not 1 <= shard_count <= height:
+            raise ValueError("shard_count must be between 1 and the board height.")
+        self.width = width
+        self.height = height
+        self.chunk_size = chunk_size
+        self.capacity = capacity
+        self.count = 0
+        self.bounds = [height * index // shard_count for index in range(shard_count + 1)]
+        self.shm = SharedMemory(create=True, size=_shared_size(capacity, shard_count, width))
+        self.views = _shared_views(self.shm.buf, capacity, shard_count, width)
+        self.views.facings[:] = array('b', [UNPLACED]) * capacity
+        self.views.ops[:] = array('b', [OP_NONE]) * capacity
+        self.workers = []
+        self.connections = []
+        self.processes = []
+        for index in range(shard_count):
+            worker_args = (self.shm.name, capacity, width, height, self.bounds, index, chunk_size)
+            if processes:
+                parent_connection, child_connection = multiprocessing.Pipe()
+                process = multiprocessing.Process(target=_serve, args=(child_connection,) + worker_args, daemon=True)
+                process.start()
+                child_connection.close()
+                self.connections.append(parent_connection)
+                self.processes.append(process)
+            else:
+                self.workers.append(ShardWorker(*worker_args))
+
+    def __len__(self):
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _request(self, messages):
+        """
+        Sends messages to shards and waits for all replies. Shards in other processes work on them in parallel.
+
+        Args:
+            messages (dict): shard index -> (method name, *arguments)
+
+        Returns:
+            dict: shard index -> result
+        """
+        if self.workers:
+            return {index: self.workers[index].handle(message) for index, message in messages.items()}
+        for index, message in messages.items():
+            self.connections[index].send(message)
+        results = {}
+        for index in messages:
+            ok, result = self.connections[index].recv()
+            if not ok:
+                raise result
+            results[index] = result
+        return results
+
+    def shard_of(self, y):
+        """
+        Args:
+            y (int): y axis value inside the board
+
+        Returns:
+            int: index of the shard owning row y
+        """
+        return bisect_right(self.bounds, y) - 1
+
+    def _owner(self, x, y):
+        """
+        Returns:
+            int: index of the shard owning x,y, or None (with an error logged) when y is not a row of the board
+        """
+        if not isinstance(y, int) or not 0 <= y < self.height:
+            logger.error("Location is outside the board. The y axis value is invalid.")
+            return None
+        return self.shard_of(y)
+
+    def add_obstruction(self, x, y):
+        """
+        Adds a static obstruction
+
+        Args:
+            x (int): x axis value
+            y (int): y axis value
+
+        Returns:
+            Bool: True or False
+        """
+        shard = self._owner(x, y)
+        if shard is None:
+            return False
+        return self._request({shard: ('add_obstruction', x, y)})[shard]
+
+    def load_obstructions(self, cells):
+        """
+        Adds many static obstructions, each shard loading its own cells in bulk
+
+        Args:
+            cells (iterable): (x, y) pairs
+
+        Returns:
+            LoadResult: added, occupied and invalid cell counts
+        """
+        groups = {}
+        invalid = 0
+        for x, y in cells:
+            if 0 <= y < self.height:
+                groups.setdefault(self.shard_of(y), []).append((x, y))
+            else:
+                invalid += 1
+        if invalid:
+            logger.warning("Skipped %s cells outside the board.", invalid)
+        results = self._request({shard: ('load_obstructions', group) for shard, group in groups.items()})
+        added, occupied, shard_invalid = (sum(column) for column in zip((0, 0, 0), *results.values()))
+        return LoadResult(added, occupied, invalid + shard_invalid)
+
+    def add_robot(self, x, y, f):
+        """
+        Places a new robot
+
+        Args:
+            x (int): x axis value
+            y (int): y axis value
+            f (str): facing orientation
+
+        Returns:
+            int: robot id, or None if the robot could not be placed
+        """
+        if self.count == self.capacity:
+            raise ValueError(f"The fleet is full ({self.capacity} robots).")
+        shard = self._owner(x, y)
+        if shard is None or not self._request({shard: ('add_robot', self.count, x, y, f)})[shard]:
+            return None
+        self.count += 1
+        return self.count - 1
+
+    def step(self, ops):
+        """
+        Runs one tick of commands
+
+        Args:
+            ops (sequence): one opcode per robot id (OP_MOVE, OP_LEFT, OP_RIGHT or OP_NONE)
+        """
+        if len(ops) > self.count:
+            raise ValueError(f"Got {len(ops)} opcodes for {self.count} robots.")
+        views = self.views
+        views.ops[:len(ops)] = ops if isinstance(ops, array) and ops.typecode == 'b' else array('b', ops)
+        views.ops[len(ops):self.count] = array('b', [OP_NONE]) * (self.count - len(ops))
+        shards = range(len(self.bounds) - 1)
+        handoffs = self._request({shard: ('step',) for shard in shards})
+        incoming = {}
+        for source in shards:
+            for robot_id, x, y in handoffs[source]:
+                incoming.setdefault(self.shard_of(y), []).append((robot_id, x, y))
+        accepted = self._request({shard: ('accept', sorted(items)) for shard, items in incoming.items()})
+        leaving = {shard: [] for shard in shards}
+        for items in accepted.values():
+            for robot_id, x, y in items:
+                leaving[self.shard_of(views.ys[robot_id])].append((robot_id, x, y))
+        self._request({shard: ('release', items) for shard, items in leaving.items()})
+
+    def report(self, robot_id):
+        """
+        Args:
+            robot_id (int): robot id
+
+        Returns:
+            str: state of the robot in x,y,f format, or None if it is not placed
+        """
+        code = self.views.facings[robot_id]
+        if code == UNPLACED:
+            return None
+        return f"{self.views.xs[robot_id]},{self.views.ys[robot_id]},{Robot.FACINGS[code]}"
+
+    def reports(self):
+        """
+        Cluster-wide REPORT
+
+        Returns:
+            list: (robot id, x,y,f report) of every placed robot in robot id order
+        """
+        return [(robot_id, self.report(robot_id)) for robot_id in range(self.count)
+                if self.views.facings[robot_id] != UNPLACED]
+
+    def gather(self):
+        """
+        Assembles the shards into one board and fleet
+
+        Returns:
+            tuple: (SparseBoard, Fleet) with every obstruction and robot of the shards
+        """
+        board = SparseBoard(self.width, self.height, self.chunk_size)
+        for tile_xs, tile_ys in self._request({shard: ('tiles',) for shard in range(len(self.bounds) - 1)}).values():
+            board.load_obstructions(zip(tile_xs, tile_ys))
+        fleet = Fleet(board)
+        for values, view in ((fleet.xs, self.views.xs), (fleet.ys, self.views.ys), (fleet.facings, self.views.facings)):
+            values.frombytes(view[:self.count].tobytes())
+        return board, fleet
+
+    def snapshot(self):
+        """
+        Returns:
+            bytes: snapshot of the whole table in the snapshot.py format
+        """
+        return dump_snapshot(*self.gather())
+
+    def close(self):
+        """
+        Stops the workers and frees the shared memory
+        """
+        if self.shm is None:
+            return
+        for connection in self.connections:
+            connection.send(('close',))
+            connection.close()
+        for process in self.processes:
+            process.join()
+        for worker in self.workers:
+            worker.close()
+        for view in self.views:
+            view.release()
+        self.shm.close()
+        self.shm.unlink()
+        self.shm = None
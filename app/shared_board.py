@@ -0,0 +1,225 @@
+import logging
+import mmap
+import struct
+import time
+
+from board import Board
+from occupancy import BitmapOccupancy, bitmap_nbytes, numpy
+
+logger = logging.getLogger(__name__)
+
+# File layout (native byte order, the file is shared by processes on one machine):
+#   header    magic, version, width, height
+#   counters  sequence u64, occupied tile count u64
+#   bits      one bit per tile, tile y * width + x is bit (key & 7) of byte key >> 3 (the BitmapOccupancy layout)
+# The sequence is odd while the simulator is writing. Readers retry a read when the sequence was odd or changed while
+# they read (a seqlock), so they never block the simulator and never take a lock.
+MAGIC = b'TRBG'
+VERSION = 1
+HEADER = struct.Struct('=4sB3xII')
+COUNTERS_OFFSET = 16
+BITS_OFFSET = 32
+
+
+class SharedOccupancy(BitmapOccupancy):
+    """
+    Bitmap occupancy index stored in a memory-mapped file, so other processes can read the live board without
+    copies or RPC. Every write bumps the sequence counter before and after the change.
+    """
+    def __init__(self, width, height, path):
+        self.width = width
+        self.height = height
+        self.path = path
+        size = BITS_OFFSET + bitmap_nbytes(width, height)
+        self.file = open(path, 'w+b')
+        self.file.truncate(size)
+        self._mmap = mmap.mmap(self.file.fileno(), size)
+        HEADER.pack_into(self._mmap, 0, MAGIC, VERSION, width, height)
+        view = memoryview(self._mmap)
+        self.counters = view[COUNTERS_OFFSET:BITS_OFFSET].cast('Q')
+        self.bits = view[BITS_OFFSET:]
+        view.release()
+        self.count = 0
+
+    def begin_write(self):
+        """
+        Marks the start of a change, readers retry until end_write
+        """
+        self.counters[0] += 1
+
+    def end_write(self):
+        """
+        Marks the end of a change and publishes the tile count
+        """
+        self.counters[1] = self.count
+        self.counters[0] += 1
+
+    def add(self, x, y):
+        key = y * self.width + x
+        mask = 1 << (key & 7)
+        bits = self.bits
+        if not bits[key >> 3] & mask:
+            counters = self.counters
+            counters[0] += 1
+            bits[key >> 3] |= mask
+            self.count += 1
+            counters[1] = self.count
+            counters[0] += 1
+
+    def discard(self, x, y):
+        key = y * self.width + x
+        mask = 1 << (key & 7)
+        bits = self.bits
+        if bits[key >> 3] & mask:
+            counters = self.counters
+            counters[0] += 1
+            bits[key >> 3] &= ~mask
+            self.count -= 1
+            counters[1] = self.count
+            counters[0] += 1
+
+    def add_keys(self, keys):
+        self.begin_write()
+        try:
+            return BitmapOccupancy.add_keys(self, keys)
+        finally:
+            self.end_write()
+
+    def close(self):
+        """
+        Unmaps the file. The file is kept so readers can still open it.
+        """
+        if self._mmap.closed:
+            return
+        self.counters.release()
+        self.bits.release()
+        self._mmap.close()
+        self.file.close()
+
+
+class SharedBoard(Board):
+    """
+    A Board whose occupancy bitmap lives in a memory-mapped file (e.g. under /dev/shm) that visualisers and monitoring
+    tools can open with SharedBoardReader. Works with Robot, Fleet and step_engine unchanged.
+    """
+    def __init__(self, size, path):
+        super().__init__(size, occupancy=SharedOccupancy(size, size, path))
+
+    def close(self):
+        """
+        Unmaps the shared file
+        """
+        self.occupancy.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class SharedBoardReader:
+    """
+    Read-only view of a SharedBoard file from any process. The bitmap is mapped, not copied; read() runs a function
+    against it until the function saw a consistent board.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as shared_file:
+            self._mmap = mmap.mmap(shared_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._mmap) < BITS_OFFSET:
+            self._mmap.close()
+            raise ValueError("Shared board file is truncated.")
+        magic, version, self.width, self.height = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC:
+            self._mmap.close()
+            raise ValueError("Not a shared robot simulator board.")
+        if version != VERSION:
+            self._mmap.close()
+            raise ValueError(f"Unsupported shared board version {version}.")
+        view = memoryview(self._mmap)
+        self.counters = view[COUNTERS_OFFSET:BITS_OFFSET].cast('Q')
+        self.bits = view[BITS_OFFSET:BITS_OFFSET + bitmap_nbytes(self.width, self.height)]
+        view.release()
+
+    def sequence(self):
+        """
+        Returns:
+            int: current sequence number, odd while the simulator is writing
+        """
+        return self.counters[0]
+
+    def read(self, function):
+        """
+        Calls function(bits) with the mapped bitmap until no write happened during the call.
+        The function must not keep the view or anything taken from it without copying.
+
+        Args:
+            function (callable): function of the bitmap memoryview
+
+        Returns:
+            object: result of the last call
+        """
+        counters = self.counters
+        while True:
+            start = counters[0]
+            if start & 1: # a write is in progress
+                time.sleep(0)
+                continue
+            result = function(self.bits)
+            if counters[0] == start:
+                return result
+
+    def contains(self, x, y):
+        """
+        Checks if x,y is occupied. A single byte read is always consistent.
+
+        Returns:
+            Bool: True or False
+        """
+        key = y * self.width + x
+        return bool(self.bits[key >> 3] & (1 << (key & 7)))
+
+    def count(self):
+        """
+        Returns:
+            int: number of occupied tiles
+        """
+        return self.read(lambda bits: self.counters[1])
+
+    def snapshot(self):
+        """
+        Returns:
+            tuple: (sequence, bytes) consistent copy of the bitmap and the sequence it was taken at
+        """
+        return self.read(lambda bits: (self.counters[0], bits.tobytes()))
+
+    def as_numpy(self):
+        """
+        Consistent copy of the board as a 2D uint8 array with one byte per tile, first row is the top of the board
+        (the load_obstruction_mask layout)
+
+        Returns:
+            numpy.ndarray: height x width array or None if numpy is not installed
+        """
+        if numpy is None:
+            return None
+        def unpack(bits):
+            tiles = numpy.unpackbits(numpy.frombuffer(bits, dtype=numpy.uint8), bitorder='little')
+            return tiles[:self.width * self.height].reshape(self.height, self.width)[::-1].copy()
+        return self.read(unpack)
+
+    def close(self):
+        """
+        Releases the memory map
+        """
+        if self._mmap.closed:
+            return
+        self.counters.release()
+        self.bits.release()
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
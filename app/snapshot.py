@@ -0,0 +1,305 @@
+import importlib
+import logging
+import mmap
+import struct
+import sys
+from array import array
+
+from board import Board
+from fleet import Fleet, FleetRobot, UNPLACED
+from occupancy import ChunkedOccupancy, maybe_promote
+from robot import Robot
+from sparse_board import SparseBoard
+
+logger = logging.getLogger(__name__)
+
+# File layout (little endian):
+#   header   magic, version, flags, chunk size, width, height, tile count, robot count
+#   tiles    x u32[tile count], y u32[tile count]         every occupied tile, robots included
+#   robots   x u32[robot count], y u32[robot count], facing i8[robot count]   facing -1 = not placed
+#   classes  (version 2, robot lists only) class count u16, per class u16 length and 'module:qualname' in UTF-8,
+#            class index u16[robot count]
+# Version 1 files have no class section and restore base Robot objects.
+MAGIC = b'TRBS'
+VERSION = 2
+SUPPORTED_VERSIONS = (1, 2)
+HEADER = struct.Struct('<4sBBHIIQQ')
+
+FLAG_SPARSE = 1
+FLAG_FLEET = 2
+
+def _le_array(typecode, values):
+    """
+    Returns:
+        array: array of values in little endian byte order
+    """
+    values = array(typecode, values)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+def _robot_arrays(robots):
+    """
+    Returns:
+        tuple: (xs, ys, facings) arrays for a Fleet or a list of Robot objects
+    """
+    if isinstance(robots, Fleet):
+        return robots.xs, robots.ys, robots.facings
+    xs, ys, facings = array('I'), array('I'), array('b')
+    for robot in robots:
+        placed = robot.board is not None
+        xs.append(robot.x_axis if placed else 0)
+        ys.append(robot.y_axis if placed else 0)
+        facings.append(robot.facing_code if placed else UNPLACED)
+    return xs, ys, facings
+
+def _class_name(cls):
+    """
+    Returns:
+        str: 'module:qualname' of a robot class that load_snapshot can import again
+    """
+    if '<locals>' in cls.__qualname__:
+        raise ValueError(f"Robot class {cls.__qualname__} is defined inside a function and cannot be snapshotted.")
+    return f"{cls.__module__}:{cls.__qualname__}"
+
+def _find_class(name):
+    """
+    Imports a robot class saved by _class_name
+
+    Returns:
+        type: Robot subclass
+    """
+    module_name, _, qualname = name.partition(':')
+    try:
+        cls = importlib.import_module(module_name)
+        for attribute in qualname.split('.'):
+            cls = getattr(cls, attribute)
+    except (ImportError, AttributeError):
+        raise ValueError(f"Robot class {name} of the snapshot is not available.") from None
+    if not (isinstance(cls, type) and issubclass(cls, Robot)):
+        raise ValueError(f"{name} of the snapshot is not a Robot class.")
+    return cls
+
+def _class_section(robots):
+    """
+    Returns:
+        bytes: class table and class index of every robot
+    """
+    names = {} # class name -> index in the table
+    indexes = array('H')
+    for robot in robots:
+        cls = Robot if isinstance(robot, FleetRobot) else type(robot) # fleet views are restored as standalone robots
+        indexes.append(names.setdefault(_class_name(cls), len(names)))
+    parts = [struct.pack('<H', len(names))]
+    for name in names:
+        encoded = name.encode()
+        parts.append(struct.pack('<H', len(encoded)))
+        parts.append(encoded)
+    parts.append(_le_array('H', indexes).tobytes())
+    return b''.join(parts)
+
+def dump_snapshot(board, robots=()):
+    """
+    Serializes a board and its robots into the compact binary snapshot format
+
+    Args:
+        board (Board): Board or SparseBoard object
+        robots (Fleet or list, optional): Fleet or list of Robot objects on the board. Defaults to ().
+
+    Returns:
+        bytes: snapshot data
+    """
+    flags = 0
+    chunk_size = 0
+    if isinstance(board.occupancy, ChunkedOccupancy):
+        flags |= FLAG_SPARSE
+        chunk_size = board.occupancy.chunk_size
+    if isinstance(robots, Fleet):
+        flags |= FLAG_FLEET
+    tile_xs, tile_ys = array('I'), array('I')
+    for x, y in board.occupancy:
+        tile_xs.append(x)
+        tile_ys.append(y)
+    robot_xs, robot_ys, facings = _robot_arrays(robots)
+    parts = [HEADER.pack(MAGIC, VERSION, flags, chunk_size, board.width, board.height, len(tile_xs), len(facings))]
+    for typecode, values in (('I', tile_xs), ('I', tile_ys), ('I', robot_xs), ('I', robot_ys), ('b', facings)):
+        parts.append(_le_array(typecode, values).tobytes())
+    if not flags & FLAG_FLEET:
+        parts.append(_class_section(robots))
+    return b''.join(parts)
+
+def save_snapshot(path, board, robots=()):
+    """
+    Writes a snapshot of a board and its robots to a file
+
+    Args:
+        path (str): snapshot file path
+        board (Board): Board or SparseBoard object
+        robots (Fleet or list, optional): Fleet or list of Robot objects on the board. Defaults to ().
+    """
+    with open(path, 'wb') as snapshot_file:
+        snapshot_file.write(dump_snapshot(board, robots))
+
+
+class SnapshotReader:
+    """
+    Lazy snapshot reader. Only the header is parsed up front; tile and robot sections are exposed
+    as memoryviews over the data (memory-mapped when opened from a file) and decoded on demand.
+    """
+    def __init__(self, data):
+        self._mmap = None
+        if isinstance(data, str):
+            with open(data, 'rb') as snapshot_file:
+                self._mmap = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+            data = self._mmap
+        self.data = memoryview(data)
+        try:
+            self._parse()
+        except BaseException: # release the memory map of a rejected file
+            self.close()
+            raise
+
+    def _parse(self):
+        """
+        Parses the header and locates the sections
+        """
+        if len(self.data) < HEADER.size:
+            raise ValueError("Snapshot is truncated.")
+        magic, version, self.flags, self.chunk_size, self.width, self.height, self.tile_count, self.robot_count = HEADER.unpack_from(self.data)
+        if magic != MAGIC:
+            raise ValueError("Not a robot simulator snapshot.")
+        if version not in SUPPORTED_VERSIONS:
+            raise ValueError(f"Unsupported snapshot version {version}.")
+        offset = HEADER.size
+        self.tile_xs, offset = self._section(offset, 'I', self.tile_count)
+        self.tile_ys, offset = self._section(offset, 'I', self.tile_count)
+        self.robot_xs, offset = self._section(offset, 'I', self.robot_count)
+        self.robot_ys, offset = self._section(offset, 'I', self.robot_count)
+        self.facings, offset = self._section(offset, 'b', self.robot_count)
+        self.class_names = [] # 'module:qualname' of the saved robot classes, empty for fleets and version 1 files
+        self.class_indexes = None
+        if version >= 2 and not self.flags & FLAG_FLEET:
+            class_count, offset = self._unpack('<H', offset)
+            for _ in range(class_count):
+                length, offset = self._unpack('<H', offset)
+                if offset + length > len(self.data):
+                    raise ValueError("Snapshot is truncated.")
+                self.class_names.append(bytes(self.data[offset:offset + length]).decode())
+                offset += length
+            self.class_indexes, offset = self._section(offset, 'H', self.robot_count)
+
+    def _unpack(self, fmt, offset):
+        """
+        Returns:
+            tuple: (single value of the struct format at offset, offset after it)
+        """
+        end = offset + struct.calcsize(fmt)
+        if end > len(self.data):
+            raise ValueError("Snapshot is truncated.")
+        return struct.unpack_from(fmt, self.data, offset)[0], end
+
+    def _section(self, offset, typecode, count):
+        """
+        Returns:
+            tuple: (section view, offset of the next section)
+        """
+        end = offset + count * array(typecode).itemsize
+        if end > len(self.data):
+            raise ValueError("Snapshot is truncated.")
+        view = self.data[offset:end]
+        if sys.byteorder == 'big': # sections are little endian, decode a copy
+            values = array(typecode, view.tobytes())
+            values.byteswap()
+            return values, end
+        return view.cast(typecode), end
+
+    def close(self):
+        """
+        Releases the memory map
+        """
+        for name in ('tile_xs', 'tile_ys', 'robot_xs', 'robot_ys', 'facings', 'class_indexes', 'data'):
+            view = getattr(self, name, None)
+            if isinstance(view, memoryview):
+                view.release()
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def robot_state(self, index):
+        """
+        Random access to one saved robot without decoding the others
+
+        Args:
+            index (int): robot index in the snapshot
+
+        Returns:
+            tuple: (x, y, facing code) or None if the robot was not placed
+        """
+        if self.facings[index] == UNPLACED:
+            return None
+        return self.robot_xs[index], self.robot_ys[index], self.facings[index]
+
+    def restore_board(self):
+        """
+        Builds the board with every saved tile occupied
+
+        Returns:
+            Board: Board or SparseBoard object
+        """
+        if self.flags & FLAG_SPARSE:
+            board = SparseBoard(self.width, self.height, self.chunk_size)
+        else:
+            board = Board(self.width, self.height)
+        occupancy = board.occupancy
+        for x, y in zip(self.tile_xs, self.tile_ys):
+            occupancy.add(x, y)
+        board.occupancy = maybe_promote(occupancy)
+        return board
+
+    def restore_robots(self, board):
+        """
+        Restores the saved robots on a board returned by restore_board
+
+        Args:
+            board (Board): board the robots stand on
+
+        Returns:
+            Fleet or list: Fleet if one was saved, otherwise a list of robots of their saved classes
+        """
+        if self.flags & FLAG_FLEET:
+            fleet = Fleet(board)
+            fleet.xs.frombytes(self.robot_xs.tobytes())
+            fleet.ys.frombytes(self.robot_ys.tobytes())
+            fleet.facings.frombytes(self.facings.tobytes())
+            return fleet
+        classes = [_find_class(name) for name in self.class_names]
+        robots = []
+        for index in range(self.robot_count):
+            robot = Robot() if self.class_indexes is None else classes[self.class_indexes[index]]()
+            state = self.robot_state(index)
+            if state is not None:
+                robot.board = board
+                robot.x_axis, robot.y_axis = state[0], state[1]
+                robot.facing_code = state[2]
+            robots.append(robot)
+        return robots
+
+def load_snapshot(source):
+    """
+    Restores a board and its robots from a snapshot file or bytes
+
+    Args:
+        source (str or bytes): snapshot file path or snapshot data
+
+    Returns:
+        tuple: (board, robots) where robots is a Fleet or a list of Robot objects
+    """
+    with SnapshotReader(source) as reader:
+        board = reader.restore_board()
+        return board, reader.restore_robots(board)
@@ -0,0 +1,52 @@
+import logging
+
+from board import Board
+from occupancy import ChunkedOccupancy
+
+logger = logging.getLogger(__name__)
+
+# largest number of tiles get_board_state/get_board_rows will render for a sparse board
+MAX_RENDER_TILES = 1 << 24
+
+class SparseBoard(Board):
+    """
+    A Board for very large or rectangular tables. Occupancy is stored in chunks allocated on demand
+    so memory scales with the occupied area, not the table area. Works with Robot.place/move unchanged.
+    """
+    def __init__(self, width, height=None, chunk_size=64):
+        height = width if height is None else height
+        super().__init__(width, height, ChunkedOccupancy(width, height, chunk_size))
+
+    def _get_grid(self):
+        """
+        Builds a full grid like Board does, but refuses tables too large to render.
+
+        Returns:
+            list: list of bytearray rows, top row first
+        """
+        if self._grid is None and self.width * self.height > MAX_RENDER_TILES:
+            raise ValueError("Board is too large to render. Use get_board_window instead.")
+        return Board._get_grid(self)
+
+    def get_board_window(self, x, y, radius):
+        """
+        Returns the state of the tiles around x,y only, clipped to the board. Reads the chunks directly
+        so it never builds the full grid.
+
+        Args:
+            x (int): x axis value of the window center
+            y (int): y axis value of the window center
+            radius (int): number of tiles to include on each side of the center
+
+        Returns:
+            list: list of lists containing data state of the window, top row first
+        """
+        if self._grid is not None:
+            return Board.get_board_window(self, x, y, radius)
+        min_x = max(x - radius, 0)
+        max_x = min(x + radius, self.max_x)
+        contains = self.occupancy.contains
+        return [
+            [1 if contains(x_axis, y_axis) else 0 for x_axis in range(min_x, max_x + 1)]
+            for y_axis in range(min(y + radius, self.max_y), max(y - radius, 0) - 1, -1)
+        ]
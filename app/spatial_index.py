@@ -0,0 +1,308 @@
+import heapq
+import logging
+from array import array
+
+logger = logging.getLogger(__name__)
+
+# bucket grids with more buckets than this (e.g. huge sparse boards) answer rectangle counts without a Fenwick tree
+MAX_TABLE_BUCKETS = 1 << 22
+
+
+class SpatialIndex:
+    """
+    Neighbourhood queries over the occupied tiles of a board (robots and obstacles alike).
+    Tiles are kept in a uniform grid of square buckets, each a set of packed keys (y * width + x), updated through the
+    board tile listeners. Rectangle counts use a 2D Fenwick tree of bucket counts, built on the first count. Tile
+    changes are netted per bucket and applied to the tree in O(log^2 B) each on the next count, so the covered interior
+    of a rectangle costs O(log^2 B) and only the buckets on its edges are scanned.
+    """
+    def __init__(self, board, bucket_size=16):
+        if bucket_size <= 0 or bucket_size & (bucket_size - 1):
+            raise ValueError("bucket_size must be a power of two.")
+        self.board = board
+        self.width = board.max_x + 1
+        self.height = board.max_y + 1
+        self.shift = bucket_size.bit_length() - 1
+        self.bucket_size = bucket_size
+        self.columns = (self.width + bucket_size - 1) >> self.shift
+        self.rows = (self.height + bucket_size - 1) >> self.shift
+        self.buckets = {} # bucket key -> set of packed tile keys
+        self._tree = None # 2D Fenwick tree of bucket counts, None until the first rectangle count
+        self._pending = {} # bucket key -> count change not applied to the tree yet
+        for x, y in board.occupancy:
+            self._add(x, y)
+        board.tile_listeners.append(self.tile_changed)
+
+    def _add(self, x, y):
+        """
+        Returns:
+            Bool: True if the tile was not indexed yet
+        """
+        bucket_key = (y >> self.shift) * self.columns + (x >> self.shift)
+        bucket = self.buckets.get(bucket_key)
+        if bucket is None:
+            bucket = self.buckets[bucket_key] = set()
+        key = y * self.width + x
+        if key in bucket:
+            return False
+        bucket.add(key)
+        return True
+
+    def tile_changed(self, x, y, occupied):
+        """
+        Board tile listener keeping the buckets in sync
+
+        Args:
+            x (int): x axis value
+            y (int): y axis value
+            occupied (int): 1 if the tile is now occupied, 0 if it is now empty
+        """
+        if occupied:
+            if self._add(x, y) and self._tree is not None:
+                bucket_key = (y >> self.shift) * self.columns + (x >> self.shift)
+                self._pending[bucket_key] = self._pending.get(bucket_key, 0) + 1
+            return
+        bucket_key = (y >> self.shift) * self.columns + (x >> self.shift)
+        bucket = self.buckets.get(bucket_key)
+        key = y * self.width + x
+        if bucket is not None and key in bucket:
+            bucket.remove(key)
+            if not bucket:
+                del self.buckets[bucket_key]
+            if self._tree is not None:
+                self._pending[bucket_key] = self._pending.get(bucket_key, 0) - 1
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self.buckets.values())
+
+    def _bucket_tiles(self, column, row):
+        """
+        Yields:
+            tuple: (x, y) of every occupied tile in one bucket
+        """
+        width = self.width
+        for key in self.buckets.get(row * self.columns + column, ()):
+            yield key % width, key // width
+
+    def _count_partial(self, column, row, x0, y0, x1, y1):
+        """
+        Counts the occupied tiles of one bucket inside a rectangle, scanning either the bucket's tiles or the
+        overlapping tiles of the board, whichever is fewer
+
+        Returns:
+            int: occupied tile count
+        """
+        bucket = self.buckets.get(row * self.columns + column)
+        if not bucket:
+            return 0
+        left = max(x0, column << self.shift)
+        right = min(x1, ((column + 1) << self.shift) - 1)
+        bottom = max(y0, row << self.shift)
+        top = min(y1, ((row + 1) << self.shift) - 1)
+        if left > right or bottom > top:
+            return 0
+        width = self.width
+        if (right - left + 1) * (top - bottom + 1) < len(bucket):
+            return sum(1 for y in range(bottom, top + 1) for x in range(left, right + 1) if y * width + x in bucket)
+        return sum(1 for key in bucket if left <= key % width <= right and bottom <= key // width <= top)
+
+    def _tree_add(self, row, column, delta):
+        """
+        Adds delta to the count of one bucket in the Fenwick tree
+        """
+        tree = self._tree
+        stride = self.columns + 1
+        row += 1
+        while row <= self.rows:
+            index = column + 1
+            base = row * stride
+            while index <= self.columns:
+                tree[base + index] += delta
+                index += index & -index
+            row += row & -row
+
+    def _tree_prefix(self, row, column):
+        """
+        Returns:
+            int: occupied tiles in the buckets of rows 0..row - 1 and columns 0..column - 1
+        """
+        tree = self._tree
+        stride = self.columns + 1
+        total = 0
+        while row > 0:
+            index = column
+            base = row * stride
+            while index > 0:
+                total += tree[base + index]
+                index -= index & -index
+            row -= row & -row
+        return total
+
+    def _build_tree(self):
+        """
+        Returns:
+            array: (rows + 1) x (columns + 1) Fenwick tree of bucket counts, or None if the grid is too large
+        """
+        if self._tree is None and self.rows * self.columns <= MAX_TABLE_BUCKETS:
+            self._tree = array('i', [0]) * ((self.rows + 1) * (self.columns + 1))
+            for bucket_key, bucket in self.buckets.items():
+                row, column = divmod(bucket_key, self.columns)
+                self._tree_add(row, column, len(bucket))
+        elif self._pending:
+            # moves inside one bucket cancel out, only the net changes reach the tree
+            for bucket_key, delta in self._pending.items():
+                if delta:
+                    row, column = divmod(bucket_key, self.columns)
+                    self._tree_add(row, column, delta)
+            self._pending.clear()
+        return self._tree
+
+    def count_rect(self, x0, y0, x1, y1):
+        """
+        Number of occupied tiles in a rectangle, corners included. The rectangle is clipped to the board.
+
+        Args:
+            x0 (int): left x axis value
+            y0 (int): bottom y axis value
+            x1 (int): right x axis value
+            y1 (int): top y axis value
+
+        Returns:
+            int: occupied tile count
+        """
+        x0, y0 = max(x0, 0), max(y0, 0)
+        x1, y1 = min(x1, self.width - 1), min(y1, self.height - 1)
+        if x0 > x1 or y0 > y1:
+            return 0
+        shift = self.shift
+        size = self.bucket_size
+        # buckets fully inside the rectangle
+        inner_c0 = (x0 + size - 1) >> shift
+        inner_r0 = (y0 + size - 1) >> shift
+        inner_c1 = ((x1 + 1) >> shift) - 1
+        inner_r1 = ((y1 + 1) >> shift) - 1
+        has_inner = inner_c0 <= inner_c1 and inner_r0 <= inner_r1
+        tree = self._build_tree()
+        count = 0
+        if tree is None: # walk the occupied buckets instead
+            for bucket_key, bucket in self.buckets.items():
+                row, column = divmod(bucket_key, self.columns)
+                if has_inner and inner_c0 <= column <= inner_c1 and inner_r0 <= row <= inner_r1:
+                    count += len(bucket)
+                else:
+                    count += self._count_partial(column, row, x0, y0, x1, y1)
+            return count
+        if has_inner:
+            prefix = self._tree_prefix
+            count = (prefix(inner_r1 + 1, inner_c1 + 1) - prefix(inner_r0, inner_c1 + 1)
+                     - prefix(inner_r1 + 1, inner_c0) + prefix(inner_r0, inner_c0))
+        for row in range(y0 >> shift, (y1 >> shift) + 1):
+            for column in range(x0 >> shift, (x1 >> shift) + 1):
+                if has_inner and inner_c0 <= column <= inner_c1 and inner_r0 <= row <= inner_r1:
+                    continue
+                count += self._count_partial(column, row, x0, y0, x1, y1)
+        return count
+
+    def query_range(self, x, y, radius):
+        """
+        Occupied tiles within a Euclidean radius of x,y, the center tile included
+
+        Args:
+            x (int): x axis value
+            y (int): y axis value
+            radius (int): search radius in tiles
+
+        Returns:
+            list: (x, y) tuples sorted by distance, then y, then x
+        """
+        shift = self.shift
+        limit = radius * radius
+        found = []
+        for row in range(max(y - radius, 0) >> shift, (min(y + radius, self.height - 1) >> shift) + 1):
+            for column in range(max(x - radius, 0) >> shift, (min(x + radius, self.width - 1) >> shift) + 1):
+                for tile_x, tile_y in self._bucket_tiles(column, row):
+                    distance = (tile_x - x) ** 2 + (tile_y - y) ** 2
+                    if distance <= limit:
+                        found.append((distance, tile_y, tile_x))
+        found.sort()
+        return [(tile_x, tile_y) for distance, tile_y, tile_x in found]
+
+    def nearest(self, x, y, k=1):
+        """
+        The k occupied tiles closest to x,y by Euclidean distance, not counting x,y itself.
+        Buckets are searched in rings around x,y until no closer tile can be found. Once the rings cover more
+        buckets than there are occupied buckets, the remaining occupied buckets are scanned directly instead.
+
+        Args:
+            x (int): x axis value
+            y (int): y axis value
+            k (int, optional): number of tiles. Defaults to 1.
+
+        Returns:
+            list: up to k (x, y) tuples sorted by distance, then y, then x
+        """
+        shift = self.shift
+        center_column, center_row = x >> shift, y >> shift
+        best = [] # max-heap of the k closest as (-distance, -y, -x)
+
+        def visit(column, row):
+            for tile_x, tile_y in self._bucket_tiles(column, row):
+                if tile_x == x and tile_y == y:
+                    continue
+                entry = (-((tile_x - x) ** 2 + (tile_y - y) ** 2), -tile_y, -tile_x)
+                if len(best) < k:
+                    heapq.heappush(best, entry)
+                elif entry > best[0]:
+                    heapq.heapreplace(best, entry)
+
+        max_ring = max(center_column, self.columns - 1 - center_column, center_row, self.rows - 1 - center_row)
+        for ring in range(max_ring + 1):
+            if len(best) == k:
+                # tiles in this ring are at least (ring - 1) buckets away
+                gap = (ring - 1) * self.bucket_size + 1
+                if gap > 0 and gap * gap > -best[0][0]:
+                    break
+            if (2 * ring + 1) ** 2 > len(self.buckets): # more buckets searched than occupied, scan the occupied ones left
+                columns = self.columns
+                for bucket_key in list(self.buckets):
+                    column, row = bucket_key % columns, bucket_key // columns
+                    if max(abs(column - center_column), abs(row - center_row)) >= ring:
+                        visit(column, row)
+                break
+            for row in range(center_row - ring, center_row + ring + 1):
+                if not 0 <= row < self.rows:
+                    continue
+                on_edge = row in (center_row - ring, center_row + ring)
+                columns = range(center_column - ring, center_column + ring + 1) if on_edge else (center_column - ring, center_column + ring)
+                for column in columns:
+                    if 0 <= column < self.columns:
+                        visit(column, row)
+        return [(-tile_x, -tile_y) for distance, tile_y, tile_x in sorted(best, reverse=True)]
+
+    def nearest_free(self, x, y):
+        """
+        The empty tile closest to x,y by Euclidean distance, x,y itself included
+
+        Args:
+            x (int): x axis value
+            y (int): y axis value
+
+        Returns:
+            tuple: (x, y) or None if the board is full
+        """
+        contains = self.board.occupancy.contains
+        best = None
+        max_ring = max(x, self.width - 1 - x, y, self.height - 1 - y)
+        for ring in range(max_ring + 1):
+            if best is not None and ring * ring > best[0]:
+                break
+            for tile_y in range(y - ring, y + ring + 1):
+                if not 0 <= tile_y < self.height:
+                    continue
+                on_edge = tile_y in (y - ring, y + ring)
+                for tile_x in (range(x - ring, x + ring + 1) if on_edge else (x - ring, x + ring)):
+                    if 0 <= tile_x < self.width and not contains(tile_x, tile_y):
+                        entry = ((tile_x - x) ** 2 + (tile_y - y) ** 2, tile_y, tile_x)
+                        if best is None or entry < best:
+                            best = entry
+        return None if best is None else (best[2], best[1])
@@ -1,51 +1,118 @@
+import argparse
 import logging
+import sys
 
+import instrumentation
+import journal
+from batch_runner import COMMAND_HANDLERS, UNPLACED_OPCODES, iter_reports
+from command_parser import OP_REPEAT, block_depth, compile_command
 from board import Board
+from event_stream import iter_events, open_sink
 from robot import Robot
 
-logger = logging.getLogger() 
+logger = logging.getLogger(__name__)
+
+# module loggers silenced by quiet mode
+QUIET_LOGGERS = ('board', 'robot', 'batch_runner', 'command_parser', 'fleet', 'step_engine', 'path_planner', 'distance_field',
+                 'scheduler', 'journal', 'instrumentation', 'macros', 'sharded_fleet',
+                 __name__)
+
+def set_quiet_mode(enabled=True):
+    """
+    Quiet/fast mode. Silences the simulator module loggers so no log records are created per command.
+    Use events.add_hook to collect telemetry instead.
+
+    Args:
+        enabled (bool, optional): turn quiet mode on or off. Defaults to True.
+    """
+    level = logging.CRITICAL if enabled else logging.NOTSET
+    for name in QUIET_LOGGERS:
+        logging.getLogger(name).setLevel(level)
 
 def run_command(command, board, robot):
     """
     Runs a command provided a robot and board class object
 
     Args:
-        command (str): command to run
+        command (str): command to run, several lines when a block spans them
         board (Board): Board object
         robot (Robot): Robot object
 
     Returns:
         Bool: True / False / 'Exit'
     """
-    command = command.upper()
-    if command == 'EXIT':
-        return 'EXIT'
-    elif 'PLACE' in command:
-        try:
-            place_commands = command.replace(' ','').replace('PLACE','').split(',')
-            x = place_commands[0]
-            y = place_commands[1]
-            f = place_commands[2]
-            return robot.place(x, y, f, board)
-        except Exception as e:
-            # logger.error(f"Exception: {e}")
-            logger.error("Invalid PLACE command. Please use the following command pattern: 'PLACE x,y,f'")
-            return False
-    elif robot.board is None:
-        logger.warning("Robot not yet placed on the board. Ignoring command.")
+    instruction, error = compile_command(command)
+    if error is not None:
+        if error.usage is not None:
+            logger.error("Invalid command (%s). Please use the following command pattern: '%s'", error, error.usage)
+        else:
+            logger.error("Invalid command (%s). Please try again.", error)
         return False
-    elif command in ('LEFT','RIGHT'):
-        robot.rotate(command)
-    elif command == 'MOVE':
-        robot.move()
-    elif command == 'REPORT':
-        return robot.report()
-    else:
-        logger.error("Invalid command. Please try again.")
+    elif instruction is None:
+        logger.error("Empty command. Please try again.")
         return False
+    if journal.writers:
+        journal.record(instruction, board, robot)
+    opcode, x, y, f = instruction
+    if robot.board is None and opcode not in UNPLACED_OPCODES:
+        logger.warning("Robot not yet placed on the board. Ignoring command.")
+        return False
+    result = COMMAND_HANDLERS[opcode](board, robot, x, y, f)
+    if opcode == OP_REPEAT:
+        return '\n'.join(result) if result else None
+    return result
+
+def run_batch_file(path, size=5, journal_path=None, events_path=None):
+    """
+    Runs every command in a file (or stdin when path is '-') on a fresh board and robot, printing REPORT outputs
+
+    Args:
+        path (str): path to the command file or '-' for stdin
+        size (int, optional): board size. Defaults to 5.
+        journal_path (str, optional): record the commands in a journal file. Defaults to None.
+        events_path (str, optional): stream every event to this file instead of printing REPORT outputs.
+            Defaults to None.
+    """
+    board = Board(size)
+    robot = Robot()
+    command_journal = journal.Journal(journal_path, board, [robot]) if journal_path else None
+    command_file = sys.stdin if path == '-' else open(path)
+    try:
+        if events_path is not None:
+            with open_sink(events_path) as sink:
+                sink.consume(iter_events(command_file, board, robot))
+        else:
+            for report in iter_reports(command_file, board, robot):
+                print(report)
+    finally:
+        if command_file is not sys.stdin:
+            command_file.close()
+        if command_journal is not None:
+            command_journal.close()
 
 if __name__ == "__main__":    
-    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+    parser = argparse.ArgumentParser(description="Toy robot simulator")
+    parser.add_argument('--batch', metavar='FILE', help="run commands from FILE ('-' for stdin) and print REPORT outputs only")
+    parser.add_argument('--size', type=int, default=5, help="board size used in batch mode")
+    parser.add_argument('--journal', metavar='FILE', help="record every command in a binary journal FILE")
+    parser.add_argument('--events', metavar='FILE', help="in batch mode, write every event to FILE instead of printing "
+                        "REPORT outputs (NDJSON if FILE ends with .ndjson or .jsonl, CSV for .csv, binary otherwise)")
+    parser.add_argument('--stats', metavar='FILE', help="time commands and board operations and write them to FILE on exit "
+                        "(JSON if FILE ends with .json, Prometheus text otherwise)")
+    args = parser.parse_args()
+    if args.stats:
+        instrumentation.enable()
+    if args.batch:
+        logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
+        set_quiet_mode()
+        try:
+            run_batch_file(args.batch, args.size, args.journal, args.events)
+        finally:
+            if args.stats:
+                instrumentation.export(args.stats)
+        sys.exit(0)
+
+    logging.basicConfig(level=logging.DEBUG, format='%(levelname)s: %(message)s') # DEBUG also prints the board on REPORT
     print('#################################################################')
     print("#              Welcome to the toy robot simulator!              #")
     print('#################################################################\n')
@@ -64,20 +131,39 @@ if __name__ == "__main__":
                x = x-axis where to place the robot
                y = y-axis where to place the robot
                f = robot facing orientation (NORTH, EAST, WEST, SOUTH)
-        > MOVE
-            - Move one tile where robot is facing
+        > MOVE [n]
+            - Move one tile (or n tiles) where robot is facing
+            - Stops at the board edge or before an obstruction
         > LEFT
             - Rotate robot to the left
         > RIGHT
             - Rotate robot to the right
         > REPORT
             - Print current state of robot in x,y,f format
+        > GOTO x,y[,f]
+            - Move the robot to x,y along the shortest path around obstructions
+            - Optionally end facing f
+        > DISTANCE x,y
+            - Print the number of moves from the robot to x,y around obstructions (-1 if unreachable)
+        > STATS
+            - Print command and board timings (start with --stats FILE to enable them)
+        > REPEAT k { commands }
+            - Run the commands k times, separated by ';' or new lines (EXIT is not allowed)
         > EXIT
             - Exit application        
         -----------------------------------------------------------------
         """.replace('        ',''))
+    command_journal = journal.Journal(args.journal, b1, [r1]) if args.journal else None
     robot_command = None
-    while robot_command != 'EXIT':
-        print("-----------------------------------------------------------------")
-        inp = input("Please enter command: ")
-        robot_command = run_command(inp, b1, r1)
+    try:
+        while robot_command != 'EXIT':
+            print("-----------------------------------------------------------------")
+            inp = input("Please enter command: ")
+            while block_depth(inp) > 0: # a block continues on the next lines until it is closed
+                inp += '\n' + input("... ")
+            robot_command = run_command(inp, b1, r1)
+    finally:
+        if command_journal is not None:
+            command_journal.close()
+        if args.stats:
+            instrumentation.export(args.stats)
@@ -0,0 +1,230 @@
+import logging
+from operator import itemgetter
+
+import events
+from command_parser import OP_MOVE, OP_LEFT, OP_RIGHT
+from fleet import FleetRobot, UNPLACED, numpy
+from occupancy import BitmapOccupancy
+
+logger = logging.getLogger(__name__)
+
+# opcode of a robot that gets no command this tick
+OP_NONE = -1
+
+def step_scalar(fleet, ops):
+    """
+    Applies one tick of commands robot by robot in ascending robot id order. This is the reference behaviour.
+
+    Args:
+        fleet (Fleet): Fleet object
+        ops (sequence): one opcode per robot id (OP_MOVE, OP_LEFT, OP_RIGHT or OP_NONE)
+    """
+    facings = fleet.facings
+    for robot_id, opcode in enumerate(ops):
+        if opcode == OP_NONE or facings[robot_id] == UNPLACED:
+            continue
+        robot = fleet.robot(robot_id)
+        if opcode == OP_MOVE:
+            robot.move()
+        elif opcode == OP_LEFT:
+            robot.rotate('LEFT')
+        elif opcode == OP_RIGHT:
+            robot.rotate('RIGHT')
+
+def _occupied(occupancy, keys, valid):
+    """
+    Vectorized occupancy lookup for packed keys
+
+    Args:
+        occupancy (SetOccupancy or BitmapOccupancy): board occupancy index
+        keys (numpy.ndarray): packed tile keys
+        valid (numpy.ndarray): mask of keys that are inside the board
+
+    Returns:
+        numpy.ndarray: boolean mask of occupied tiles
+    """
+    safe_keys = numpy.where(valid, keys, 0)
+    if isinstance(occupancy, BitmapOccupancy):
+        bits = numpy.frombuffer(occupancy.bits, dtype=numpy.uint8)
+        return valid & (((bits[safe_keys >> 3] >> (safe_keys & 7)) & 1) == 1)
+    width = occupancy.width
+    found = numpy.fromiter((occupancy.contains(key % width, key // width) for key in safe_keys.tolist()), dtype=bool, count=len(safe_keys))
+    return valid & found
+
+def _resolve_moves(old_keys, new_keys, in_bounds, occupied):
+    """
+    Decides which movers succeed so that the outcome equals moving them one by one in ascending robot id order.
+    A mover fails when its target is off the board, holds a static obstruction, holds a later mover that has not
+    moved yet, holds an earlier mover that failed, or was already taken by an earlier mover.
+
+    Args:
+        old_keys (numpy.ndarray): packed current tiles of the movers, in robot id order
+        new_keys (numpy.ndarray): packed target tiles of the movers
+        in_bounds (numpy.ndarray): mask of targets inside the board
+        occupied (numpy.ndarray): mask of targets occupied before the tick
+
+    Returns:
+        numpy.ndarray: boolean mask of successful movers
+    """
+    count = len(old_keys)
+    index = numpy.arange(count)
+
+    # mover currently standing on each target tile, if any
+    old_order = numpy.argsort(old_keys)
+    sorted_old = old_keys[old_order]
+    position = numpy.minimum(numpy.searchsorted(sorted_old, new_keys), count - 1)
+    has_blocker = in_bounds & (sorted_old[position] == new_keys)
+    blocker = numpy.where(has_blocker, old_order[position], 0)
+
+    basic = in_bounds & ~(occupied & ~has_blocker) & ~(has_blocker & (blocker > index))
+
+    # movers grouped by target tile. All movers of a group share the target and so the blocker, which means only the
+    # lowest robot id that passes the basic checks can win the tile, and it wins when the blocker moved away.
+    group_order = numpy.lexsort((index, new_keys))
+    sorted_new = new_keys[group_order]
+    group_start = numpy.ones(count, dtype=bool)
+    group_start[1:] = sorted_new[1:] != sorted_new[:-1]
+    group_id = numpy.empty(count, dtype=numpy.int64)
+    group_id[group_order] = numpy.cumsum(group_start) - 1
+    groups = int(group_id[group_order[-1]]) + 1
+    winner = numpy.full(groups, count, dtype=numpy.int64) # lowest basic mover of each group, count when there is none
+    numpy.minimum.at(winner, group_id[basic], index[basic])
+    is_winner = basic & (winner[group_id] == index)
+
+    # A group is clear when its target has no blocker, blocked when the blocker is not the winner of its own group,
+    # and otherwise as clear as the blocker's group. Blockers have lower robot ids than the winners waiting on them, so
+    # these links form chains, resolved by pointer jumping in O(log n) rounds instead of one link per pass.
+    group_blocker = numpy.zeros(groups, dtype=numpy.int64)
+    group_has_blocker = numpy.zeros(groups, dtype=bool)
+    group_blocker[group_id] = blocker
+    group_has_blocker[group_id] = has_blocker
+    parent = group_id[group_blocker]
+    clear = ~group_has_blocker
+    resolved = clear | ~is_winner[group_blocker]
+    parent[resolved] = numpy.flatnonzero(resolved)
+    while not resolved.all():
+        parent_clear = clear[parent]
+        parent_resolved = resolved[parent]
+        clear = numpy.where(resolved, clear, parent_clear)
+        parent = numpy.where(resolved, parent, parent[parent])
+        resolved = resolved | parent_resolved
+    return is_winner & clear[group_id]
+
+def _move_movers(board, xs, ys, facings, movers):
+    """
+    Moves the fleet robots that got a MOVE command this tick, in place on the fleet arrays and the board occupancy
+
+    Args:
+        board (Board): board of the fleet
+        xs (numpy.ndarray): fleet x view
+        ys (numpy.ndarray): fleet y view
+        facings (numpy.ndarray): fleet facing view
+        movers (numpy.ndarray): ids of the moving robots, ascending
+
+    Returns:
+        tuple: (old_x, old_y, new_x, new_y, success) arrays per mover
+    """
+    codes = facings[movers]
+    old_x = xs[movers].astype(numpy.int64)
+    old_y = ys[movers].astype(numpy.int64)
+    new_x = old_x + numpy.array(FleetRobot.DX, dtype=numpy.int64)[codes]
+    new_y = old_y + numpy.array(FleetRobot.DY, dtype=numpy.int64)[codes]
+    in_bounds = (new_x >= 0) & (new_x <= board.max_x) & (new_y >= 0) & (new_y <= board.max_y)
+
+    width = board.max_x + 1
+    old_keys = old_y * width + old_x
+    new_keys = numpy.where(in_bounds, new_y * width + new_x, -1)
+    success = _resolve_moves(old_keys, new_keys, in_bounds, _occupied(board.occupancy, new_keys, in_bounds))
+
+    vacated = old_keys[success]
+    taken = new_keys[success]
+    occupancy = board.occupancy
+    if isinstance(occupancy, BitmapOccupancy):
+        bits = numpy.frombuffer(occupancy.bits, dtype=numpy.uint8)
+        occupancy.begin_write()
+        numpy.bitwise_and.at(bits, vacated >> 3, ~(numpy.left_shift(1, vacated & 7)).astype(numpy.uint8))
+        numpy.bitwise_or.at(bits, taken >> 3, numpy.left_shift(1, taken & 7).astype(numpy.uint8))
+        occupancy.end_write()
+        del bits # a view of a shared bitmap would keep its memory map open
+    else:
+        for key in vacated.tolist():
+            occupancy.discard(key % width, key // width)
+        for key in taken.tolist():
+            occupancy.add(key % width, key // width)
+    board.sync_tiles(vacated.tolist(), taken.tolist()) # keep the cached board state and listeners in sync
+
+    board.version += 1
+    moved = movers[success]
+    xs[moved] = new_x[success]
+    ys[moved] = new_y[success]
+    return old_x, old_y, new_x, new_y, success
+
+def _emit_tick(fleet, turned, turned_codes, movers, moves):
+    """
+    Emits the ROTATED, MOVED and BLOCKED events step_scalar would have emitted for a tick, in robot id order
+
+    Args:
+        fleet (Fleet): Fleet object
+        turned (numpy.ndarray): ids of the robots that turned
+        turned_codes (numpy.ndarray): their facing codes before the turn
+        movers (numpy.ndarray): ids of the robots that got a MOVE command
+        moves (tuple): result of _move_movers, or None without movers
+    """
+    facing_names = FleetRobot.FACINGS
+    facings = fleet.facings
+    tick_events = [(robot_id, events.ROTATED, facing_names[code], facing_names[facings[robot_id]])
+                   for robot_id, code in zip(turned.tolist(), turned_codes.tolist())]
+    if moves is not None:
+        old_x, old_y, new_x, new_y, success = (values.tolist() for values in moves)
+        for robot_id, from_x, from_y, to_x, to_y, moved in zip(movers.tolist(), old_x, old_y, new_x, new_y, success):
+            if moved:
+                tick_events.append((robot_id, events.MOVED, from_x, from_y, to_x, to_y))
+            else:
+                tick_events.append((robot_id, events.BLOCKED, to_x, to_y))
+    tick_events.sort(key=itemgetter(0))
+    for event in tick_events:
+        events.emit((event[1], fleet.robot(event[0])) + event[2:])
+
+def step_numpy(fleet, ops):
+    """
+    Applies one tick of commands to the whole fleet with NumPy array operations.
+    The result is the same as step_scalar, events included when hooks are registered.
+
+    Args:
+        fleet (Fleet): Fleet object
+        ops (sequence): one opcode per robot id (OP_MOVE, OP_LEFT, OP_RIGHT or OP_NONE)
+    """
+    if len(ops) != len(fleet):
+        raise ValueError(f"Got {len(ops)} opcodes for {len(fleet)} robots.")
+    if len(fleet) == 0:
+        return
+    xs, ys, facings = fleet.as_numpy()
+    ops = numpy.asarray(ops, dtype=numpy.int8)
+    placed = facings != UNPLACED
+
+    emitting = bool(events.hooks)
+    if emitting: # events are built from the masks once the tick is applied
+        turned = numpy.flatnonzero(placed & ((ops == OP_LEFT) | (ops == OP_RIGHT)))
+        turned_codes = facings[turned]
+    for opcode, table in ((OP_LEFT, FleetRobot.LEFT), (OP_RIGHT, FleetRobot.RIGHT)):
+        turning = placed & (ops == opcode)
+        facings[turning] = numpy.array(table, dtype=numpy.int8)[facings[turning]]
+
+    movers = numpy.flatnonzero(placed & (ops == OP_MOVE))
+    moves = _move_movers(fleet.board, xs, ys, facings, movers) if movers.size else None
+    del xs, ys, facings # release the views before hooks run
+    if emitting:
+        _emit_tick(fleet, turned, turned_codes, movers, moves)
+
+def step(fleet, ops):
+    """
+    Applies one tick of commands to the whole fleet. Uses NumPy when installed, otherwise falls back to step_scalar.
+
+    Args:
+        fleet (Fleet): Fleet object
+        ops (sequence): one opcode per robot id (OP_MOVE, OP_LEFT, OP_RIGHT or OP_NONE)
+    """
+    if numpy is None:
+        step_scalar(fleet, ops)
+    else:
+        step_numpy(fleet, ops)